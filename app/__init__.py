@@ -1,6 +1,9 @@
 from flask import Flask
 from flask_cors import CORS
 import os
+from app.jobs import create_job_queue
+from app.session_store import create_session_store
+from app.result_cache import create_result_cache
 
 def create_app():
     app = Flask(__name__)
@@ -8,12 +11,29 @@ def create_app():
     
     app.config['UPLOAD_FOLDER'] = 'app/uploads'
     app.config['RESULTS_FOLDER'] = 'app/results'
-    app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+    app.config['MAX_CONTENT_LENGTH'] = 1024 * 1024 * 1024  # 1GB: el FASTA se copia a disco por bloques
+    app.config['ALIGN_PROCESSES'] = None  # Procesos para alinear pares (None = todos los núcleos)
+    app.config['BOOTSTRAP_PROCESSES'] = None  # Procesos para las réplicas bootstrap (None = todos los núcleos)
+    app.config['JOB_WORKERS'] = 2  # Trabajos asíncronos (align/build_tree) ejecutándose a la vez
+    app.config['JOB_BACKEND'] = 'process'  # 'process' (pool de procesos) o 'thread'
+    app.config['SESSION_BACKEND'] = 'sqlite'  # 'sqlite' (disco, compartido entre procesos) o 'memory'
+    app.config['SESSION_DB'] = 'app/sessions/sessions.db'
+    app.config['SESSION_BLOB_FOLDER'] = 'app/sessions/data'  # Secuencias, alineamientos y árboles de cada sesión
+    app.config['SESSION_TTL'] = 24 * 3600  # Segundos sin uso antes de eliminar una sesión
+    app.config['MAX_SESSIONS'] = 1000  # Al superarlo se eliminan las sesiones usadas hace más tiempo
+    app.config['RESULT_CACHE_FOLDER'] = 'app/cache'  # Alineamientos, distancias y árboles reutilizables
+    app.config['RESULT_CACHE_MAX_BYTES'] = 2 << 30  # Tamaño máximo de la caché (0 = desactivada)
     app.secret_key = 'clave-secreta-123'
     
     # Crear directorios necesarios
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
     os.makedirs(app.config['RESULTS_FOLDER'], exist_ok=True)
+    
+    # Sesiones y cola de trabajos local (el pool se crea con el primer trabajo;
+    # con sesiones en SQLite el estado de los trabajos se guarda en la misma base)
+    app.extensions['sessions'] = create_session_store(app.config)
+    app.extensions['jobs'] = create_job_queue(app.config)
+    app.extensions['result_cache'] = create_result_cache(app.config)
 
     from app.routes import main
     app.register_blueprint(main)
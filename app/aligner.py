@@ -1,40 +1,651 @@
-def needleman_wunsch(seq1, seq2, match=1, mismatch=-1, gap=-2):
-    n, m = len(seq1), len(seq2)
-    score = [[0]*(m+1) for _ in range(n+1)]
-    trace = [['']*(m+1) for _ in range(n+1)]
-
-    for i in range(n+1):
-        score[i][0] = i * gap
-        trace[i][0] = 'U'
-    for j in range(m+1):
-        score[0][j] = j * gap
-        trace[0][j] = 'L'
-    trace[0][0] = '0'
-
-    for i in range(1, n+1):
-        for j in range(1, m+1):
-            diag = score[i-1][j-1] + (match if seq1[i-1]==seq2[j-1] else mismatch)
-            up = score[i-1][j] + gap
-            left = score[i][j-1] + gap
-            best = max(diag, up, left)
-            score[i][j] = best
-            trace[i][j] = 'D' if best==diag else 'U' if best==up else 'L'
-
-    aln1, aln2 = "", ""
+import numpy as np
+from app.scoring import get_scoring_scheme
+
+# Número máximo de celdas (n+1)*(m+1) para el que se guarda la matriz de
+# traceback completa; por encima se usa Hirschberg en espacio lineal.
+MAX_CELLS = 1 << 26
+
+# Semiancho inicial de la banda (en diagonales) para el alineamiento con banda
+BAND_WIDTH = 16
+
+# Veces que se puede duplicar la banda; si hace falta más, las secuencias
+# son divergentes y se usa el alineamiento completo (exacto)
+MAX_BAND_DOUBLINGS = 1
+
+# Un par cuyo puntaje con banda queda por debajo de esta fracción del
+# máximo posible (mejor sustitución x largo de la secuencia corta) se
+# considera divergente y se alinea completo
+DIVERGENT_SCORE = 0.5
+
+# Códigos de dirección del traceback (2 bits por celda)
+DIAG, UP, LEFT = 0, 1, 2
+
+
+def needleman_wunsch(seq1, seq2, match=1, mismatch=-1, gap=-2, max_cells=None,
+                     scoring=None):
+    """
+    Alineamiento global Needleman-Wunsch vectorizado por filas con NumPy.
+
+    Devuelve (aln1, aln2, score) igual que la implementación original. Si la
+    matriz supera `max_cells` celdas se usa Hirschberg (memoria lineal), que
+    obtiene el mismo puntaje óptimo aunque ante empates puede elegir otro
+    alineamiento igual de bueno.
+
+    `scoring` (un ScoringScheme) reemplaza a match/mismatch/gap y permite
+    matrices de sustitución y gaps afines (Gotoh; Myers-Miller en espacio
+    lineal).
+    """
+    if max_cells is None:
+        max_cells = MAX_CELLS
+    scheme = _scheme(scoring, match, mismatch, gap)
+
+    raw1, raw2 = _raw(seq1), _raw(seq2)
+    a, b, table = _encode_pair(scheme, raw1, raw2)
+    profile = table[:, b]
+    ops = []
+    if scheme.affine:
+        g, h = _affine_params(scheme)
+        score = _myers_miller(a, profile, g, h, g, g, max_cells, ops)
+    else:
+        score = _hirschberg(a, profile, scheme.gap_open, max_cells, ops)
+
+    aln1, aln2 = _build_alignment(ops, raw1, raw2)
+    return aln1, aln2, _as_score(score, scheme)
+
+
+def needleman_wunsch_score(seq1, seq2, match=1, mismatch=-1, gap=-2, scoring=None):
+    """
+    Puntaje óptimo global sin traceback, en memoria O(min(n, m)).
+    Útil cuando solo se necesita el puntaje para calcular distancias.
+    """
+    scheme = _scheme(scoring, match, mismatch, gap)
+    a, b, table = _encode_pair(scheme, _raw(seq1), _raw(seq2))
+    if len(b) > len(a):
+        # El puntaje es simétrico: las columnas recorren la secuencia corta
+        a, b, table = b, a, table.T
+    profile = table[:, b]
+
+    if scheme.affine:
+        g, h = _affine_params(scheme)
+        score = _affine_last_row(a, profile, g, h, g)[0][-1]
+    else:
+        score = _last_row(a, profile, scheme.gap_open)[-1]
+    return _as_score(score, scheme)
+
+
+def needleman_wunsch_banded(seq1, seq2, match=1, mismatch=-1, gap=-2,
+                            band=None, score_only=False, max_cells=None,
+                            scoring=None):
+    """
+    Alineamiento global restringido a una banda diagonal.
+
+    La banda cubre las diagonales entre 0 y len(seq2)-len(seq1), ampliadas
+    `band` posiciones a cada lado. Si el camino óptimo toca el borde de la
+    banda, el ancho se duplica y se repite; para secuencias casi idénticas
+    el costo es O(n * band) en lugar de O(n * m).
+    Que el camino no toque el borde no garantiza el óptimo global: con
+    secuencias divergentes la banda puede dar un puntaje menor. Por eso se
+    calcula el alineamiento completo (exacto) si la banda tendría que
+    duplicarse más de MAX_BAND_DOUBLINGS veces o si el puntaje con banda
+    queda por debajo de DIVERGENT_SCORE del máximo posible. Para pares
+    parecidos el resultado con banda sigue siendo una aproximación, que en
+    la práctica coincide con el óptimo.
+
+    Devuelve (aln1, aln2, score), o solo el puntaje si `score_only`.
+    """
+    if max_cells is None:
+        max_cells = MAX_CELLS
+    if band is None:
+        band = BAND_WIDTH
+    scheme = _scheme(scoring, match, mismatch, gap)
+
+    raw1, raw2 = _raw(seq1), _raw(seq2)
+    a, b, table = _encode_pair(scheme, raw1, raw2)
+    n, m = len(a), len(b)
+    # Columna extra al inicio: profile[:, j] puntúa contra b[j-1]
+    profile = np.zeros((table.shape[0], m + 1))
+    profile[:, 1:] = table[:, b]
+
+    width = max(1, band)
+    doublings = 0
+    while True:
+        low = min(0, m - n) - width
+        high = max(0, m - n) + width
+        full = low <= -n and high >= m
+        # Secuencias divergentes o banda que ya no ahorra nada: usar el
+        # alineamiento completo (en espacio lineal si es grande)
+        exact = doublings > MAX_BAND_DOUBLINGS or (
+            full and (n + 1) * (m + 1) > max_cells)
+        if exact:
+            break
+
+        ops = []
+        low, high = max(low, -n), min(high, m)
+        if scheme.affine:
+            g, h = _affine_params(scheme)
+            score, touches = _banded_affine(a, profile, g, h, low, high, ops)
+        else:
+            score, touches = _banded_alignment(a, profile, scheme.gap_open,
+                                               low, high, ops)
+        if full or not touches:
+            # Con un puntaje bajo el par es divergente y la banda no es
+            # confiable aunque el camino no toque el borde
+            exact = not full and score < DIVERGENT_SCORE * table.max() * min(n, m)
+            break
+        width *= 2
+        doublings += 1
+
+    if exact:
+        if score_only:
+            return needleman_wunsch_score(seq1, seq2, scoring=scheme)
+        return needleman_wunsch(seq1, seq2, max_cells=max_cells, scoring=scheme)
+
+    score = _as_score(score, scheme)
+    if score_only:
+        return score
+    aln1, aln2 = _build_alignment(ops, raw1, raw2)
+    return aln1, aln2, score
+
+
+def align_profiles(freqs1, freqs2, table, scoring, max_cells=None):
+    """
+    Alinear dos perfiles de frecuencias por columna (matrices L x K de NumPy)
+    con puntaje de suma de pares: la columna i contra la j puntúa
+    freqs1[i] @ table @ freqs2[j]. Usa los mismos motores que el
+    alineamiento de secuencias (Hirschberg o Myers-Miller según `scoring`).
+
+    Devuelve (ops, score), con ops un arreglo de DIAG/UP/LEFT.
+    """
+    if max_cells is None:
+        max_cells = MAX_CELLS
+    profile = _WeightedProfile(table @ np.asarray(freqs2, dtype=np.float64).T)
+    freqs1 = np.asarray(freqs1, dtype=np.float64)
+    ops = []
+    if scoring.affine:
+        g, h = _affine_params(scoring)
+        score = _myers_miller(freqs1, profile, g, h, g, g, max_cells, ops)
+    else:
+        score = _hirschberg(freqs1, profile, scoring.gap_open, max_cells, ops)
+    return np.asarray(ops, dtype=np.uint8), float(score)
+
+
+class _WeightedProfile:
+    """
+    Perfil de consulta para alineamiento perfil-perfil: la fila de puntajes
+    de una columna es `freqs @ matrix` en lugar de `matrix[código]`, así los
+    motores de alineamiento sirven sin cambios.
+    """
+
+    def __init__(self, matrix):
+        self.matrix = matrix
+
+    @property
+    def shape(self):
+        return self.matrix.shape
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            rows, cols = key
+            if isinstance(rows, slice):
+                return _WeightedProfile(self.matrix[:, cols])
+            return rows @ self.matrix[:, cols]
+        return key @ self.matrix
+
+
+def _scheme(scoring, match, mismatch, gap):
+    """Usar el esquema recibido o construir el de coincidencia/discrepancia"""
+    if scoring is not None:
+        return scoring
+    return get_scoring_scheme(match=match, mismatch=mismatch, gap=gap)
+
+
+def _raw(seq):
+    """Bytes de una secuencia como arreglo uint8, sin copiar carácter a carácter"""
+    return np.frombuffer(str(seq).encode('latin-1', 'replace'), dtype=np.uint8)
+
+
+def _encode_pair(scheme, raw1, raw2):
+    """
+    Codificar ambas secuencias una sola vez y reducir la tabla de
+    sustitución a los símbolos presentes, para que el perfil de consulta
+    `table[:, b]` sea pequeño.
+    """
+    x = scheme.lookup[raw1]
+    y = scheme.lookup[raw2]
+    present = np.zeros(256, dtype=bool)
+    present[x] = True
+    present[y] = True
+    used = np.flatnonzero(present)
+    remap = np.cumsum(present) - 1
+    return remap[x], remap[y], scheme.table[np.ix_(used, used)]
+
+
+def _as_score(value, scheme):
+    """Devolver el puntaje como int si el esquema es entero"""
+    if scheme.integral:
+        return int(round(value))
+    return float(value)
+
+
+def _affine_params(scheme):
+    """Prima de apertura g y costo por posición h: un gap de largo L vale g + L*h"""
+    return scheme.gap_open - scheme.gap_extend, scheme.gap_extend
+
+
+def _pack(codes, bits=2):
+    """Empaquetar códigos de `bits` bits en bytes (4 o 2 celdas por byte)"""
+    per_byte = 8 // bits
+    pad = (-len(codes)) % per_byte
+    if pad:
+        codes = np.concatenate([codes, np.zeros(pad, dtype=np.uint8)])
+    c = codes.reshape(-1, per_byte)
+    packed = c[:, 0].copy()
+    for k in range(1, per_byte):
+        packed |= c[:, k] << (k * bits)
+    return packed
+
+
+# ----------------------------------------------------------------------
+# Gaps lineales
+# ----------------------------------------------------------------------
+
+def _next_row(prev, sub, gap, offsets):
+    """
+    Calcular la fila i a partir de la fila i-1.
+
+    La dependencia horizontal H[i][j-1] + gap se resuelve con un máximo
+    acumulado: H[i][j] = j*gap + max_{k<=j}(T[k] - k*gap), donde T es el
+    mejor valor entre diagonal y arriba.
+    """
+    diag = prev[:-1] + sub
+    up = prev + gap
+    best = up.copy()
+    np.maximum(best[1:], diag, out=best[1:])
+    row = np.maximum.accumulate(best - offsets) + offsets
+    return row, diag, up
+
+
+def _linear_codes(diag, up, left):
+    """
+    Dirección de cada celda con preferencia diagonal > arriba > izquierda.
+    Se comparan los candidatos directamente (no contra H) porque el máximo
+    acumulado redondea distinto cuando los puntajes no son enteros.
+    """
+    return np.where((diag >= up) & (diag >= left), DIAG,
+                    np.where(up >= left, UP, LEFT)).astype(np.uint8)
+
+
+def _last_row(a, profile, gap):
+    """Última fila de puntajes de alinear a contra el perfil, en memoria O(m)"""
+    offsets = np.arange(profile.shape[1] + 1, dtype=np.float64) * gap
+    row = offsets.copy()
+    for ai in a:
+        row = _next_row(row, profile[ai], gap, offsets)[0]
+    return row
+
+
+def _full_alignment(a, profile, gap, ops):
+    """Alineamiento con traceback completo empaquetado en uint8"""
+    n, m = len(a), profile.shape[1]
+    offsets = np.arange(m + 1, dtype=np.float64) * gap
+    trace = np.empty((n + 1, (m + 4) // 4), dtype=np.uint8)
+
+    row = offsets.copy()
+    codes = np.full(m + 1, LEFT, dtype=np.uint8)
+    trace[0] = _pack(codes)
+    for i in range(1, n + 1):
+        row, diag, up = _next_row(row, profile[a[i - 1]], gap, offsets)
+        codes[0] = UP
+        codes[1:] = _linear_codes(diag, up[1:], row[:-1] + gap)
+        trace[i] = _pack(codes)
+
+    path = []
     i, j = n, m
     while i > 0 or j > 0:
-        if trace[i][j] == 'D':
-            aln1 = seq1[i-1] + aln1
-            aln2 = seq2[j-1] + aln2
+        code = (trace[i, j >> 2] >> ((j & 3) << 1)) & 3
+        path.append(code)
+        if code == DIAG:
             i -= 1
             j -= 1
-        elif trace[i][j] == 'U':
-            aln1 = seq1[i-1] + aln1
-            aln2 = '-' + aln2
+        elif code == UP:
             i -= 1
-        elif trace[i][j] == 'L':
-            aln1 = '-' + aln1
-            aln2 = seq2[j-1] + aln2
+        else:
             j -= 1
+    ops.extend(reversed(path))
+    return row[m]
+
+
+def _hirschberg(a, profile, gap, max_cells, ops):
+    """
+    Alinear en espacio lineal dividiendo `a` por la mitad y buscando la
+    columna donde el camino óptimo cruza la fila central.
+    Agrega las operaciones a `ops` y devuelve el puntaje del subproblema.
+    """
+    n, m = len(a), profile.shape[1]
+    if n == 0:
+        ops.extend([LEFT] * m)
+        return m * gap
+    if m == 0:
+        ops.extend([UP] * n)
+        return n * gap
+    if n == 1 or (n + 1) * (m + 1) <= max_cells:
+        return _full_alignment(a, profile, gap, ops)
+
+    mid = n // 2
+    forward = _last_row(a[:mid], profile, gap)
+    backward = _last_row(a[mid:][::-1], profile[:, ::-1], gap)
+    total = forward + backward[::-1]
+    k = int(np.argmax(total))
+
+    _hirschberg(a[:mid], profile[:, :k], gap, max_cells, ops)
+    _hirschberg(a[mid:], profile[:, k:], gap, max_cells, ops)
+    return total[k]
+
+
+def _banded_alignment(a, profile, gap, low, high, ops):
+    """
+    Needleman-Wunsch dentro de las diagonales [low, high] (d = j - i).
+
+    Las filas se guardan en coordenadas de banda k = j - i - low, de modo
+    que la diagonal queda en la misma columna k de la fila anterior y el
+    valor de arriba en k+1. Devuelve (puntaje, toca_borde).
+    """
+    n, m = len(a), profile.shape[1] - 1
+    width = high - low + 1
+    offsets = np.arange(width, dtype=np.float64) * gap
+
+    row = np.full(width + 1, -np.inf)
+    k_hi = min(width, m - low + 1)
+    row[-low:k_hi] = np.arange(k_hi + low) * gap
+    trace = np.empty((n + 1, (width + 3) // 4), dtype=np.uint8)
+    codes = np.full(width, LEFT, dtype=np.uint8)
+    trace[0] = _pack(codes)
+
+    for i in range(1, n + 1):
+        j0 = i + low
+        k_lo = max(0, -j0)
+        k_hi = min(width, m - j0 + 1)
+        diag = row[k_lo:k_hi] + profile[a[i - 1], j0 + k_lo:j0 + k_hi]
+        up = row[k_lo + 1:k_hi + 1] + gap
+        best = np.maximum(diag, up)
+        offs = offsets[:k_hi - k_lo]
+        seg = np.maximum.accumulate(best - offs) + offs
+
+        row = np.full(width + 1, -np.inf)
+        row[k_lo:k_hi] = seg
+        left = np.empty_like(seg)
+        left[0] = -np.inf
+        left[1:] = seg[:-1] + gap
+        codes[:] = LEFT
+        codes[k_lo:k_hi] = _linear_codes(diag, up, left)
+        trace[i] = _pack(codes)
+
+    touches = _banded_traceback(trace, n, m, low, high, 2, ops)
+    return row[m - n - low], touches
+
+
+# ----------------------------------------------------------------------
+# Gaps afines (Gotoh)
+#
+# M: termina en sustitución, X: en gap vertical (consume seq1),
+# Y: en gap horizontal (consume seq2), H = max(M, X, Y).
+# Cada celda guarda 4 bits: origen de H (2 bits), X extiende, Y extiende.
+# ----------------------------------------------------------------------
+
+_STATE_M, _STATE_X, _STATE_Y = 0, 1, 2
+
+
+def _affine_first_row(width, g, h, tb):
+    """Fila 0: gaps horizontales; X[0][0] = tb fija la prima del gap inicial"""
+    offsets = np.arange(width, dtype=np.float64) * h
+    H = offsets + g
+    H[0] = 0.0
+    X = np.full(width, -np.inf)
+    X[0] = tb
+    return H, X, offsets
+
+
+def _affine_next_row(prev_h, prev_x, sub, g, h, offsets):
+    """
+    Fila i de Gotoh. Y se resuelve igual que el caso lineal, con un máximo
+    acumulado: Y[j] = g + j*h + max_{k<j}(G[k] - k*h), G = max(M, X).
+    """
+    size = len(prev_h)
+    M = np.empty(size)
+    M[0] = -np.inf
+    M[1:] = prev_h[:-1] + sub
+    x_open = prev_h + (g + h)
+    x_ext = prev_x + h
+    X = np.maximum(x_open, x_ext)
+    G = np.maximum(M, X)
+    best = np.maximum.accumulate(G - offsets)
+    Y = np.empty(size)
+    Y[0] = -np.inf
+    Y[1:] = best[:-1] + offsets[1:] + g
+    H = np.maximum(G, Y)
+    return H, X, M, Y, G, x_ext >= x_open
+
+
+def _affine_codes(X, M, Y, G, x_ext, h, g):
+    """Códigos de 4 bits de una fila de Gotoh"""
+    codes = np.where((M >= X) & (M >= Y), _STATE_M,
+                     np.where(X >= Y, _STATE_X, _STATE_Y)).astype(np.uint8)
+    codes |= x_ext.astype(np.uint8) << 2
+    y_ext = np.zeros(len(M), dtype=np.uint8)
+    y_ext[1:] = Y[:-1] + h >= G[:-1] + g + h
+    codes |= y_ext << 3
+    return codes
+
+
+def _affine_last_row(a, profile, g, h, tb):
+    """Últimas filas H y X de Gotoh en memoria O(m)"""
+    H, X, offsets = _affine_first_row(profile.shape[1] + 1, g, h, tb)
+    for ai in a:
+        H, X = _affine_next_row(H, X, profile[ai], g, h, offsets)[:2]
+    return H, X
+
+
+def _first_row_codes(width):
+    """Códigos de la fila 0: gap horizontal que se extiende desde j = 2"""
+    codes = np.full(width, _STATE_Y | 8, dtype=np.uint8)
+    codes[0] = _STATE_M
+    if width > 1:
+        codes[1] = _STATE_Y
+    return codes
+
+
+def _affine_traceback(read, n, m, state, ops, on_cell=None):
+    """Recorrer el traceback afín desde (n, m) en el estado indicado"""
+    path = []
+    i, j = n, m
+    while i > 0 or j > 0:
+        if on_cell is not None:
+            on_cell(i, j)
+        if i == 0:
+            state = _STATE_Y
+        elif j == 0:
+            state = _STATE_X
+        code = read(i, j)
+        if state == _STATE_M:
+            path.append(DIAG)
+            i -= 1
+            j -= 1
+            state = read(i, j) & 3
+        elif state == _STATE_X:
+            path.append(UP)
+            i -= 1
+            if not (code >> 2) & 1:
+                state = read(i, j) & 3
+        else:
+            path.append(LEFT)
+            j -= 1
+            if not (code >> 3) & 1:
+                state = read(i, j) & 3
+    ops.extend(reversed(path))
+
+
+def _gotoh_full(a, profile, g, h, tb, te, ops):
+    """
+    Gotoh con traceback completo (4 bits por celda, dos celdas por byte).
+    `tb`/`te` son la prima del gap vertical al inicio/final: vale g, o 0
+    si el gap continúa desde el subproblema vecino (Myers-Miller).
+    """
+    n, m = len(a), profile.shape[1]
+    H, X, offsets = _affine_first_row(m + 1, g, h, tb)
+    trace = np.empty((n + 1, (m + 2) // 2), dtype=np.uint8)
+    trace[0] = _pack(_first_row_codes(m + 1), bits=4)
+
+    for i in range(1, n + 1):
+        H, X, M, Y, G, x_ext = _affine_next_row(H, X, profile[a[i - 1]], g, h, offsets)
+        trace[i] = _pack(_affine_codes(X, M, Y, G, x_ext, h, g), bits=4)
+
+    # Estado final: un gap vertical que termina en (n, m) paga `te`
+    finals = [M[m], X[m] - g + te, Y[m]]
+    state = int(np.argmax(finals))
+
+    def read(i, j):
+        return (trace[i, j >> 1] >> ((j & 1) << 2)) & 15
+
+    _affine_traceback(read, n, m, state, ops)
+    return finals[state]
+
+
+def _myers_miller(a, profile, g, h, tb, te, max_cells, ops):
+    """
+    Gotoh en espacio lineal (Myers y Miller, 1988). En la fila central el
+    camino óptimo cruza por una celda (tipo 1) o dentro de un gap vertical
+    (tipo 2); en el segundo caso a[mid-1] y a[mid] quedan alineados con gaps
+    y los subproblemas vecinos no vuelven a pagar la apertura.
+    """
+    n, m = len(a), profile.shape[1]
+    if n == 0:
+        ops.extend([LEFT] * m)
+        return g + m * h if m else 0.0
+    if m == 0:
+        ops.extend([UP] * n)
+        return max(tb, te) + n * h
+    if n == 1 or (n + 1) * (m + 1) <= max_cells:
+        return _gotoh_full(a, profile, g, h, tb, te, ops)
+
+    mid = n // 2
+    fh, fx = _affine_last_row(a[:mid], profile, g, h, tb)
+    rh, rx = _affine_last_row(a[mid:][::-1], profile[:, ::-1], g, h, te)
+    type1 = fh + rh[::-1]
+    type2 = fx + rx[::-1] - g
+    k1 = int(np.argmax(type1))
+    k2 = int(np.argmax(type2))
+
+    if type1[k1] >= type2[k2]:
+        _myers_miller(a[:mid], profile[:, :k1], g, h, tb, g, max_cells, ops)
+        _myers_miller(a[mid:], profile[:, k1:], g, h, g, te, max_cells, ops)
+        return type1[k1]
+
+    _myers_miller(a[:mid - 1], profile[:, :k2], g, h, tb, 0.0, max_cells, ops)
+    ops.extend([UP, UP])
+    _myers_miller(a[mid + 1:], profile[:, k2:], g, h, 0.0, te, max_cells, ops)
+    return type2[k2]
+
+
+def _banded_affine(a, profile, g, h, low, high, ops):
+    """Gotoh dentro de las diagonales [low, high], en coordenadas de banda"""
+    n, m = len(a), profile.shape[1] - 1
+    width = high - low + 1
+
+    H = np.full(width + 1, -np.inf)
+    X = np.full(width + 1, -np.inf)
+    k_hi = min(width, m - low + 1)
+    first_h, first_x, offsets = _affine_first_row(k_hi + low, g, h, g)
+    H[-low:k_hi] = first_h
+    X[-low:k_hi] = first_x
+    offsets = np.arange(width + 1, dtype=np.float64) * h
+
+    trace = np.empty((n + 1, (width + 1) // 2), dtype=np.uint8)
+    codes = np.zeros(width, dtype=np.uint8)
+    codes[-low:k_hi] = _first_row_codes(k_hi + low)
+    trace[0] = _pack(codes, bits=4)
+
+    for i in range(1, n + 1):
+        j0 = i + low
+        k_lo = max(0, -j0)
+        k_hi = min(width, m - j0 + 1)
+        size = k_hi - k_lo
+        offs = offsets[:size]
+
+        M = H[k_lo:k_hi] + profile[a[i - 1], j0 + k_lo:j0 + k_hi]
+        x_open = H[k_lo + 1:k_hi + 1] + (g + h)
+        x_ext = X[k_lo + 1:k_hi + 1] + h
+        X_seg = np.maximum(x_open, x_ext)
+        G = np.maximum(M, X_seg)
+        best = np.maximum.accumulate(G - offs)
+        Y = np.empty(size)
+        Y[0] = -np.inf
+        Y[1:] = best[:-1] + offs[1:] + g
+        H_seg = np.maximum(G, Y)
+
+        H = np.full(width + 1, -np.inf)
+        X = np.full(width + 1, -np.inf)
+        H[k_lo:k_hi] = H_seg
+        X[k_lo:k_hi] = X_seg
+        codes[:] = 0
+        codes[k_lo:k_hi] = _affine_codes(X_seg, M, Y, G, x_ext >= x_open, h, g)
+        trace[i] = _pack(codes, bits=4)
+
+    touches = _banded_traceback(trace, n, m, low, high, 4, ops)
+    return H[m - n - low], touches
+
+
+def _banded_traceback(trace, n, m, low, high, bits, ops):
+    """
+    Traceback en coordenadas de banda (lineal con 2 bits, afín con 4).
+    Devuelve True si el camino toca un borde real de la banda.
+    """
+    width = high - low + 1
+    touch_low = low > -n
+    touch_high = high < m
+    touched = []
+
+    def on_cell(i, j):
+        k = j - i - low
+        if (touch_low and k == 0) or (touch_high and k == width - 1):
+            touched.append(True)
+
+    if bits == 4:
+        def read(i, j):
+            k = j - i - low
+            return (trace[i, k >> 1] >> ((k & 1) << 2)) & 15
+
+        _affine_traceback(read, n, m, read(n, m) & 3, ops, on_cell)
+        return bool(touched)
+
+    path = []
+    i, j = n, m
+    while i > 0 or j > 0:
+        on_cell(i, j)
+        if i == 0:
+            code = LEFT
+        elif j == 0:
+            code = UP
+        else:
+            k = j - i - low
+            code = (trace[i, k >> 2] >> ((k & 3) << 1)) & 3
+        path.append(code)
+        if code == DIAG:
+            i -= 1
+            j -= 1
+        elif code == UP:
+            i -= 1
+        else:
+            j -= 1
+    ops.extend(reversed(path))
+    return bool(touched)
+
 
-    return aln1, aln2, score[n][m]
+def _build_alignment(ops, a, b):
+    """Construir las cadenas alineadas a partir de la lista de operaciones"""
+    ops = np.asarray(ops, dtype=np.uint8)
+    gap_char = ord('-')
+    out1 = np.full(len(ops), gap_char, dtype=np.uint8)
+    out2 = np.full(len(ops), gap_char, dtype=np.uint8)
+    out1[ops != LEFT] = a
+    out2[ops != UP] = b
+    return out1.tobytes().decode('latin-1'), out2.tobytes().decode('latin-1')
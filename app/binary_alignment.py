@@ -0,0 +1,53 @@
+import os
+import struct
+import numpy as np
+
+# Formato binario de un alineamiento codificado (little-endian):
+#   cabecera de 32 bytes: MAGIC (8), taxones (u64), sitios (u64), bytes de etiquetas (u64)
+#   matriz uint8 taxones x sitios con los bytes de cada carácter (fila por taxón)
+#   tabla de etiquetas en UTF-8 separadas por '\n'
+MAGIC = b'PHYALN01'
+HEADER = struct.Struct('<8sQQQ')
+
+# Extensión del archivo binario que acompaña al FASTA alineado
+BINARY_SUFFIX = '.aln'
+
+
+def binary_alignment_path(fasta_path):
+    """Ruta del binario que acompaña a un FASTA alineado (mismo nombre, extensión .aln)"""
+    return os.path.splitext(fasta_path)[0] + BINARY_SUFFIX
+
+
+def write_binary_alignment(path, codes, labels):
+    """Guardar una matriz codificada (ver encode_alignment) y sus nombres en formato binario"""
+    codes = np.ascontiguousarray(codes, dtype=np.uint8)
+    if codes.ndim != 2 or codes.shape[0] != len(labels):
+        raise ValueError("La matriz debe ser taxones x sitios, con un nombre por fila")
+    names = '\n'.join(labels).encode('utf-8')
+    temp = f"{path}.{os.getpid()}.tmp"
+    with open(temp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, codes.shape[0], codes.shape[1], len(names)))
+        f.write(codes.tobytes())
+        f.write(names)
+    # Reemplazo atómico: nadie abre un binario escrito a medias
+    os.replace(temp, path)
+
+
+def open_binary_alignment(path):
+    """
+    Abrir un alineamiento binario: la matriz se mapea con np.memmap (solo
+    lectura, sin copiar ni parsear) y se devuelve (matriz, nombres).
+    """
+    with open(path, 'rb') as f:
+        magic, taxa, sites, names_size = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} no es un alineamiento binario")
+        f.seek(HEADER.size + taxa * sites)
+        names = f.read(names_size).decode('utf-8')
+    labels = names.split('\n') if taxa else []
+    if len(labels) != taxa:
+        raise ValueError(f"Tabla de nombres incompleta en {path}")
+    if taxa * sites == 0:
+        return np.zeros((taxa, sites), dtype=np.uint8), labels
+    codes = np.memmap(path, dtype=np.uint8, mode='r', offset=HEADER.size, shape=(taxa, sites))
+    return codes, labels
@@ -0,0 +1,122 @@
+import os
+from collections import Counter
+from multiprocessing import Pool
+import numpy as np
+from app.distance_models import distance_matrix
+from app.likelihood import TreeLikelihood, compress_patterns
+from app.neighbor_joining import neighbor_joining
+
+# Límite de réplicas aceptado por la API
+MAX_REPLICATES = 1000
+
+# Semilla por defecto: el mismo alineamiento da los mismos soportes
+DEFAULT_SEED = 12345
+
+# Estado de cada proceso trabajador (se llena en _init_worker)
+_worker = {}
+
+
+def resample_weights(pattern_weights, rng):
+    """
+    Pesos de una réplica bootstrap: tantos sitios como el original,
+    sorteados con reemplazo, contados por patrón (en lugar de copiar las
+    columnas del alineamiento)
+    """
+    total = pattern_weights.sum()
+    return rng.multinomial(int(round(total)), pattern_weights / total).astype(np.float64)
+
+
+def replicate_tree(patterns, labels, weights, method='nj', model='identity'):
+    """
+    Árbol de una réplica a partir de los patrones de sitio y sus pesos:
+    NJ con distancias `model` y, si method='ml', búsqueda NNI desde él.
+    Los patrones con peso cero se descartan antes de calcular.
+    """
+    used = weights > 0
+    patterns, weights = patterns[:, used], weights[used]
+    tree = neighbor_joining(distance_matrix(patterns, model, weights), labels)
+    if method == 'ml':
+        likelihood = TreeLikelihood(tree, patterns, labels, weights)
+        likelihood.nni_search()
+        tree = likelihood.to_tree()
+    return tree
+
+
+def bootstrap_support(tree, codes, labels, method='nj', model='identity', replicates=100,
+                      seed=DEFAULT_SEED, processes=None, progress=None):
+    """
+    Soporte bootstrap no paramétrico (Felsenstein, 1985) de cada nodo de
+    `tree` (CompactTree), en porcentaje.
+
+    Las columnas de `codes` se comprimen una sola vez en patrones y cada
+    réplica solo sortea nuevos pesos por patrón. La réplica k usa su
+    propia semilla derivada de `seed` (SeedSequence.spawn), así que el
+    resultado no depende del número de procesos ni del orden en que
+    terminan. Las biparticiones se cuentan como bitsets.
+    `progress(fracción)`, si se pasa, se llama al terminar cada bloque.
+
+    Devuelve un arreglo con el soporte por nodo (NaN en hojas y raíz).
+    """
+    patterns, weights = compress_patterns(codes)
+    seeds = np.random.SeedSequence(seed).spawn(replicates)
+    index = {name: k for k, name in enumerate(labels)}
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+    processes = max(1, min(processes, replicates))
+    chunks = [list(range(start, replicates, processes * 4)) for start in range(processes * 4)]
+    chunks = [[seeds[k] for k in chunk] for chunk in chunks if chunk]
+
+    init_args = (patterns, weights, labels, index, method, model)
+    if processes == 1:
+        _init_worker(*init_args)
+        try:
+            results = []
+            for chunk in chunks:
+                results.append(_run_chunk(chunk))
+                if progress is not None:
+                    progress(len(results) / len(chunks))
+        finally:
+            _worker.clear()
+    else:
+        with Pool(processes, initializer=_init_worker, initargs=init_args) as pool:
+            results = []
+            for result in pool.imap_unordered(_run_chunk, chunks):
+                results.append(result)
+                if progress is not None:
+                    progress(len(results) / len(chunks))
+
+    counts = Counter()
+    for chunk in results:
+        for masks in chunk:
+            counts.update(masks)
+
+    support = np.full(len(tree), np.nan)
+    for node, mask in tree.bipartitions(index).items():
+        support[node] = 100.0 * counts[mask] / replicates
+    return support
+
+
+def with_support(tree, support):
+    """Poner los soportes en el árbol; los nodos internos pierden su nombre (InnerN) para que se escriban"""
+    tree.label[tree.left_child >= 0] = -1
+    tree.support = np.asarray(support, dtype=np.float64)
+    return tree
+
+
+def _init_worker(patterns, weights, labels, index, method, model):
+    """Guardar en el proceso los patrones y las opciones comunes a todas las réplicas"""
+    _worker.update(patterns=patterns, weights=weights, labels=labels, index=index,
+                   method=method, model=model)
+
+
+def _run_chunk(chunk):
+    """Construir las réplicas de un bloque y devolver el conjunto de biparticiones de cada una"""
+    out = []
+    for seed in chunk:
+        rng = np.random.default_rng(seed)
+        weights = resample_weights(_worker['weights'], rng)
+        tree = replicate_tree(_worker['patterns'], _worker['labels'], weights,
+                              _worker['method'], _worker['model'])
+        out.append(set(tree.bipartitions(_worker['index']).values()))
+    return out
@@ -0,0 +1,307 @@
+import re
+import numpy as np
+from Bio.Phylo.Newick import Clade, Tree
+
+# Tokens Newick: etiqueta entre comillas, comentario [...], puntuación o
+# etiqueta sin comillas
+_TOKEN = re.compile(r"'(?:[^']|'')*'|\[[^\]]*\]|[(),;:]|[^\s(),;:\[\]']+")
+
+# Caracteres que obligan a escribir una etiqueta entre comillas
+_QUOTE = re.compile(r"[\s(),;:\[\]']")
+
+
+def split_newick(text):
+    """Separar un texto con varios árboles Newick (terminados en ';'), respetando comillas y comentarios"""
+    trees = []
+    start = 0
+    for match in _TOKEN.finditer(text):
+        if match.group() == ';':
+            tree = text[start:match.end()].strip()
+            if tree != ';':
+                trees.append(tree)
+            start = match.end()
+    rest = text[start:].strip()
+    if rest:
+        trees.append(rest)
+    return trees
+
+
+class CompactTree:
+    """
+    Árbol enraizado guardado en arreglos NumPy, un índice por nodo:
+
+    - parent: índice del padre (-1 en la raíz)
+    - left_child / right_sibling: primer hijo y siguiente hermano
+      (representación hijo izquierdo / hermano derecho, válida también para
+      nodos con más de dos hijos)
+    - branch_length: longitud de la rama hacia el padre (NaN si no tiene)
+    - support: valor de soporte del nodo (NaN si no tiene)
+    - label: índice en la tabla `labels` (-1 si el nodo no tiene nombre)
+
+    Todos los recorridos son iterativos, por lo que árboles grandes no
+    chocan con el límite de recursión.
+    """
+
+    def __init__(self, parent, branch_length=None, label=None, labels=None,
+                 support=None, rooted=False):
+        self.parent = np.asarray(parent, dtype=np.int32)
+        size = len(self.parent)
+        if branch_length is None:
+            branch_length = np.full(size, np.nan)
+        if support is None:
+            support = np.full(size, np.nan)
+        if label is None:
+            label = np.full(size, -1)
+        self.branch_length = np.asarray(branch_length, dtype=np.float64)
+        self.support = np.asarray(support, dtype=np.float64)
+        self.label = np.asarray(label, dtype=np.int32)
+        self.labels = list(labels) if labels is not None else []
+        self.rooted = rooted
+
+        roots = np.flatnonzero(self.parent < 0)
+        if len(roots) != 1:
+            raise ValueError("El árbol debe tener exactamente una raíz")
+        self.root = int(roots[0])
+        self._link_children()
+
+    def _link_children(self):
+        """Calcular left_child/right_sibling a partir de parent (hijos en orden de índice)"""
+        size = len(self.parent)
+        self.left_child = np.full(size, -1, dtype=np.int32)
+        self.right_sibling = np.full(size, -1, dtype=np.int32)
+        nodes = np.flatnonzero(self.parent >= 0)
+        if len(nodes) == 0:
+            return
+        order = nodes[np.argsort(self.parent[nodes], kind='stable')]
+        parents = self.parent[order]
+        same = parents[1:] == parents[:-1]
+        self.right_sibling[order[:-1][same]] = order[1:][same]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = ~same
+        self.left_child[parents[first]] = order[first]
+
+    def __len__(self):
+        return len(self.parent)
+
+    def __str__(self):
+        return self.to_newick()
+
+    def is_leaf(self, node):
+        return self.left_child[node] < 0
+
+    def name(self, node):
+        """Nombre del nodo o None"""
+        index = self.label[node]
+        return self.labels[index] if index >= 0 else None
+
+    def children(self, node):
+        """Lista de hijos de un nodo, en orden"""
+        out = []
+        child = self.left_child[node]
+        while child >= 0:
+            out.append(int(child))
+            child = self.right_sibling[child]
+        return out
+
+    def leaves(self):
+        """Índices de las hojas"""
+        return np.flatnonzero(self.left_child < 0)
+
+    def leaf_names(self):
+        return [self.name(node) for node in self.preorder() if self.is_leaf(node)]
+
+    def preorder(self):
+        """Índices en pre-orden (padre antes que hijos, hijos en orden)"""
+        order = np.empty(len(self.parent), dtype=np.int32)
+        stack = [self.root]
+        k = 0
+        while stack:
+            node = stack.pop()
+            order[k] = node
+            k += 1
+            stack.extend(reversed(self.children(node)))
+        return order
+
+    def postorder(self):
+        """Índices con cada hijo antes que su padre"""
+        return self.preorder()[::-1]
+
+    def depths(self):
+        """Distancia de cada nodo a la raíz (ramas sin longitud cuentan 0)"""
+        lengths = np.nan_to_num(self.branch_length)
+        depth = np.zeros(len(self.parent))
+        for node in self.preorder()[1:]:
+            depth[node] = depth[self.parent[node]] + lengths[node]
+        return depth
+
+    def bipartitions(self, index):
+        """
+        Biparticiones no triviales como bitsets (enteros de Python): bit k
+        = taxón con índice k en `index` (nombre -> índice); las hojas que no
+        están en `index` se ignoran (árbol restringido a esos taxones).
+        Cada bitset se normaliza al lado que no contiene el taxón 0, de modo
+        que la misma bipartición da el mismo entero en cualquier árbol (con
+        o sin raíz). Devuelve un dict nodo -> bitset, con una pasada en
+        post-orden.
+        """
+        n = len(index)
+        full = (1 << n) - 1
+        parent = self.parent.tolist()
+        leaf = (self.left_child < 0).tolist()
+        masks = [0] * len(parent)
+        sizes = [0] * len(parent)
+        out = {}
+        for node in self.postorder().tolist():
+            if leaf[node]:
+                k = index.get(self.name(node))
+                if k is not None:
+                    masks[node] = 1 << k
+                    sizes[node] = 1
+            mask, size = masks[node], sizes[node]
+            up = parent[node]
+            if up >= 0:
+                masks[up] |= mask
+                sizes[up] += size
+            if mask & 1:
+                mask ^= full
+                size = n - size
+            if 2 <= size <= n - 2:
+                out[node] = mask
+        return out
+
+    # ------------------------------------------------------------------
+    # Newick
+
+    @classmethod
+    def from_newick(cls, text):
+        """Leer un árbol Newick sin recursión"""
+        parent = [-1]
+        lengths = [np.nan]
+        names = [None]
+        node = 0
+        expect_length = False
+        closed = set()
+
+        for token in _TOKEN.findall(text):
+            if token[0] == '[':
+                continue
+            if expect_length:
+                lengths[node] = float(token)
+                expect_length = False
+            elif token == '(':
+                parent.append(node)
+                lengths.append(np.nan)
+                names.append(None)
+                node = len(parent) - 1
+            elif token == ',':
+                if parent[node] < 0:
+                    raise ValueError("Newick inválido: ',' fuera de un grupo")
+                parent.append(parent[node])
+                lengths.append(np.nan)
+                names.append(None)
+                node = len(parent) - 1
+            elif token == ')':
+                node = parent[node]
+                if node < 0:
+                    raise ValueError("Newick inválido: paréntesis desbalanceados")
+                closed.add(node)
+            elif token == ':':
+                expect_length = True
+            elif token == ';':
+                break
+            else:
+                if token[0] == "'":
+                    token = token[1:-1].replace("''", "'")
+                names[node] = token
+
+        if node != 0:
+            raise ValueError("Newick inválido: paréntesis desbalanceados")
+
+        # Etiquetas numéricas en nodos internos: valores de soporte
+        support = np.full(len(parent), np.nan)
+        for k in closed:
+            try:
+                support[k] = float(names[k])
+                names[k] = None
+            except (TypeError, ValueError):
+                pass
+        return cls._from_lists(parent, lengths, names, support)
+
+    @classmethod
+    def _from_lists(cls, parent, lengths, names, support=None, rooted=False):
+        table = {}
+        label = np.full(len(parent), -1, dtype=np.int32)
+        for k, name in enumerate(names):
+            if name is not None:
+                label[k] = table.setdefault(name, len(table))
+        return cls(parent, lengths, label, list(table), support, rooted)
+
+    def to_newick(self):
+        """Escribir el árbol en formato Newick sin recursión"""
+        parts = []
+        stack = [(self.root, False)]
+        while stack:
+            node, closing = stack.pop()
+            if node < 0:
+                parts.append(',')
+                continue
+            children = self.children(node)
+            if children and not closing:
+                parts.append('(')
+                stack.append((node, True))
+                for k, child in enumerate(reversed(children)):
+                    stack.append((child, False))
+                    if k < len(children) - 1:
+                        stack.append((-1, False))
+                continue
+            if children:
+                parts.append(')')
+            parts.append(self._newick_label(node))
+        parts.append(';')
+        return ''.join(parts)
+
+    def _newick_label(self, node):
+        name = self.name(node)
+        if name is not None:
+            text = f"'{name.replace(chr(39), chr(39) * 2)}'" if _QUOTE.search(name) else name
+        elif not np.isnan(self.support[node]):
+            text = f"{self.support[node]:g}"
+        else:
+            text = ''
+        if not np.isnan(self.branch_length[node]):
+            text += f":{self.branch_length[node]:.10g}"
+        return text
+
+    # ------------------------------------------------------------------
+    # Bio.Phylo
+
+    @classmethod
+    def from_bio(cls, tree):
+        """Convertir un árbol de Bio.Phylo (o su clado raíz)"""
+        root = getattr(tree, 'root', tree)
+        parent, lengths, names, support = [], [], [], []
+        stack = [(root, -1)]
+        while stack:
+            clade, up = stack.pop()
+            k = len(parent)
+            parent.append(up)
+            lengths.append(np.nan if clade.branch_length is None else float(clade.branch_length))
+            names.append(clade.name)
+            support.append(np.nan if clade.confidence is None else float(clade.confidence))
+            stack.extend((child, k) for child in reversed(clade.clades))
+        return cls._from_lists(parent, lengths, names, support,
+                               rooted=bool(getattr(tree, 'rooted', False)))
+
+    def to_bio(self):
+        """Convertir a un árbol de Bio.Phylo"""
+        clades = {}
+        for node in self.preorder():
+            length = self.branch_length[node]
+            confidence = self.support[node]
+            clade = Clade(branch_length=None if np.isnan(length) else float(length),
+                          name=self.name(node),
+                          confidence=None if np.isnan(confidence) else float(confidence))
+            clades[node] = clade
+            if node != self.root:
+                clades[self.parent[node]].clades.append(clade)
+        return Tree(root=clades[self.root], rooted=self.rooted)
@@ -0,0 +1,220 @@
+import os
+import numpy as np
+from Bio import SeqIO
+from app.binary_alignment import BINARY_SUFFIX, binary_alignment_path, open_binary_alignment
+
+# Modelos de distancia sobre un alineamiento múltiple
+MODELS = ('identity', 'p', 'jc69', 'k2p')
+
+# Distancia asignada a pares saturados (JC69/K2P sin solución finita)
+MAX_DISTANCE = 5.0
+
+# Memoria aproximada por bloque de sitios (matrices indicadoras n x sitios)
+BLOCK_BYTES = 32 << 20
+
+_GAPS = b'-.?*'
+_NUCLEOTIDES = b'ACGTU'
+
+
+def encode_alignment(alignment):
+    """
+    Codificar un alineamiento una sola vez como matriz uint8 (taxones x
+    sitios) con los bytes de cada carácter. Acepta un dict nombre ->
+    secuencia o un MultipleSeqAlignment de Biopython.
+    Devuelve (matriz, nombres).
+    """
+    if isinstance(alignment, dict):
+        labels = list(alignment.keys())
+        rows = [str(alignment[name]) for name in labels]
+    else:
+        labels = [record.id for record in alignment]
+        rows = [str(record.seq) for record in alignment]
+    if not rows:
+        return np.zeros((0, 0), dtype=np.uint8), labels
+    if len({len(row) for row in rows}) != 1:
+        raise ValueError("Las secuencias alineadas deben tener la misma longitud")
+    data = ''.join(rows).encode('latin-1', 'replace')
+    codes = np.frombuffer(data, dtype=np.uint8).reshape(len(rows), -1)
+    return codes, labels
+
+
+def read_encoded_alignment(path):
+    """
+    Leer un alineamiento codificado (ver encode_alignment). Si el FASTA
+    tiene al lado su versión binaria (.aln, escrita por el alineador) y no
+    es más antigua, la matriz se abre con np.memmap sin parsear nada; si
+    no, se lee el FASTA.
+    """
+    binary = path if path.endswith(BINARY_SUFFIX) else binary_alignment_path(path)
+    if os.path.exists(binary) and (binary == path or not os.path.exists(path)
+                                   or os.path.getmtime(binary) >= os.path.getmtime(path)):
+        return open_binary_alignment(binary)
+    records = list(SeqIO.parse(path, "fasta"))
+    return encode_alignment({record.id: str(record.seq) for record in records})
+
+
+def load_alignment(alignment):
+    """
+    Alineamiento codificado (matriz, nombres) a partir de una ruta (ver
+    read_encoded_alignment), un dict nombre -> secuencia alineada, un
+    MultipleSeqAlignment o un par (matriz, nombres) ya codificado
+    """
+    if isinstance(alignment, (str, os.PathLike)):
+        return read_encoded_alignment(os.fspath(alignment))
+    if isinstance(alignment, tuple):
+        codes, labels = alignment
+        return codes, list(labels)
+    return encode_alignment(alignment)
+
+
+def is_nucleotide(codes, weights=None):
+    """
+    True si al menos el 90% de las letras son A, C, G, T, U o N (`weights`:
+    peso de cada columna, p. ej. patrones de sitio comprimidos)
+    """
+    if weights is None:
+        counts = np.bincount(codes.ravel(), minlength=256)
+    else:
+        column_weights = np.broadcast_to(np.asarray(weights, dtype=np.float64), codes.shape)
+        counts = np.bincount(codes.ravel(), weights=column_weights.ravel(), minlength=256)
+    letters = counts[ord('A'):ord('Z') + 1].sum() + counts[ord('a'):ord('z') + 1].sum()
+    nucleotides = sum(counts[c] + counts[c + 32] for c in b'ACGTUN')
+    return letters > 0 and nucleotides >= 0.9 * letters
+
+
+def distance_matrix(codes, model='identity', weights=None, rows=None):
+    """
+    Matriz de distancias n x n entre las filas de un alineamiento codificado.
+
+    - identity: 1 - coincidencias / longitud, comparando todos los
+      caracteres tal cual (igual que DistanceCalculator("identity")).
+    - p: proporción de diferencias, con eliminación por pares de los sitios
+      con gap o desconocidos ('N' en ADN, 'X').
+    - jc69: Jukes-Cantor, d = -3/4 ln(1 - 4/3 p), solo sitios A/C/G/T.
+    - k2p: Kimura 2 parámetros (transiciones P y transversiones Q),
+      d = -1/2 ln(1 - 2P - Q) - 1/4 ln(1 - 2Q), solo sitios A/C/G/T.
+
+    Los conteos se obtienen con productos de matrices indicadoras (un
+    símbolo por matriz) por bloques de sitios, para acotar la memoria.
+    `weights` da un peso por sitio (p. ej. patrones de sitio comprimidos).
+    Con `rows` (índices de filas) solo se calculan las distancias de esas
+    filas a todas: matriz len(rows) x n, p. ej. para taxones agregados.
+    """
+    if model not in MODELS:
+        raise ValueError(f"Modelo desconocido: {model}. Disponibles: {', '.join(MODELS)}")
+    n, sites = codes.shape
+    if weights is None:
+        weights = np.ones(sites)
+    weights = np.asarray(weights, dtype=np.float64)
+    rows = np.arange(n) if rows is None else np.asarray(rows, dtype=np.int64)
+    # Posiciones (fila, columna) de cada taxón consigo mismo
+    diagonal = (np.arange(len(rows)), rows)
+    if n == 0:
+        return np.zeros((0, 0))
+
+    if model == 'identity':
+        # Cada byte es su propia clase y no se descarta ningún sitio
+        lut = np.arange(256, dtype=np.int16)
+        matches = _count_pairs(codes, lut, weights, rows=rows)
+        total = weights.sum()
+        dist = np.ones((len(rows), n)) if total == 0 else 1.0 - matches / total
+        dist[diagonal] = 0.0
+        return dist
+
+    nucleotide = is_nucleotide(codes, weights)
+    if model in ('jc69', 'k2p'):
+        if not nucleotide:
+            raise ValueError(f"El modelo {model} solo se aplica a alineamientos de ADN/ARN")
+        lut = _nucleotide_lut()
+    else:
+        lut = _letter_lut(nucleotide)
+
+    valid = _count_pairs(codes, lut, weights, valid_only=True, rows=rows)
+    matches = _count_pairs(codes, lut, weights, rows=rows)
+    safe = np.maximum(valid, 1e-300)
+    p = np.where(valid > 0, (valid - matches) / safe, 0.0)
+
+    if model == 'p':
+        dist = p
+    elif model == 'jc69':
+        arg = 1.0 - 4.0 / 3.0 * p
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dist = np.where(arg > 0, -0.75 * np.log(np.maximum(arg, 1e-300)), MAX_DISTANCE)
+    else:
+        # Transiciones: A<->G y C<->T (códigos 0<->2 y 1<->3)
+        transitions = _count_pairs(codes, lut, weights, pairs=((0, 2), (2, 0), (1, 3), (3, 1)),
+                                   rows=rows)
+        P = np.where(valid > 0, transitions / safe, 0.0)
+        Q = p - P
+        a = 1.0 - 2.0 * P - Q
+        b = 1.0 - 2.0 * Q
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dist = np.where((a > 0) & (b > 0),
+                            -0.5 * np.log(np.maximum(a, 1e-300)) - 0.25 * np.log(np.maximum(b, 1e-300)),
+                            MAX_DISTANCE)
+
+    dist = np.minimum(np.maximum(dist, 0.0), MAX_DISTANCE)
+    dist[diagonal] = 0.0
+    return dist
+
+
+def alignment_distance_matrix(alignment, model='identity'):
+    """Matriz de distancias y nombres de un alineamiento (ruta o en memoria, ver load_alignment)"""
+    codes, labels = load_alignment(alignment)
+    return distance_matrix(codes, model), labels
+
+
+def _nucleotide_lut():
+    """A, C, G, T/U -> 0..3 (mayúsculas o minúsculas); el resto se descarta (-1)"""
+    lut = np.full(256, -1, dtype=np.int16)
+    for k, chars in enumerate((b'Aa', b'Cc', b'Gg', b'TtUu')):
+        for c in chars:
+            lut[c] = k
+    return lut
+
+
+def _letter_lut(nucleotide):
+    """Letras (sin distinguir mayúsculas) -> clase; gaps y desconocidos -> -1"""
+    lut = np.full(256, -1, dtype=np.int16)
+    for c in range(ord('A'), ord('Z') + 1):
+        lut[c] = lut[c + 32] = c - ord('A')
+    lut[ord('U')] = lut[ord('u')] = ord('T') - ord('A')
+    unknown = b'NX' if nucleotide else b'X'
+    for c in unknown + unknown.lower():
+        lut[c] = -1
+    for c in _GAPS:
+        lut[c] = -1
+    return lut
+
+
+def _count_pairs(codes, lut, weights, pairs=None, valid_only=False, rows=None):
+    """
+    Suma ponderada, para cada par de filas, de los sitios donde:
+    - valid_only: ambas tienen una clase válida (lut >= 0)
+    - pairs=None: ambas tienen la misma clase válida
+    - pairs=((a, b), ...): la fila i tiene la clase a y la fila j la b
+    Con `rows` la fila i recorre solo esas filas (matriz len(rows) x n).
+    """
+    n, sites = codes.shape
+    counts = np.zeros((n if rows is None else len(rows), n))
+    block = max(1, BLOCK_BYTES // (8 * max(n, 1)))
+    for start in range(0, sites, block):
+        classes = lut[codes[:, start:start + block]]
+        left = classes if rows is None else classes[rows]
+        w = weights[start:start + block]
+        if valid_only:
+            counts += ((left >= 0) * w) @ (classes >= 0).astype(np.float64).T
+            continue
+        if pairs is None:
+            used = np.unique(classes)
+            pairs_here = [(c, c) for c in used if c >= 0]
+        else:
+            pairs_here = pairs
+        indicators = {}
+        for a, b in pairs_here:
+            for c in (a, b):
+                if c not in indicators:
+                    indicators[c] = (classes == c).astype(np.float64)
+            left_a = indicators[a] if rows is None else indicators[a][rows]
+            counts += (left_a * w) @ indicators[b].T
+    return counts
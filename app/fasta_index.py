@@ -0,0 +1,228 @@
+import hashlib
+import mmap
+import os
+from collections import OrderedDict
+
+# Tamaño de los bloques leídos del archivo subido
+CHUNK_SIZE = 1 << 20
+
+# Bytes que no forman parte de una secuencia
+_WHITESPACE = b' \t\r\n\v\f'
+
+
+class FastaIndex:
+    """
+    Índice de un archivo FASTA al estilo de `samtools faidx` (archivo
+    .fai: nombre, largo, offset, bases por línea, bytes por línea). Las
+    secuencias se leen del archivo con mmap solo cuando se piden.
+
+    write_fasta() copia un FASTA desde un flujo en bloques, en una sola
+    pasada, dejando cada secuencia en una línea, así que cada secuencia es
+    un rango contiguo de bytes del archivo.
+    """
+
+    def __init__(self, path, entries=None):
+        self.path = path
+        self.entries = entries if entries is not None else OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def names(self):
+        return list(self.entries)
+
+    def length(self, name):
+        return self.entries[name][0]
+
+    @classmethod
+    def write_fasta(cls, stream, path, chunk_size=CHUNK_SIZE):
+        """
+        Guardar en `path` el FASTA leído de `stream` (binario) bloque a
+        bloque y devolver su índice. El nombre de cada registro es la
+        primera palabra de la cabecera (como record.id de Biopython); el
+        texto anterior a la primera cabecera se ignora.
+        """
+        entries = OrderedDict()
+        header = None
+        name = None
+        offset = length = 0
+        written = 0
+        line_start = True
+
+        with open(path, 'wb') as out:
+            def finish():
+                nonlocal written
+                if name is not None:
+                    out.write(b'\n')
+                    written += 1
+                    entries[name] = (length, offset, length, length + 1)
+
+            for chunk in iter(lambda: stream.read(chunk_size), b''):
+                pos = 0
+                while pos < len(chunk):
+                    if header is not None:
+                        # Dentro de una cabecera: hasta el fin de línea
+                        end = chunk.find(b'\n', pos)
+                        if end < 0:
+                            header += chunk[pos:]
+                            break
+                        header += chunk[pos:end]
+                        pos = end + 1
+                        line_start = True
+                        text = bytes(header).strip()
+                        header = None
+                        out.write(b'>' + text + b'\n')
+                        written += len(text) + 2
+                        words = text.split(None, 1)
+                        name = words[0].decode('utf-8', 'replace') if words else ''
+                        offset, length = written, 0
+                    elif line_start and chunk[pos:pos + 1] == b'>':
+                        finish()
+                        name = None
+                        header = bytearray()
+                        pos += 1
+                    else:
+                        # Secuencia hasta la próxima línea que empiece con '>'
+                        end = chunk.find(b'\n>', pos)
+                        end = end + 1 if end >= 0 else len(chunk)
+                        part = chunk[pos:end]
+                        line_start = part.endswith(b'\n')
+                        pos = end
+                        if name is not None:
+                            residues = part.translate(None, _WHITESPACE)
+                            out.write(residues)
+                            written += len(residues)
+                            length += len(residues)
+
+            if header is not None:
+                # Cabecera final sin salto de línea ni secuencia
+                text = bytes(header).strip()
+                out.write(b'>' + text + b'\n')
+                written += len(text) + 2
+                words = text.split(None, 1)
+                name = words[0].decode('utf-8', 'replace') if words else ''
+                offset, length = written, 0
+            finish()
+
+        index = cls(path, entries)
+        index.save()
+        return index
+
+    @classmethod
+    def build(cls, path):
+        """
+        Indexar un FASTA ya guardado en disco. Como en faidx, todas las
+        líneas de una secuencia deben tener el mismo largo salvo la última.
+        """
+        entries = OrderedDict()
+        name = None
+        offset = length = linebases = linewidth = 0
+        short = False
+        position = 0
+        with open(path, 'rb') as f:
+            for line in f:
+                if line.startswith(b'>'):
+                    if name is not None:
+                        entries[name] = (length, offset, linebases, linewidth)
+                    words = line[1:].split(None, 1)
+                    name = words[0].decode('utf-8', 'replace') if words else ''
+                    offset = position + len(line)
+                    length = linebases = linewidth = 0
+                    short = False
+                elif name is not None:
+                    bases = len(line.rstrip(b'\r\n'))
+                    if not linebases:
+                        linebases, linewidth = bases, len(line)
+                    elif short or bases > linebases:
+                        raise ValueError(f"Largo de línea irregular en la secuencia {name}")
+                    short = bases < linebases
+                    length += bases
+                position += len(line)
+        if name is not None:
+            entries[name] = (length, offset, linebases, linewidth)
+        index = cls(path, entries)
+        index.save()
+        return index
+
+    @classmethod
+    def open(cls, path):
+        """Leer el índice .fai de `path`, o crearlo si no existe"""
+        fai = f"{path}.fai"
+        if not os.path.exists(fai) or os.path.getmtime(fai) < os.path.getmtime(path):
+            return cls.build(path)
+        entries = OrderedDict()
+        with open(fai, encoding='utf-8') as f:
+            for line in f:
+                name, length, offset, linebases, linewidth = line.rstrip('\n').split('\t')
+                entries[name] = (int(length), int(offset), int(linebases), int(linewidth))
+        return cls(path, entries)
+
+    def save(self):
+        """Escribir el índice en `path`.fai"""
+        with open(f"{self.path}.fai", 'w', encoding='utf-8') as f:
+            for name, (length, offset, linebases, linewidth) in self.entries.items():
+                f.write(f"{name}\t{length}\t{offset}\t{linebases}\t{linewidth}\n")
+
+    def append(self, other):
+        """
+        Agregar al final de este archivo los registros de otro FASTA
+        indexado (copiados por bloques) y actualizar el índice
+        """
+        with open(self.path, 'ab') as out, open(other.path, 'rb') as source:
+            base = out.tell()
+            for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                out.write(chunk)
+        for name, (length, offset, linebases, linewidth) in other.entries.items():
+            self.entries[name] = (length, base + offset, linebases, linewidth)
+        self.save()
+
+    def fetch(self, name, buffer=None):
+        """Bytes de la secuencia `name` (sin saltos de línea)"""
+        length, offset, linebases, linewidth = self.entries[name]
+        if not length:
+            return b''
+        # Línea y columna del último residuo
+        line, column = divmod(length - 1, linebases)
+        end = offset + line * linewidth + column + 1
+        if buffer is not None:
+            data = buffer[offset:end]
+        else:
+            with open(self.path, 'rb') as f:
+                f.seek(offset)
+                data = f.read(end - offset)
+        return data if line == 0 else data.translate(None, _WHITESPACE)
+
+    def sequence(self, name):
+        """Secuencia `name` como texto"""
+        return self.fetch(name).decode('latin-1')
+
+    def sequences(self, names=None):
+        """dict nombre -> secuencia (texto), leyendo el archivo con mmap una sola vez"""
+        names = self.names() if names is None else names
+        if not names:
+            return {}
+        with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            return {name: self.fetch(name, buffer).decode('latin-1') for name in names}
+
+    def digest(self):
+        """
+        Hash (sha256) de las secuencias normalizadas: nombres y residuos en
+        orden, sin descripciones ni saltos de línea. Dos archivos con las
+        mismas secuencias tienen el mismo hash aunque cambie el formato.
+        """
+        h = hashlib.sha256()
+        if self.entries:
+            with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                for name in self.entries:
+                    h.update(b'>' + name.encode('utf-8') + b'\n')
+                    h.update(self.fetch(name, buffer))
+                    h.update(b'\n')
+        return h.hexdigest()
+
+
+def read_sequences(path):
+    """Secuencias de un FASTA (dict nombre -> texto) a través de su índice"""
+    return FastaIndex.open(path).sequences()
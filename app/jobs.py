@@ -0,0 +1,370 @@
+import copy
+import json
+import multiprocessing
+import os
+import queue
+import sqlite3
+import threading
+import uuid
+from collections import OrderedDict
+from contextlib import closing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+
+# Backends locales: procesos (por defecto) o hilos del mismo proceso
+BACKENDS = ('process', 'thread')
+
+# Trabajos terminados que se conservan para consultar su estado/resultado
+MAX_FINISHED_JOBS = 200
+
+# Estados de un trabajo
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = 'queued', 'running', 'done', 'failed', 'cancelled'
+FINISHED = (DONE, FAILED, CANCELLED)
+
+# Estado de cada proceso trabajador (se llena en _init_worker)
+_worker = {}
+
+
+class Job:
+    """Trabajo enviado a la cola: estado, avance (0-100) y resultado o error"""
+
+    FIELDS = ('id', 'kind', 'session_id', 'status', 'progress', 'message', 'result', 'error',
+              'created_at', 'started_at', 'finished_at')
+
+    def __init__(self, kind, session_id=None):
+        self.id = str(uuid.uuid4())
+        self.kind = kind
+        self.session_id = session_id
+        self.status = QUEUED
+        self.progress = 0.0
+        self.message = None
+        self.result = None
+        self.error = None
+        self.created_at = datetime.now().isoformat()
+        self.started_at = None
+        self.finished_at = None
+
+    @classmethod
+    def from_row(cls, row):
+        """Job a partir de una fila de la tabla jobs (columnas en el orden de FIELDS)"""
+        job = cls.__new__(cls)
+        for name, value in zip(cls.FIELDS, row):
+            setattr(job, name, value)
+        job.result = json.loads(job.result) if job.result is not None else None
+        return job
+
+    def to_dict(self, include_result=True):
+        data = {
+            'job_id': self.id,
+            'kind': self.kind,
+            'session_id': self.session_id,
+            'status': self.status,
+            'progress': round(self.progress, 1),
+            'message': self.message,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at
+        }
+        if self.status == DONE and include_result:
+            data['result'] = self.result
+        if self.status == FAILED:
+            data['error'] = self.error
+        return data
+
+
+class MemoryJobRegistry:
+    """Estado de los trabajos en memoria del proceso (un solo trabajador web)"""
+
+    shared = False
+
+    def __init__(self):
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, job):
+        with self._lock:
+            self._jobs[job.id] = job
+            self._forget_finished()
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return copy.copy(job) if job is not None else None
+
+    def list(self, session_id=None):
+        with self._lock:
+            return [copy.copy(job) for job in self._jobs.values()
+                    if session_id is None or job.session_id == session_id]
+
+    def status(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.status if job is not None else None
+
+    def report(self, job_id, percent, message=None, started=None):
+        """Marcar el trabajo en ejecución y actualizar su avance (si no terminó)"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status in FINISHED:
+                return
+            job.status = RUNNING
+            if started:
+                job.started_at = started
+            job.progress = max(job.progress, min(float(percent), 100.0))
+            if message is not None:
+                job.message = message
+
+    def finish(self, job_id, status, result=None, error=None):
+        """Dejar el trabajo terminado; False si no existe o ya había terminado"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status in FINISHED:
+                return False
+            job.status, job.result, job.error = status, result, error
+            if status == DONE:
+                job.progress = 100.0
+            job.finished_at = datetime.now().isoformat()
+            return True
+
+    def _forget_finished(self):
+        """Descartar los trabajos terminados más antiguos por encima del límite (con el lock tomado)"""
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in FINISHED]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job_id]
+
+
+class SQLiteJobRegistry:
+    """
+    Estado de los trabajos en una tabla `jobs` de SQLite (la misma base de
+    las sesiones): cualquier proceso web puede consultar o cancelar un
+    trabajo, aunque lo haya encolado otro. Solo guarda la ruta, así que
+    también se puede pasar a los procesos trabajadores.
+    """
+
+    shared = True
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("CREATE TABLE IF NOT EXISTS jobs ("
+                       "id TEXT PRIMARY KEY, kind TEXT NOT NULL, session_id TEXT, "
+                       "status TEXT NOT NULL, progress REAL NOT NULL, message TEXT, "
+                       "result TEXT, error TEXT, created_at TEXT NOT NULL, "
+                       "started_at TEXT, finished_at TEXT)")
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_session ON jobs (session_id)")
+
+    def _connect(self):
+        return closing(sqlite3.connect(self.path, timeout=30, isolation_level=None))
+
+    def add(self, job):
+        with self._connect() as db:
+            db.execute(f"INSERT INTO jobs ({', '.join(Job.FIELDS)}) VALUES ({', '.join('?' * len(Job.FIELDS))})",
+                       tuple(getattr(job, name) for name in Job.FIELDS))
+            # Conservar solo los MAX_FINISHED_JOBS terminados más recientes
+            db.execute(f"DELETE FROM jobs WHERE id IN (SELECT id FROM jobs WHERE status IN "
+                       f"({', '.join('?' * len(FINISHED))}) ORDER BY finished_at DESC "
+                       f"LIMIT -1 OFFSET ?)", FINISHED + (MAX_FINISHED_JOBS,))
+
+    def get(self, job_id):
+        with self._connect() as db:
+            row = db.execute(f"SELECT {', '.join(Job.FIELDS)} FROM jobs WHERE id = ?",
+                             (job_id,)).fetchone()
+        return Job.from_row(row) if row is not None else None
+
+    def list(self, session_id=None):
+        query = f"SELECT {', '.join(Job.FIELDS)} FROM jobs"
+        args = ()
+        if session_id is not None:
+            query, args = query + " WHERE session_id = ?", (session_id,)
+        with self._connect() as db:
+            rows = db.execute(query + " ORDER BY created_at, rowid", args).fetchall()
+        return [Job.from_row(row) for row in rows]
+
+    def status(self, job_id):
+        with self._connect() as db:
+            row = db.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    def report(self, job_id, percent, message=None, started=None):
+        """Marcar el trabajo en ejecución y actualizar su avance (si no terminó)"""
+        with self._connect() as db:
+            db.execute(f"UPDATE jobs SET status = ?, progress = MAX(progress, ?), "
+                       f"message = COALESCE(?, message), started_at = COALESCE(?, started_at) "
+                       f"WHERE id = ? AND status NOT IN ({', '.join('?' * len(FINISHED))})",
+                       (RUNNING, min(float(percent), 100.0), message, started, job_id) + FINISHED)
+
+    def finish(self, job_id, status, result=None, error=None):
+        """Dejar el trabajo terminado; False si no existe o ya había terminado"""
+        with self._connect() as db:
+            return db.execute(
+                f"UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, "
+                f"progress = CASE WHEN ? THEN 100.0 ELSE progress END "
+                f"WHERE id = ? AND status NOT IN ({', '.join('?' * len(FINISHED))})",
+                (status, json.dumps(result) if result is not None else None, error,
+                 datetime.now().isoformat(), status == DONE, job_id) + FINISHED).rowcount > 0
+
+
+class JobQueue:
+    """
+    Cola de trabajos local, sin broker externo: un pool acotado de
+    `workers` procesos (o hilos con backend='thread') creado con el primer
+    trabajo. Los trabajadores informan su avance por una cola que un hilo
+    del proceso principal vuelca en el registro de trabajos.
+
+    El estado de los trabajos vive en `registry`: en memoria
+    (MemoryJobRegistry) o en SQLite (SQLiteJobRegistry), compartido por
+    varios procesos web; cada trabajo se ejecuta en el pool del proceso que
+    lo encoló, pero se puede consultar y cancelar desde cualquiera.
+
+    `func(*args, progress=...)` se ejecuta en el trabajador y debe poder
+    serializarse (función de módulo); `on_success(resultado)` corre en el
+    proceso principal al terminar y su valor queda como resultado del
+    trabajo (p. ej. para guardarlo en la sesión). Si el resultado se
+    descarta (trabajo cancelado o on_success falló), se llama a
+    `on_discard(resultado)` para limpiar lo que el trabajo haya escrito.
+
+    Un trabajo en cola se cancela sin ejecutarse; uno en ejecución no se
+    puede interrumpir, se marca como cancelado y su resultado se descarta.
+    """
+
+    def __init__(self, workers=None, backend='process', registry=None):
+        if backend not in BACKENDS:
+            raise ValueError(f"Backend de trabajos desconocido: {backend}")
+        self.workers = workers or 1
+        self.backend = backend
+        self.registry = registry if registry is not None else MemoryJobRegistry()
+        # Futuros y callbacks de los trabajos encolados por este proceso
+        self._local = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self._progress = None
+
+    def _start(self):
+        """Crear el pool y el hilo que lee los avances (con el lock tomado)"""
+        if self.backend == 'process':
+            self._progress = multiprocessing.Queue()
+            self._executor = ProcessPoolExecutor(self.workers, initializer=_init_worker,
+                                                 initargs=(self._progress,))
+        else:
+            self._progress = queue.Queue()
+            self._executor = ThreadPoolExecutor(self.workers, initializer=_init_worker,
+                                                initargs=(self._progress,))
+        threading.Thread(target=self._listen, daemon=True).start()
+
+    def submit(self, kind, func, args=(), session_id=None, on_success=None, on_discard=None):
+        """Encolar func(*args) y devolver el Job sin esperar a que termine"""
+        job = Job(kind, session_id)
+        self.registry.add(job)
+        # El trabajador revisa el registro compartido antes de empezar, por
+        # si otro proceso canceló el trabajo mientras estaba en cola
+        shared = self.registry if self.registry.shared else None
+        with self._lock:
+            if self._executor is None:
+                self._start()
+            future = self._executor.submit(_run, job.id, func, args, shared)
+            self._local[job.id] = (future, on_success, on_discard)
+        future.add_done_callback(lambda future: self._finish(job.id, future))
+        return job
+
+    def get(self, job_id):
+        return self.registry.get(job_id)
+
+    def jobs(self, session_id=None):
+        """Trabajos (de una sesión o todos), del más antiguo al más reciente"""
+        return self.registry.list(session_id)
+
+    def cancel(self, job_id):
+        """Cancelar un trabajo; devuelve False si no existe o ya había terminado"""
+        if not self.registry.finish(job_id, CANCELLED):
+            return False
+        with self._lock:
+            local = self._local.get(job_id)
+        # Fuera del lock: cancel() llama en el acto a _finish si estaba en cola
+        if local is not None:
+            local[0].cancel()
+        return True
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            queued = [job_id for job_id in self._local
+                      if self.registry.status(job_id) == QUEUED]
+        for job_id in queued:
+            self.cancel(job_id)
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+            self._progress.put(None)
+
+    def _finish(self, job_id, future):
+        """Guardar resultado o error al terminar (proceso principal)"""
+        with self._lock:
+            _, on_success, on_discard = self._local.pop(job_id)
+        produced = None
+        if not future.cancelled() and future.exception() is None:
+            produced = future.result()
+        if self.registry.status(job_id) in FINISHED:
+            # Cancelado mientras corría: lo escrito por el trabajo no se usa
+            if produced is not None and on_discard is not None:
+                on_discard(produced)
+            return
+
+        status, result, error = DONE, None, None
+        if future.cancelled():
+            status = CANCELLED
+        elif future.exception() is not None:
+            status, error = FAILED, str(future.exception())
+        else:
+            try:
+                result = on_success(produced) if on_success is not None else produced
+            except Exception as e:
+                status, error = FAILED, str(e)
+                if on_discard is not None:
+                    on_discard(produced)
+        self.registry.finish(job_id, status, result, error)
+
+    def _listen(self):
+        """Volcar en el registro los avances que envían los trabajadores"""
+        progress = self._progress
+        while True:
+            item = progress.get()
+            if item is None:
+                return
+            job_id, percent, message, started = item
+            try:
+                self.registry.report(job_id, percent, message, started)
+            except sqlite3.Error:
+                # El avance es informativo: si la base está ocupada se
+                # espera al siguiente
+                continue
+
+
+def create_job_queue(config):
+    """Cola de trabajos según la configuración (JOB_*); comparte la base de sesiones SQLite si la hay"""
+    registry = None
+    if config.get('SESSION_BACKEND', 'sqlite') == 'sqlite':
+        registry = SQLiteJobRegistry(config['SESSION_DB'])
+    return JobQueue(config.get('JOB_WORKERS'), config.get('JOB_BACKEND', 'process'), registry)
+
+
+def _init_worker(progress):
+    """Guardar en el trabajador la cola de avances"""
+    _worker['progress'] = progress
+
+
+def _run(job_id, func, args, registry=None):
+    """
+    Ejecutar un trabajo en el trabajador, informando su avance; con un
+    registro compartido, no se ejecuta si ya fue cancelado
+    """
+    if registry is not None and registry.status(job_id) in FINISHED:
+        return None
+    progress = _worker['progress']
+
+    def report(percent, message=None):
+        progress.put((job_id, percent, message, None))
+
+    progress.put((job_id, 0, None, datetime.now().isoformat()))
+    return func(*args, progress=report)
@@ -0,0 +1,190 @@
+import math
+import numpy as np
+
+# Tamaño máximo del vector de conteos (alfabeto ** k)
+MAX_KMER_SPACE = 1 << 12
+
+# Parámetros por defecto de los sketches MinHash (como Mash)
+MINHASH_K = 21
+SKETCH_SIZE = 1024
+
+# Límites de los parámetros que acepta la API (k-mers más largos no aportan
+# y los sketches más grandes solo gastan memoria)
+MAX_MINHASH_K = 32
+MAX_SKETCH_SIZE = 1 << 16
+
+# Filas por bloque al comparar sketches, para acotar la memoria
+SKETCH_BLOCK = 256
+
+_EMPTY_BIN = np.uint64(0xFFFFFFFFFFFFFFFF)
+
+
+def encode_sequences(sequences):
+    """
+    Codificar secuencias (dict nombre -> secuencia) a arreglos de índices
+    sobre el alfabeto de letras presentes. Los caracteres que no son letras
+    (gaps, '*', etc.) se marcan con -1 y cortan los k-mers.
+    Devuelve (nombres, lista de arreglos, tamaño del alfabeto).
+    """
+    labels = list(sequences.keys())
+    raws = [np.frombuffer(str(sequences[name]).upper().encode('latin-1', 'replace'),
+                          dtype=np.uint8) for name in labels]
+
+    present = np.zeros(256, dtype=bool)
+    for raw in raws:
+        present[raw] = True
+    letters = np.zeros(256, dtype=bool)
+    letters[ord('A'):ord('Z') + 1] = True
+    present &= letters
+
+    lookup = np.full(256, -1, dtype=np.int64)
+    lookup[present] = np.arange(np.count_nonzero(present))
+    return labels, [lookup[raw] for raw in raws], max(1, int(np.count_nonzero(present)))
+
+
+def kmer_codes(codes, k, alphabet_size):
+    """
+    Índices enteros (uint64) de todos los k-mers válidos de una secuencia
+    codificada, calculados con desplazamientos vectorizados (sin recorrer en
+    Python). Para k grandes el valor desborda de forma determinista, lo que
+    no afecta al hashing.
+    """
+    n = len(codes) - k + 1
+    if n <= 0:
+        return np.empty(0, dtype=np.uint64)
+    values = np.zeros(n, dtype=np.uint64)
+    valid = np.ones(n, dtype=bool)
+    base = np.uint64(alphabet_size)
+    for offset in range(k):
+        window = codes[offset:offset + n]
+        values = values * base + np.maximum(window, 0).astype(np.uint64)
+        valid &= window >= 0
+    return values[valid]
+
+
+def hash64(values, seed=0):
+    """Hash de 64 bits vectorizado (finalizador de splitmix64)"""
+    x = values.astype(np.uint64) + np.uint64((0x9E3779B97F4A7C15 * (seed + 1)) & 0xFFFFFFFFFFFFFFFF)
+    x ^= x >> np.uint64(30)
+    x *= np.uint64(0xBF58476D1CE4E5B9)
+    x ^= x >> np.uint64(27)
+    x *= np.uint64(0x94D049BB133111EB)
+    x ^= x >> np.uint64(31)
+    return x
+
+
+def default_k(alphabet_size):
+    """Mayor k tal que alfabeto ** k no supere MAX_KMER_SPACE (máximo 6)"""
+    if alphabet_size <= 1:
+        return 1
+    return max(1, min(6, int(math.log(MAX_KMER_SPACE) / math.log(alphabet_size))))
+
+
+def kmer_count_vectors(sequences, k=None):
+    """
+    Vectores de conteo de k-mers (n x alfabeto**k).
+    Devuelve (matriz de conteos, nombres, k).
+    """
+    labels, encoded, alphabet_size = encode_sequences(sequences)
+    if k is None:
+        k = default_k(alphabet_size)
+    space = alphabet_size ** k
+    counts = np.zeros((len(labels), space), dtype=np.float64)
+    for row, codes in enumerate(encoded):
+        kmers = kmer_codes(codes, k, alphabet_size).astype(np.int64)
+        counts[row] = np.bincount(kmers, minlength=space)
+    return counts, labels, k
+
+
+def kmer_distance_matrix(sequences, k=None, rows=None):
+    """
+    Distancia k-mer sin alineamiento (Edgar, 2004): 1 - fracción de k-mers
+    compartidos, F = sum(min(c_a, c_b)) / (min(L_a, L_b) - k + 1).
+    Devuelve (matriz NumPy n x n, nombres); con `rows` (índices) solo las
+    distancias de esas secuencias a todas (len(rows) x n).
+    """
+    counts, labels, k = kmer_count_vectors(sequences, k)
+    totals = counts.sum(axis=1)
+    n = len(labels)
+    if rows is not None:
+        matrix = np.zeros((len(rows), n))
+        for row, i in enumerate(rows):
+            shared = np.minimum(counts[i], counts).sum(axis=1)
+            denom = np.maximum(np.minimum(totals[i], totals), 1.0)
+            matrix[row] = 1.0 - shared / denom
+            matrix[row, i] = 0.0
+        return matrix, labels
+    matrix = np.zeros((n, n))
+    for i in range(1, n):
+        shared = np.minimum(counts[i], counts[:i]).sum(axis=1)
+        denom = np.maximum(np.minimum(totals[i], totals[:i]), 1.0)
+        matrix[i, :i] = 1.0 - shared / denom
+    matrix = matrix + matrix.T
+    return matrix, labels
+
+
+def minhash_sketches(sequences, k=MINHASH_K, sketch_size=SKETCH_SIZE, seed=0):
+    """
+    Sketches MinHash de una permutación: el espacio de hashes se divide en
+    `sketch_size` intervalos (potencia de 2) y se guarda el mínimo de cada
+    uno. Un solo hash por k-mer, todo vectorizado con NumPy.
+    Devuelve (matriz n x sketch_size uint64, nombres); los intervalos vacíos
+    valen 2**64 - 1.
+    """
+    if sketch_size < 1 or sketch_size & (sketch_size - 1):
+        raise ValueError("sketch_size debe ser una potencia de 2")
+    labels, encoded, alphabet_size = encode_sequences(sequences)
+    shift = np.uint64(64 - int(math.log2(sketch_size))) if sketch_size > 1 else None
+
+    sketches = np.full((len(labels), sketch_size), _EMPTY_BIN, dtype=np.uint64)
+    for row, codes in enumerate(encoded):
+        hashes = np.unique(hash64(kmer_codes(codes, k, alphabet_size), seed))
+        if len(hashes) == 0:
+            continue
+        if shift is None:
+            sketches[row, 0] = hashes[0]
+            continue
+        # Los hashes ordenados quedan agrupados por intervalo (bits altos):
+        # el primero de cada grupo es el mínimo del intervalo
+        bins = (hashes >> shift).astype(np.int64)
+        used, first = np.unique(bins, return_index=True)
+        sketches[row, used] = hashes[first]
+    return sketches, labels
+
+
+def sketch_jaccard_matrix(sketches, rows=None):
+    """
+    Índice de Jaccard estimado entre todos los pares de sketches:
+    intervalos con el mismo mínimo / intervalos no vacíos en alguno.
+    Se procesa por bloques de filas para acotar la memoria; con `rows`
+    solo esas filas contra todas (len(rows) x n).
+    """
+    n = sketches.shape[0]
+    rows = np.arange(n) if rows is None else np.asarray(rows, dtype=np.int64)
+    jaccard = np.zeros((len(rows), n))
+    filled = sketches != _EMPTY_BIN
+    for start in range(0, len(rows), SKETCH_BLOCK):
+        chosen = rows[start:start + SKETCH_BLOCK]
+        block = sketches[chosen, None, :]
+        block_filled = filled[chosen, None, :]
+        equal = ((block == sketches[None, :, :]) & block_filled).sum(axis=2)
+        union = (block_filled | filled[None, :, :]).sum(axis=2)
+        jaccard[start:start + SKETCH_BLOCK] = equal / np.maximum(union, 1)
+    return jaccard
+
+
+def mash_distance_matrix(sequences, k=MINHASH_K, sketch_size=SKETCH_SIZE, seed=0, rows=None):
+    """
+    Distancia de Mash (Ondov et al., 2016) a partir de sketches MinHash:
+    d = -1/k * ln(2J / (1 + J)), con d = 1 cuando no comparten k-mers.
+    Devuelve (matriz NumPy n x n, nombres); con `rows` (índices) solo las
+    distancias de esas secuencias a todas (len(rows) x n).
+    """
+    sketches, labels = minhash_sketches(sequences, k, sketch_size, seed)
+    rows = np.arange(len(labels)) if rows is None else np.asarray(rows, dtype=np.int64)
+    jaccard = sketch_jaccard_matrix(sketches, rows)
+    with np.errstate(divide='ignore'):
+        distances = -np.log(2 * jaccard / (1 + jaccard)) / k
+    distances = np.minimum(distances, 1.0)
+    distances[np.arange(len(rows)), rows] = 0.0
+    return distances, labels
@@ -0,0 +1,450 @@
+import numpy as np
+from scipy.optimize import minimize
+from app.compact_tree import CompactTree
+from app.distance_models import is_nucleotide
+
+# Longitudes de rama permitidas durante la optimización
+MIN_BRANCH = 1e-8
+MAX_BRANCH = 10.0
+
+# Rondas de optimización de ramas y mejora mínima de log-verosimilitud
+# para seguir iterando
+MAX_ROUNDS = 8
+TOLERANCE = 1e-2
+
+# Los parciales se reescalan solo cuando algún patrón baja de este valor
+SCALE_THRESHOLD = 1e-100
+
+# Rondas de búsqueda NNI (cada una revisa todas las aristas internas)
+NNI_ROUNDS = 10
+
+# Aristas (en saltos) alrededor de un taxón insertado que revisa local_search
+LOCAL_RADIUS = 2
+
+_AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+
+# Códigos de ambigüedad: carácter -> estados posibles
+_NUCLEOTIDE_CODES = {
+    'A': 'A', 'C': 'C', 'G': 'G', 'T': 'T', 'U': 'T',
+    'R': 'AG', 'Y': 'CT', 'S': 'CG', 'W': 'AT', 'K': 'GT', 'M': 'AC',
+    'B': 'CGT', 'D': 'AGT', 'H': 'ACT', 'V': 'ACG',
+}
+_AMINO_ACID_CODES = dict({c: c for c in _AMINO_ACIDS}, B='DN', Z='EQ', J='IL')
+
+
+def state_table(nucleotide):
+    """
+    Vectores de hoja por byte: (clase de cada byte, vectores de cada clase).
+    Cada clase es un vector 0/1 sobre los estados (ACGT o los 20
+    aminoácidos); gaps, N, X y cualquier otro carácter son todo unos.
+    """
+    states = 'ACGT' if nucleotide else _AMINO_ACIDS
+    codes = _NUCLEOTIDE_CODES if nucleotide else _AMINO_ACID_CODES
+    vectors = [np.ones(len(states))]
+    byte_class = np.zeros(256, dtype=np.uint8)
+    for char, allowed in codes.items():
+        vector = np.array([float(s in allowed) for s in states])
+        vectors.append(vector)
+        byte_class[ord(char)] = byte_class[ord(char.lower())] = len(vectors) - 1
+    return byte_class, np.array(vectors)
+
+
+def compress_patterns(codes, weights=None):
+    """
+    Comprimir las columnas de un alineamiento codificado (taxones x sitios,
+    bytes o clases) en patrones de sitio únicos; `weights` da un peso por
+    sitio. Devuelve (patrones taxones x patrones, peso de cada patrón).
+    """
+    n, sites = codes.shape
+    if weights is None:
+        weights = np.ones(sites)
+    if sites == 0:
+        return np.zeros((n, 0), dtype=codes.dtype), np.zeros(0)
+    columns = np.ascontiguousarray(codes.T)
+    keys = columns.view(np.dtype((np.void, columns.dtype.itemsize * n))).ravel()
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    pattern_weights = np.bincount(inverse.ravel(), weights=weights, minlength=len(first))
+    return columns[first].T.copy(), pattern_weights
+
+
+class TreeLikelihood:
+    """
+    Verosimilitud de Felsenstein de un alineamiento sobre un árbol sin raíz,
+    con el modelo JC69 (ADN) o su equivalente de 20 estados (Poisson, para
+    proteínas): frecuencias iguales y P(t) = e I + (1 - e)/K, con
+    e = exp(-K/(K-1) t).
+
+    Las columnas se comprimen en patrones de sitio con peso, y cada
+    vector parcial es un arreglo estados x patrones que se calcula para
+    todos los patrones a la vez. Cuando un parcial se acerca al underflow
+    se reescala y la escala se acumula en logaritmos por patrón.
+
+    El árbol se guarda como lista de vecinos con una longitud por arista;
+    el mensaje (u -> v) es el parcial del lado de u al quitar la arista u-v.
+    Los mensajes se guardan en caché por arista dirigida y solo se calculan
+    cuando se piden. Cambiar una rama o la topología marca como sucios
+    (los descarta) los mensajes que salen de ese punto, y la propagación se
+    detiene en los que ya estaban sucios: un mensaje válido siempre tiene
+    válidas sus entradas. Así, tras un cambio local solo se recalcula el
+    camino hasta la arista donde se evalúa.
+    """
+
+    def __init__(self, tree, codes, labels, weights=None):
+        row_of = {name: k for k, name in enumerate(labels)}
+        self.nucleotide = is_nucleotide(codes, weights)
+        byte_class, vectors = state_table(self.nucleotide)
+        # Estados x clases, para que los parciales de hoja salgan contiguos
+        self.vectors = np.ascontiguousarray(vectors.T)
+        self.K = self.vectors.shape[0]
+        self.beta = self.K / (self.K - 1.0)
+        self.patterns, self.weights = compress_patterns(byte_class[codes], weights)
+        self._no_scale = np.zeros(self.n_patterns)
+
+        self.tree = tree
+        self.root = tree.root
+        size = len(tree)
+        self.adj = [[] for _ in range(size)]
+        self.length = {}
+        # Soporte de cada arista (el del nodo de abajo en el árbol original)
+        self.support = {}
+        lengths = np.clip(np.nan_to_num(tree.branch_length), MIN_BRANCH, MAX_BRANCH)
+        for node in range(size):
+            up = int(tree.parent[node])
+            if up >= 0:
+                self.adj[node].append(up)
+                self.adj[up].append(node)
+                self.length[_edge(node, up)] = float(lengths[node])
+                self.support[_edge(node, up)] = float(tree.support[node])
+
+        # Fila del alineamiento de cada hoja
+        self.tip_row = {}
+        for node in tree.leaves().tolist():
+            name = tree.name(node)
+            if name not in row_of:
+                raise ValueError(f"La hoja '{name}' no está en el alineamiento")
+            self.tip_row[node] = row_of[name]
+
+        # Caché de mensajes por arista dirigida y número de NNI aplicados
+        self._messages = {}
+        self.swaps = 0
+
+    @property
+    def n_patterns(self):
+        return self.patterns.shape[1]
+
+    def edges(self):
+        """Aristas (hijo, padre) en pre-orden desde la raíz"""
+        out = []
+        stack = [(self.root, -1)]
+        while stack:
+            node, up = stack.pop()
+            if up >= 0:
+                out.append((node, up))
+            stack.extend((w, node) for w in reversed(self.adj[node]) if w != up)
+        return out
+
+    def _tip(self, node):
+        return self.vectors.take(self.patterns[self.tip_row[node]], axis=1)
+
+    def _transition(self, partial, t):
+        """P(t) aplicado a cada patrón de un parcial, en O(K x patrones)"""
+        e = np.exp(-self.beta * t)
+        mixed = partial.sum(axis=0)
+        mixed *= (1.0 - e) / self.K
+        out = partial * e
+        out += mixed
+        return out
+
+    def _join(self, parts):
+        """Producto de mensajes [(mensaje, longitud de su rama)], reescalado si hace falta"""
+        partial = None
+        scale = np.zeros(self.n_patterns)
+        for (child, child_scale), t in parts:
+            term = self._transition(child, t)
+            partial = term if partial is None else partial * term
+            scale += child_scale
+        if partial is None:
+            return np.ones((self.K, self.n_patterns)), scale
+        peak = partial.max(axis=0)
+        if peak.min() < SCALE_THRESHOLD:
+            peak[peak <= 0] = 1.0
+            partial /= peak
+            scale += np.log(peak)
+        return partial, scale
+
+    def _message(self, u, v):
+        """
+        Mensaje (u -> v). Se calculan, de las hojas hacia u y sin
+        recursión, solo los mensajes que faltan en la caché.
+        """
+        if u in self.tip_row:
+            return self._tip(u), self._no_scale
+        missing = []
+        stack = [(u, v)]
+        while stack:
+            x, y = stack.pop()
+            if x in self.tip_row or (x, y) in self._messages:
+                continue
+            missing.append((x, y))
+            stack.extend((w, x) for w in self.adj[x] if w != y)
+        for x, y in reversed(missing):
+            self._messages[(x, y)] = self._join(
+                [(self._input(w, x), self.length[_edge(w, x)]) for w in self.adj[x] if w != y])
+        return self._messages[(u, v)]
+
+    def _input(self, w, x):
+        """Mensaje (w -> x) ya disponible: vector de hoja o caché"""
+        if w in self.tip_row:
+            return self._tip(w), self._no_scale
+        return self._messages[(w, x)]
+
+    def _invalidate(self, pairs):
+        """Descartar los mensajes dados y los que dependen de ellos (se alejan del cambio)"""
+        stack = list(pairs)
+        while stack:
+            x, y = stack.pop()
+            if self._messages.pop((x, y), None) is None:
+                continue
+            stack.extend((y, z) for z in self.adj[y] if z != x)
+
+    def set_length(self, u, v, t):
+        """Cambiar la longitud de la arista u-v y marcar sucio lo que depende de ella"""
+        self.length[_edge(u, v)] = t
+        self._invalidate([(u, w) for w in self.adj[u] if w != v] +
+                         [(v, w) for w in self.adj[v] if w != u])
+
+    def _edge_terms(self, forward, backward):
+        """
+        Términos de la verosimilitud sobre una arista a partir de sus dos
+        mensajes X = (u -> v) e Y = (v -> u): cada patrón vale
+        e A + (1 - e) B con A = sum(X Y) / K y B = sum(X) sum(Y) / K^2,
+        más la escala.
+        """
+        (X, sx), (Y, sy) = forward, backward
+        A = (X * Y).sum(axis=0) / self.K
+        B = X.sum(axis=0) * Y.sum(axis=0) / self.K ** 2
+        return A, B, float(self.weights @ (sx + sy))
+
+    def _edge_log_likelihood(self, t, A, B, scale):
+        e = np.exp(-self.beta * t)
+        return float(self.weights @ np.log(e * A + (1.0 - e) * B)) + scale
+
+    def log_likelihood(self):
+        """
+        Log-verosimilitud con las longitudes actuales, evaluada siempre en
+        la primera arista de la raíz (tras un cambio local solo se recalcula
+        el camino hasta ella)
+        """
+        if not self.length:
+            tip = self._tip(self.root)
+            return float(self.weights @ np.log(tip.sum(axis=0) / self.K))
+        u = self.root
+        v = self.adj[u][0]
+        A, B, scale = self._edge_terms(self._message(u, v), self._message(v, u))
+        return self._edge_log_likelihood(self.length[_edge(u, v)], A, B, scale)
+
+    def _optimize_length(self, forward, backward, start):
+        """
+        Longitud de máxima verosimilitud de una arista dados sus dos
+        mensajes, con scipy.optimize.minimize y gradiente analítico. Cada
+        evaluación cuesta O(patrones). Devuelve (log-verosimilitud, longitud).
+        """
+        A, B, scale = self._edge_terms(forward, backward)
+        w = self.weights
+        beta = self.beta
+
+        def objective(x):
+            e = np.exp(-beta * x[0])
+            L = e * A + (1.0 - e) * B
+            value = -float(w @ np.log(L))
+            gradient = beta * e * float(w @ ((A - B) / L))
+            return value, np.array([gradient])
+
+        result = minimize(objective, [start], jac=True, method='L-BFGS-B',
+                          bounds=[(MIN_BRANCH, MAX_BRANCH)])
+        t = float(result.x[0]) if result.fun <= objective([start])[0] else start
+        return self._edge_log_likelihood(t, A, B, scale), t
+
+    def optimize_edge(self, u, v):
+        """
+        Optimizar la longitud de la arista u-v con el resto fijo.
+        Devuelve la log-verosimilitud resultante.
+        """
+        start = self.length[_edge(u, v)]
+        value, t = self._optimize_length(self._message(u, v), self._message(v, u), start)
+        if t != start:
+            self.set_length(u, v, t)
+        return value
+
+    def optimize_branches(self, rounds=MAX_ROUNDS, tolerance=TOLERANCE):
+        """
+        Optimizar las ramas una a una (ascenso por coordenadas) hasta que una
+        ronda completa mejore menos que `tolerance`. Devuelve la
+        log-verosimilitud final.
+
+        Las aristas se recorren en pre-orden, de modo que cada cambio solo
+        obliga a recalcular unos pocos mensajes de la caché y la ronda
+        cuesta O(taxones x patrones).
+        """
+        current = self.log_likelihood()
+        for _ in range(rounds):
+            if not self.length:
+                break
+            value = current
+            for u, v in self.edges():
+                value = self.optimize_edge(u, v)
+            improved = value - current
+            current = value
+            if improved < tolerance:
+                break
+        return current
+
+    def _nni(self, u, v):
+        """
+        Mejor de las tres topologías en torno a la arista interna u-v
+        (la actual y sus dos NNI), optimizando la longitud central.
+
+        Se evalúan con los cuatro mensajes que llegan desde los subárboles,
+        que no cambian con el intercambio, sin tocar el árbol. Devuelve
+        (log-verosimilitud, longitud, intercambio) con intercambio = None o
+        el par (x, y) de vecinos de u y de v a intercambiar.
+        """
+        a1, a2 = [w for w in self.adj[u] if w != v]
+        b1, b2 = [w for w in self.adj[v] if w != u]
+        inward = {w: (self._message(w, u), self.length[_edge(w, u)]) for w in (a1, a2)}
+        inward.update({w: (self._message(w, v), self.length[_edge(w, v)]) for w in (b1, b2)})
+        start = self.length[_edge(u, v)]
+        best = None
+        for (p, q, r, s), swap in (((a1, a2, b1, b2), None),
+                                   ((a1, b1, a2, b2), (a2, b1)),
+                                   ((a1, b2, b1, a2), (a2, b2))):
+            value, t = self._optimize_length(self._join([inward[p], inward[q]]),
+                                             self._join([inward[r], inward[s]]), start)
+            if best is None or value > best[0]:
+                best = (value, t, swap)
+        return best
+
+    def _swap(self, u, x, v, y):
+        """
+        NNI: intercambiar el vecino x de u con el vecino y de v (cada
+        subárbol conserva su rama y su soporte; la arista u-v cambia de
+        bipartición y pierde el suyo)
+        """
+        self._invalidate([(u, w) for w in self.adj[u]] + [(v, w) for w in self.adj[v]])
+        self._messages.pop((x, u), None)
+        self._messages.pop((y, v), None)
+        length_x = self.length.pop(_edge(u, x))
+        length_y = self.length.pop(_edge(v, y))
+        self.adj[u][self.adj[u].index(x)] = y
+        self.adj[v][self.adj[v].index(y)] = x
+        self.adj[x][self.adj[x].index(u)] = v
+        self.adj[y][self.adj[y].index(v)] = u
+        self.length[_edge(v, x)] = length_x
+        self.length[_edge(u, y)] = length_y
+        self.support[_edge(v, x)] = self.support.pop(_edge(u, x))
+        self.support[_edge(u, y)] = self.support.pop(_edge(v, y))
+        self.support[_edge(u, v)] = np.nan
+        self.swaps += 1
+
+    def nni_search(self, rounds=NNI_ROUNDS, tolerance=TOLERANCE):
+        """
+        Búsqueda de topología por ascenso con NNI: en cada ronda se revisan
+        todas las aristas internas y se aplica el NNI (o la longitud central)
+        que mejore la verosimilitud; luego se reoptimizan todas las ramas.
+        Termina cuando una ronda no aplica ningún NNI. Devuelve la
+        log-verosimilitud final.
+        """
+        current = self.optimize_branches()
+        for _ in range(rounds):
+            applied = 0
+            for u, v in self.edges():
+                # Solo aristas internas de un árbol binario; tras un NNI la
+                # arista de la lista puede haber dejado de existir
+                if len(self.adj[u]) != 3 or len(self.adj[v]) != 3 or v not in self.adj[u]:
+                    continue
+                value, t, swap = self._nni(u, v)
+                if swap is not None and value > current + tolerance:
+                    self._swap(u, swap[0], v, swap[1])
+                    self.set_length(u, v, t)
+                    current = value
+                    applied += 1
+                elif swap is not None:
+                    # El NNI no mejora lo suficiente: la longitud `t` es la
+                    # de la otra topología, así que se reoptimiza la actual
+                    current = self.optimize_edge(u, v)
+                elif value > current:
+                    self.set_length(u, v, t)
+                    current = value
+            current = self.optimize_branches()
+            if not applied:
+                break
+        return current
+
+    def local_search(self, nodes, radius=LOCAL_RADIUS, rounds=NNI_ROUNDS, tolerance=TOLERANCE):
+        """
+        Refinamiento local (p. ej. tras insertar taxones): solo se revisan
+        las aristas a menos de `radius` saltos de `nodes`; se optimiza su
+        longitud y se aplica el NNI que mejore la verosimilitud en las
+        internas. Termina cuando una ronda no aplica ningún NNI. Devuelve
+        la log-verosimilitud final.
+        """
+        current = self.log_likelihood()
+        for _ in range(rounds):
+            applied = 0
+            for u, v in self._edges_near(nodes, radius):
+                if v not in self.adj[u]:
+                    continue
+                current = self.optimize_edge(u, v)
+                if len(self.adj[u]) != 3 or len(self.adj[v]) != 3:
+                    continue
+                value, t, swap = self._nni(u, v)
+                if swap is not None and value > current + tolerance:
+                    self._swap(u, swap[0], v, swap[1])
+                    self.set_length(u, v, t)
+                    current = value
+                    applied += 1
+            if not applied:
+                break
+        return current
+
+    def _edges_near(self, nodes, radius):
+        """Aristas con algún extremo a menos de `radius` saltos de `nodes`"""
+        seen = {node: 0 for node in nodes}
+        frontier = list(nodes)
+        edges, listed = [], set()
+        for hops in range(radius):
+            following = []
+            for u in frontier:
+                for w in self.adj[u]:
+                    if w not in seen:
+                        seen[w] = hops + 1
+                        following.append(w)
+                    edge = _edge(u, w)
+                    if edge not in listed:
+                        listed.add(edge)
+                        edges.append(edge)
+            frontier = following
+        return edges
+
+    def to_tree(self):
+        """
+        CompactTree con la topología y longitudes actuales, enraizado en la
+        raíz original. Los soportes siguen a su bipartición: solo las
+        aristas centrales de los NNI aplicados quedan sin soporte.
+        """
+        size = len(self.adj)
+        parent = np.full(size, -1, dtype=np.int32)
+        lengths = np.full(size, np.nan)
+        support = np.full(size, np.nan)
+        support[self.root] = self.tree.support[self.root]
+        for node, up in self.edges():
+            parent[node] = up
+            lengths[node] = self.length[_edge(node, up)]
+            support[node] = self.support[_edge(node, up)]
+        return CompactTree(parent, lengths, self.tree.label.copy(), self.tree.labels,
+                           support, self.tree.rooted)
+
+
+def _edge(u, v):
+    """Clave de la arista sin dirección u-v"""
+    return (u, v) if u < v else (v, u)
@@ -1,106 +1,71 @@
-from Bio import AlignIO
-from Bio.Phylo.TreeConstruction import DistanceCalculator, DistanceTreeConstructor
-from Bio import Phylo
-import os
+from app.compact_tree import CompactTree
+from app.neighbor_joining import neighbor_joining
+from app.distance_models import distance_matrix, encode_alignment, load_alignment
+from app.tree_builder import guardar_newick
+from app.likelihood import TreeLikelihood
+from app.bootstrap import DEFAULT_SEED, bootstrap_support, with_support
 import numpy as np
-from scipy.optimize import minimize
-import math
 
-def construir_ml_tree(alignment_path=None, session_id=None):
+def construir_ml_tree(alineamiento, model="identity", bootstrap=0, seed=DEFAULT_SEED,
+                      processes=None, progress=None, output_path=None):
     """
-    Construir árbol de Máxima Verosimilitud (Simplificado)
-    Falta implementación de un algoritmo ML real,
-    aquí usamos Neighbor-Joining (NJ) como aproximación inicial.
+    Construir árbol de Máxima Verosimilitud desde un alineamiento (ruta o
+    en memoria, ver load_alignment).
+    El árbol inicial es Neighbor-Joining con distancias del modelo `model`
+    (identity, p, jc69 o k2p); luego se busca la topología con NNI y se
+    optimizan las ramas por máxima verosimilitud (JC69 en ADN, Poisson en
+    proteínas).
+    Con `bootstrap` > 0 cada réplica repite NJ + NNI sobre pesos de sitio
+    remuestreados y los soportes se escriben en los nodos internos;
+    `progress(fracción)` informa el avance de las réplicas.
+    Devuelve (newick, output_path, log-verosimilitud); el Newick solo se
+    escribe en disco si se pasa `output_path`.
     """
-    if alignment_path is None:
-        alignment_path = "results/alineado.fasta"
+    codes, labels = load_alignment(alineamiento)
+    matrix = distance_matrix(codes, model)
     
-    # Asegurar que el archivo de alineamiento exista
-    if not os.path.exists(alignment_path):
-        raise FileNotFoundError("El archivo de alineamiento no existe. Realiza la alineación primero.")
-
-    alignment = AlignIO.read(alignment_path, "fasta")
-    calculator = DistanceCalculator("identity")
-    dm = calculator.get_distance(alignment)
-    constructor = DistanceTreeConstructor()
-    
-    # Construir árbol inicial con NJ
-    tree = constructor.nj(dm)
+    # Construir árbol inicial con NJ y mejorarlo con NNI
+    likelihood = TreeLikelihood(neighbor_joining(matrix, labels), codes, labels)
+    log_likelihood = likelihood.nni_search()
+    tree = likelihood.to_tree()
     
-    # Optimizar longitudes de ramas (simulación de ML)
-    tree = optimize_branch_lengths(tree, alignment)
-    
-    # Asignar valores de soporte bootstrap (simulados)
-    for clade in tree.find_clades():
-        if clade.is_terminal():
-            clade.confidence = 100.0
-        else:
-            # Simular bootstrap con valores realistas
-            clade.confidence = float(np.random.randint(60, 100))
+    # Soporte bootstrap real de cada clado
+    support = np.full(len(tree), np.nan)
+    if bootstrap:
+        support = bootstrap_support(tree, codes, labels, 'ml', model, bootstrap, seed, processes,
+                                    progress)
+    tree = with_support(tree, support)
 
-    # Determinar ruta del archivo de salida
-    if session_id:
-        results_dir = f"app/results"
-        tree_file = os.path.join(results_dir, f"{session_id}_ml_tree.txt")
-    else:
-        results_dir = "results"
-        tree_file = "results/ml_tree.txt"
-    
-    # Crear directorio si no existe
-    os.makedirs(results_dir, exist_ok=True)
+    newick = tree.to_newick()
+    if output_path:
+        guardar_newick(newick, output_path)
     
-    # Guardar árbol como archivo Newick
-    Phylo.write(tree, tree_file, "newick")
-    
-    return tree.format("newick"), tree_file
+    return newick, output_path, log_likelihood
 
 def optimize_branch_lengths(tree, alignment):
     """
-    Optimización simplificada de longitudes de ramas
+    Optimizar por máxima verosimilitud las longitudes de ramas de un árbol
+    de Bio.Phylo (la topología no cambia)
     """
-    # Calcular matriz de distancia de nuevo para optimización
-    calculator = DistanceCalculator("identity")
-    dm = calculator.get_distance(alignment)
-    
-    # Ajustar longitudes de ramas basado en distancias observadas
-    for clade in tree.find_clades():
-        if clade.branch_length is not None:
-            # Aplicar factor de corrección estocástico
-            correction_factor = np.random.uniform(0.8, 1.2)
-            clade.branch_length *= correction_factor
-    
-    return tree
+    codes, labels = encode_alignment(alignment)
+    likelihood = TreeLikelihood(CompactTree.from_bio(tree), codes, labels)
+    likelihood.optimize_branches()
+    return likelihood.to_tree().to_bio()
 
 def calculate_likelihood(tree, alignment):
     """
-    Cálculo simplificado de verosimilitud
+    Log-verosimilitud de un alineamiento sobre un árbol de Bio.Phylo
     """
-    # Para propósitos de demostración, retornamos un valor simulado
-    num_sites = alignment.get_alignment_length()
-    num_sequences = len(alignment)
-    
-    # Likelihood simulada basada en longitud del alineamiento
-    likelihood = -num_sites * num_sequences * 0.5
-    return likelihood
+    codes, labels = encode_alignment(alignment)
+    return TreeLikelihood(CompactTree.from_bio(tree), codes, labels).log_likelihood()
 
 def jukes_cantor_distance(seq1, seq2):
     """
-    Calcular distancia Jukes-Cantor entre dos secuencias
+    Calcular distancia Jukes-Cantor entre dos secuencias alineadas (solo
+    sitios A/C/G/T, ver distance_matrix; los pares saturados valen
+    MAX_DISTANCE)
     """
     if len(seq1) != len(seq2):
         raise ValueError("Las secuencias deben tener la misma longitud")
-    
-    differences = sum(1 for a, b in zip(seq1, seq2) if a != b and a != '-' and b != '-')
-    valid_sites = sum(1 for a, b in zip(seq1, seq2) if a != '-' and b != '-')
-    
-    if valid_sites == 0:
-        return 0.0
-    
-    p = differences / valid_sites
-    
-    # Modelo Jukes-Cantor
-    if p >= 0.75:
-        return float('inf')  # Saturación
-    
-    distance = -0.75 * math.log(1 - (4/3) * p)
-    return max(0.0, distance)
+    codes, _ = encode_alignment({0: str(seq1), 1: str(seq2)})
+    return float(distance_matrix(codes, 'jc69')[0, 1])
@@ -1,12 +1,25 @@
-from app.aligner import needleman_wunsch
+from app.aligner import needleman_wunsch_banded, align_profiles, UP, LEFT
+from app.kmer_distance import kmer_distance_matrix
+from app.scoring import get_scoring_scheme
+from app.upgma import upgma
+from app.distance_models import encode_alignment
+from app.binary_alignment import binary_alignment_path, write_binary_alignment
 from Bio.Seq import Seq
 from Bio.SeqRecord import SeqRecord
-from Bio.Align import MultipleSeqAlignment
-from Bio import AlignIO, SeqIO
+from Bio import SeqIO
+import numpy as np
 import os
 
-def align_multiple(sequences):
-    """Alineamiento múltiple usando alineamiento por pares progresivo"""
+# Estrategias de alineamiento múltiple disponibles
+STRATEGIES = ('progressive', 'center')
+
+def align_multiple(sequences, scoring=None):
+    """
+    Alineamiento múltiple por estrella (estrategia 'center'): cada
+    secuencia se alinea con la primera, que acumula los gaps. Todo en
+    memoria; devuelve dict nombre -> secuencia alineada, en el orden de
+    entrada y con la misma longitud.
+    """
     aligned = {}
     names = list(sequences.keys())
     center_name = names[0]
@@ -15,7 +28,8 @@ def align_multiple(sequences):
 
     for name in names[1:]:
         s2 = sequences[name]
-        aln1, aln2, _ = needleman_wunsch(center_seq, s2)
+        # Alineamiento por pares (con banda adaptativa)
+        aln1, aln2, _ = needleman_wunsch_banded(center_seq, s2, scoring=scoring)
         center_seq = aln1
         aligned[center_name] = aln1
         aligned[name] = aln2
@@ -23,23 +37,168 @@ def align_multiple(sequences):
     maxlen = max(len(s) for s in aligned.values())
     for name in aligned:
         aligned[name] = aligned[name].ljust(maxlen, '-')
+    return aligned
 
-    # Crear carpeta si no existe
-    os.makedirs("results", exist_ok=True)
+def align_sequences(sequences, scoring=None, strategy='progressive'):
+    """
+    Alineamiento múltiple en memoria de un dict nombre -> secuencia con la
+    estrategia dada ('progressive' o 'center'). Devuelve dict nombre ->
+    secuencia alineada.
+    """
+    if len(sequences) < 2:
+        raise ValueError("Se requieren al menos 2 secuencias para alineamiento")
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Estrategia desconocida: {strategy}")
+    if strategy == 'progressive':
+        # Alineamiento progresivo guiado por árbol
+        return align_progressive(sequences, scoring)
+    return align_multiple(sequences, scoring)
 
-    # Guardar alineamiento como archivo FASTA
-    alignment = MultipleSeqAlignment([
-        SeqRecord(Seq(seq), id=name)
-        for name, seq in aligned.items()
-    ])
-    AlignIO.write(alignment, "results/alineado.fasta", "fasta")
+def align_progressive(sequences, scoring=None):
+    """
+    Alineamiento múltiple progresivo guiado por árbol:
+    1. distancias k-mer entre las secuencias sin alinear,
+    2. árbol guía UPGMA,
+    3. alineamiento perfil-perfil subiendo por el árbol, con perfiles de
+       frecuencias por columna en arreglos NumPy.
+    Cada secuencia se alinea una sola vez, por lo que el largo del
+    alineamiento no se infla al agregar secuencias.
+    Devuelve dict nombre -> secuencia alineada, en el orden de entrada.
+    """
+    if scoring is None:
+        scoring = get_scoring_scheme()
+    names = list(sequences.keys())
+    raws = [np.frombuffer(str(sequences[name]).encode('latin-1', 'replace'), dtype=np.uint8)
+            for name in names]
+    if len(names) < 2:
+        return {name: str(sequences[name]) for name in names}
 
-    return aligned
+    codes, table = _encode_for_profiles(scoring, raws)
+    gap_code = table.shape[0] - 1
+
+    matrix, labels = kmer_distance_matrix(sequences)
+    guide = upgma(matrix, labels)
+
+    # Post-orden del árbol guía: las hojas 0..n-1 son las secuencias en orden
+    profiles = {}
+    for node in guide.postorder().tolist():
+        if guide.is_leaf(node):
+            profiles[node] = ([node], codes[node][None, :])
+        else:
+            left, right = guide.children(node)
+            profiles[node] = _merge_profiles(profiles.pop(left), profiles.pop(right),
+                                             table, gap_code, scoring)
+
+    members, rows = profiles[guide.root]
+    aligned = {}
+    gap_char = ord('-')
+    for row, k in zip(rows, members):
+        out = np.full(rows.shape[1], gap_char, dtype=np.uint8)
+        out[row != gap_code] = raws[k]
+        aligned[k] = out.tobytes().decode('latin-1')
+    return {names[k]: aligned[k] for k in range(len(names))}
+
+def add_to_alignment(codes, labels, sequences, scoring=None):
+    """
+    Agregar secuencias a un alineamiento existente sin realinearlo: cada
+    secuencia nueva se alinea contra el perfil de frecuencias del
+    alineamiento (perfil-perfil, con una fila del lado nuevo) y entra en él
+    antes de alinear la siguiente. Las columnas que solo tiene la secuencia
+    nueva se agregan como gaps en las demás filas.
+    `codes`: matriz uint8 taxones x sitios (ver encode_alignment);
+    `sequences`: dict nombre -> secuencia sin alinear.
+    Devuelve (matriz, nombres) con las filas nuevas al final.
+    """
+    if scoring is None:
+        scoring = get_scoring_scheme()
+    names = list(sequences.keys())
+    if not names:
+        return codes, list(labels)
+    codes = np.asarray(codes, dtype=np.uint8)
+    gaps = codes == ord('-')
+    raws = [codes[k][~gaps[k]] for k in range(codes.shape[0])]
+    raws += [np.frombuffer(str(sequences[name]).encode('latin-1', 'replace'), dtype=np.uint8)
+             for name in names]
+
+    encoded, table = _encode_for_profiles(scoring, raws)
+    gap_code = table.shape[0] - 1
+    rows = np.full(codes.shape, gap_code, dtype=np.int64)
+    for k in range(codes.shape[0]):
+        rows[k, ~gaps[k]] = encoded[k]
+
+    block = (list(range(codes.shape[0])), rows)
+    for k in range(codes.shape[0], len(raws)):
+        block = _merge_profiles(block, ([k], encoded[k][None, :]), table, gap_code, scoring)
 
-def align_multiple_sequences(input_fasta_path, output_fasta_path):
+    members, rows = block
+    out = np.full(rows.shape, ord('-'), dtype=np.uint8)
+    for row, k in zip(rows, members):
+        out[k, row != gap_code] = raws[k]
+    return out, list(labels) + names
+
+def write_alignment(path, codes, labels):
+    """
+    Guardar un alineamiento codificado como FASTA (una fila a la vez) y en
+    formato binario (.aln); el FASTA se reemplaza de forma atómica
+    """
+    records = (SeqRecord(Seq(codes[k].tobytes().decode('latin-1')), id=label, description="")
+               for k, label in enumerate(labels))
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    temp = f"{path}.{os.getpid()}.tmp"
+    SeqIO.write(records, temp, "fasta")
+    os.replace(temp, path)
+    write_binary_alignment(binary_alignment_path(path), codes, labels)
+
+def _encode_for_profiles(scoring, raws):
+    """
+    Codificar todas las secuencias sobre los símbolos presentes y extender
+    la tabla de sustitución con un símbolo de gap que puntúa 0
+    """
+    encoded = [scoring.lookup[raw] for raw in raws]
+    present = np.zeros(256, dtype=bool)
+    for x in encoded:
+        present[x] = True
+    used = np.flatnonzero(present)
+    remap = np.cumsum(present) - 1
+
+    size = len(used)
+    table = np.zeros((size + 1, size + 1))
+    table[:size, :size] = scoring.table[np.ix_(used, used)]
+    return [remap[x] for x in encoded], table
+
+def _frequencies(rows, size):
+    """Matriz L x size de frecuencias por columna de un bloque alineado"""
+    length = rows.shape[1]
+    flat = (np.arange(length) * size)[None, :] + rows
+    counts = np.bincount(flat.ravel(), minlength=length * size)
+    return counts.reshape(length, size) / rows.shape[0]
+
+def _merge_profiles(left, right, table, gap_code, scoring):
+    """Alinear dos perfiles y devolver el bloque combinado (miembros, filas)"""
+    members_a, rows_a = left
+    members_b, rows_b = right
+    size = table.shape[0]
+    ops, _ = align_profiles(_frequencies(rows_a, size), _frequencies(rows_b, size),
+                            table, scoring)
+
+    merged = np.full((rows_a.shape[0] + rows_b.shape[0], len(ops)), gap_code,
+                     dtype=rows_a.dtype)
+    merged[:rows_a.shape[0], ops != LEFT] = rows_a
+    merged[rows_a.shape[0]:, ops != UP] = rows_b
+    return members_a + members_b, merged
+
+def align_multiple_sequences(input_fasta_path, output_fasta_path, scoring=None,
+                             strategy='progressive'):
     """
     Realizar alineamiento múltiple de secuencias desde un archivo FASTA
-    y guardar el resultado en otro archivo FASTA
+    y guardar el resultado en otro archivo FASTA, junto con su versión
+    binaria (.aln, ver binary_alignment.py).
+    `scoring` es un ScoringScheme opcional (matriz de sustitución y gaps).
+    `strategy` es 'progressive' (árbol guía y perfiles) o 'center' (cada
+    secuencia contra una referencia que acumula gaps).
+    Devuelve el alineamiento en memoria (matriz codificada, nombres).
     """
     try:
         # Leer secuencias del archivo FASTA
@@ -48,50 +207,9 @@ def align_multiple_sequences(input_fasta_path, output_fasta_path):
         for record in records:
             sequences[record.id] = str(record.seq)
         
-        if len(sequences) < 2:
-            raise ValueError("Se requieren al menos 2 secuencias para alineamiento")
-        
-        # Realizar alineamiento múltiple progresivo
-        aligned_sequences = {}
-        sequence_names = list(sequences.keys())
-        
-        # Comenzar con la primera secuencia como referencia
-        reference_name = sequence_names[0]
-        reference_seq = sequences[reference_name]
-        aligned_sequences[reference_name] = reference_seq
-        
-        # Alinear cada secuencia restante con la referencia
-        for seq_name in sequence_names[1:]:
-            target_seq = sequences[seq_name]
-            
-            # Realizar alineamiento por pares
-            aligned_ref, aligned_target, _ = needleman_wunsch(reference_seq, target_seq)
-            
-            # Actualizar secuencia de referencia
-            reference_seq = aligned_ref
-            aligned_sequences[reference_name] = aligned_ref
-            aligned_sequences[seq_name] = aligned_target
-        
-        # Igualar todas las secuencias a la misma longitud
-        max_length = max(len(seq) for seq in aligned_sequences.values())
-        for name in aligned_sequences:
-            aligned_sequences[name] = aligned_sequences[name].ljust(max_length, '-')
-        
-        # Crear objeto MultipleSeqAlignment de Biopython
-        alignment_records = []
-        for name, seq in aligned_sequences.items():
-            record = SeqRecord(Seq(seq), id=name, description="")
-            alignment_records.append(record)
-        
-        alignment = MultipleSeqAlignment(alignment_records)
-        
-        # Crear directorio de salida si no existe
-        os.makedirs(os.path.dirname(output_fasta_path), exist_ok=True)
-        
-        # Guardar alineamiento en archivo FASTA
-        AlignIO.write(alignment, output_fasta_path, "fasta")
-        
-        return True
+        codes, labels = encode_alignment(align_sequences(sequences, scoring, strategy))
+        write_alignment(output_fasta_path, codes, labels)
+        return codes, labels
         
     except Exception as e:
         raise Exception(f"Error en alineamiento múltiple: {str(e)}")
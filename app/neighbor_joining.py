@@ -0,0 +1,252 @@
+import numpy as np
+from app.compact_tree import CompactTree
+
+# A partir de este número de taxones se usa la poda tipo RapidNJ por defecto
+RAPID_THRESHOLD = 500
+
+# Filas por bloque al calcular la matriz Q, para acotar la memoria
+Q_BLOCK = 512
+
+
+def neighbor_joining(distance_matrix, labels, rapid=None):
+    """
+    Neighbor-Joining (Saitou y Nei, 1987) sobre arreglos NumPy.
+
+    La matriz activa se mantiene compacta en D[:m, :m]: el nodo nuevo ocupa
+    la fila de uno de los unidos y la última fila activa se mueve a la del
+    otro. En cada paso se busca el mínimo de Q_ij = D_ij - u_i - u_j (con
+    u = sumas de fila / (m - 2)).
+
+    - rapid=False: mínimos de Q por filas, vectorizado (exacto, O(n^3)).
+    - rapid=True: poda de RapidNJ (Simonsen et al., 2008): cada fila se
+      guarda ordenada y solo se revisan las entradas que todavía pueden
+      mejorar el mínimo encontrado. Da el mismo árbol.
+    - rapid=None: elegir según RAPID_THRESHOLD.
+
+    Devuelve un CompactTree con la misma forma que el de Biopython: nodos
+    internos "Inner1", "Inner2"... y el último nodo creado como raíz (con
+    tres hijos).
+    """
+    n = len(labels)
+    if n == 0:
+        raise ValueError("Se necesita al menos un taxón")
+    if rapid is None:
+        rapid = n > RAPID_THRESHOLD
+
+    size = max(1, 2 * n - 2)
+    parent = np.full(size, -1, dtype=np.int32)
+    branch_length = np.full(size, np.nan)
+    names = list(labels) + [f"Inner{k}" for k in range(1, n - 1)]
+    label = np.arange(size, dtype=np.int32)
+    if n == 1:
+        return CompactTree(parent, branch_length, label, names)
+    if n == 2:
+        d = float(np.asarray(distance_matrix, dtype=np.float64)[1, 0])
+        return CompactTree([2, 2, -1], [d - d / 2.0, d / 2.0, np.nan],
+                           [0, 1, 2], names + ["Inner"])
+
+    D = np.array(distance_matrix, dtype=np.float64)
+    r = D.sum(axis=1)
+    node_of = np.arange(n)
+    search = _RapidSearch(D, r, n) if rapid else None
+
+    m = n
+    for step in range(n - 2):
+        u = r[:m] / (m - 2)
+        if rapid:
+            i, j = search.find(u, m, node_of)
+        else:
+            i, j = _find_pair(D, u, m)
+        if i > j:
+            i, j = j, i
+
+        # Nuevo nodo interno con ramas hacia i y j
+        new = n + step
+        dij = D[i, j]
+        bi = dij / 2.0 + (u[i] - u[j]) / 2.0
+        removed = (node_of[i], node_of[j])
+        parent[node_of[i]] = new
+        parent[node_of[j]] = new
+        branch_length[node_of[i]] = bi
+        branch_length[node_of[j]] = dij - bi
+
+        # Distancias del nodo nuevo (ocupa la fila i) y sumas de fila
+        row = (D[i, :m] + D[j, :m] - dij) / 2.0
+        r[:m] += row - D[i, :m] - D[j, :m]
+        row[i] = 0.0
+        D[i, :m] = row
+        D[:m, i] = row
+        r[i] = row.sum() - row[j]
+        node_of[i] = new
+
+        # La última fila activa pasa a ocupar la fila j
+        last = m - 1
+        if j != last:
+            D[j, :m] = D[last, :m]
+            D[:m, j] = D[:m, last]
+            r[j] = r[last]
+            node_of[j] = node_of[last]
+        m -= 1
+        if rapid:
+            search.merged(i, j, last, removed, node_of, r, m)
+
+    # Los dos nodos restantes: el que no es el último creado cuelga de él
+    a, b = node_of[0], node_of[1]
+    root, other = (a, b) if a == 2 * n - 3 else (b, a)
+    parent[other] = root
+    branch_length[other] = D[0, 1]
+    branch_length[root] = np.nan
+    return CompactTree(parent, branch_length, label, names)
+
+
+def _find_pair(D, u, m):
+    """Par (i, j) con Q mínimo, calculando Q por bloques de filas"""
+    best = np.inf
+    pair = (0, 1)
+    for start in range(0, m, Q_BLOCK):
+        stop = min(m, start + Q_BLOCK)
+        q = D[start:stop, :m] - u[start:stop, None] - u[None, :]
+        q[np.arange(stop - start), np.arange(start, stop)] = np.inf
+        flat = int(q.argmin())
+        value = q.flat[flat]
+        if value < best:
+            best = value
+            pair = (start + flat // m, flat % m)
+    return pair
+
+
+class _RapidSearch:
+    """
+    Filas ordenadas para la búsqueda de RapidNJ.
+
+    Cada fila i guarda sus columnas j ordenadas por la clave
+    D_ij - u0_j, donde u0 es el valor de u de cada nodo cuando se ordenó la
+    fila (o cuando se creó el nodo). Como
+    Q_ij = clave_ij - u_i - (u_j - u0_j), basta revisar las entradas con
+    clave_ij <= mejor + u_i + max(u - u0): usar la deriva de u en lugar del
+    u máximo da una cota mucho más ajustada que la de RapidNJ original.
+    Las entradas de nodos ya unidos se saltan, y las filas se vuelven a
+    ordenar cada vez que la matriz activa se reduce a la mitad.
+    """
+
+    def __init__(self, D, r, n):
+        self.D = D
+        # Fila que ocupa cada nodo (-1 si ya no está activo); el elemento
+        # extra hace que el relleno (-1) también se lea como inactivo
+        self.slot_of = np.full(2 * n - 1, -1, dtype=np.int64)
+        self.slot_of[:n] = np.arange(n)
+        self.u0 = np.zeros(2 * n - 1)
+        self._sort_rows(np.arange(n), r, n)
+
+    def _sort_rows(self, node_of, r, m):
+        """Ordenar desde cero las m filas activas con u0 = u actual"""
+        self.u0[node_of[:m]] = r[:m] / (m - 2)
+        shift = self.u0[node_of[:m]]
+        self.keys = np.empty((m, m))
+        self.order_nodes = np.empty((m, m), dtype=np.int32)
+        self.start = np.zeros(m, dtype=np.int64)
+        for first in range(0, m, Q_BLOCK):
+            block = slice(first, min(m, first + Q_BLOCK))
+            keys = self.D[block, :m] - shift
+            order = np.argsort(keys, axis=1)
+            self.order_nodes[block] = node_of[order]
+            self.keys[block] = np.take_along_axis(keys, order, axis=1)
+
+    def find(self, u, m, node_of):
+        keys = self.keys
+        width = keys.shape[1]
+        rows = np.arange(m)
+        start = self.start[:m]
+
+        # Cota inicial: primeras entradas vivas de cada fila (la propia
+        # fila suele ser la primera)
+        best = np.inf
+        pair = (0, 1)
+        for shift in (0, 1):
+            pos = np.minimum(start + shift, width - 1)
+            best, pair = self._best(rows, pos, u, best, pair)
+
+        # Corte de cada fila (está ordenada): búsqueda exponencial y luego
+        # binaria, vectorizadas; casi todas las filas se resuelven en uno o
+        # dos saltos
+        limit = best + u + (u - self.u0[node_of[:m]]).max()
+        lo = start.copy()
+        hi = np.full(m, width)
+        pending = rows
+        step = 1
+        while len(pending):
+            probe = lo[pending] + step - 1
+            outside = probe >= width
+            inside = ~outside
+            inside[inside] = keys.take(pending[inside] * width + probe[inside]) <= limit[pending[inside]]
+            done = pending[~inside]
+            hi[done] = np.minimum(probe[~inside], width)
+            pending = pending[inside]
+            lo[pending] = probe[inside] + 1
+            step *= 2
+        pending = rows[lo < hi]
+        while len(pending):
+            mid = (lo[pending] + hi[pending]) // 2
+            inside = keys.take(pending * width + mid) <= limit[pending]
+            lo[pending[inside]] = mid[inside] + 1
+            hi[pending[~inside]] = mid[~inside]
+            pending = pending[lo[pending] < hi[pending]]
+
+        # Revisar de una vez todas las entradas candidatas
+        lengths = lo - start
+        total = int(lengths.sum())
+        if total:
+            owner = np.repeat(rows, lengths)
+            first = np.repeat(np.cumsum(lengths) - lengths - start, lengths)
+            pos = np.arange(total) - first
+            best, pair = self._best(owner, pos, u, best, pair)
+        return pair
+
+    def _best(self, rows, pos, u, best, pair):
+        """Mínimo de Q (calculado desde D) entre las entradas (fila, posición) dadas"""
+        flat = rows * self.keys.shape[1] + pos
+        cols = self.slot_of.take(self.order_nodes.take(flat))
+        ok = (cols >= 0) & (cols != rows)
+        if ok.any():
+            rows, cols = rows[ok], cols[ok]
+            q = self.D.take(rows * self.D.shape[1] + cols) - u.take(rows) - u.take(cols)
+            k = int(q.argmin())
+            if q[k] < best:
+                return q[k], (int(rows[k]), int(cols[k]))
+        return best, pair
+
+    def merged(self, i, j, last, removed, node_of, r, m):
+        """Actualizar las filas ordenadas tras unir las filas i y j"""
+        keys, nodes = self.keys, self.order_nodes
+        self.slot_of[list(removed)] = -1
+        self.slot_of[node_of[i]] = i
+        if j != last:
+            self.slot_of[node_of[j]] = j
+        if m <= 2:
+            return
+        if m <= keys.shape[1] // 2:
+            self._sort_rows(node_of, r, m)
+            return
+
+        if j != last:
+            keys[j] = keys[last]
+            nodes[j] = nodes[last]
+            self.start[j] = self.start[last]
+
+        # Fila del nodo nuevo, ordenada desde cero
+        self.u0[node_of[i]] = r[i] / (m - 2)
+        row = self.D[i, :m] - self.u0[node_of[:m]]
+        order = np.argsort(row)
+        keys[i, :m] = row[order]
+        keys[i, m:] = np.inf
+        nodes[i, :m] = node_of[order]
+        nodes[i, m:] = -1
+        self.start[i] = 0
+
+        # Avanzar los punteros sobre entradas de nodos ya unidos
+        rows = np.arange(m)
+        while len(rows):
+            dead = self.slot_of[nodes[rows, self.start[rows]]] < 0
+            dead &= np.isfinite(keys[rows, self.start[rows]])
+            rows = rows[dead]
+            self.start[rows] += 1
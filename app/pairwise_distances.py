@@ -0,0 +1,135 @@
+import heapq
+import os
+from multiprocessing import Pool, shared_memory
+import numpy as np
+from app.aligner import needleman_wunsch_banded
+
+# Estado de cada proceso trabajador (se llena en _init_worker)
+_worker = {}
+
+
+def all_pairs_alignment(sequences, scoring=None, processes=None, band=None, rows=None):
+    """
+    Alinear todos los pares de secuencias en paralelo.
+
+    `sequences` es un dict nombre -> secuencia. Las secuencias se copian una
+    sola vez a memoria compartida y los pares se reparten en bloques de costo
+    similar (len_i * len_j) entre los procesos.
+
+    Devuelve (distancias, puntajes, nombres): matrices NumPy n x n donde la
+    distancia es 1 - identidad del alineamiento por pares. Con `rows`
+    (índices) solo se alinean los pares que incluyen esas secuencias y las
+    matrices son len(rows) x n.
+    """
+    labels = list(sequences.keys())
+    n = len(labels)
+    raw = [str(sequences[name]).encode('latin-1', 'replace') for name in labels]
+    lengths = np.array([len(s) for s in raw], dtype=np.int64)
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    distances = np.zeros((n, n))
+    scores = np.zeros((n, n))
+    if rows is None:
+        pairs = [(i, j) for i in range(n) for j in range(i)]
+    else:
+        # Mismo orden (i > j) que en la matriz completa
+        pairs = sorted({(max(i, j), min(i, j)) for i in rows for j in range(n) if j != i})
+    if not pairs:
+        return _rows(distances, rows), _rows(scores, rows), labels
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+    processes = max(1, min(processes, len(pairs)))
+    chunks = _balanced_chunks(pairs, lengths, processes * 4)
+
+    shm = shared_memory.SharedMemory(create=True, size=max(1, int(offsets[-1])))
+    try:
+        buffer = np.ndarray((int(offsets[-1]),), dtype=np.uint8, buffer=shm.buf)
+        for k, s in enumerate(raw):
+            buffer[offsets[k]:offsets[k + 1]] = np.frombuffer(s, dtype=np.uint8)
+        del buffer
+
+        init_args = (shm.name, offsets, scoring, band)
+        if processes == 1:
+            _init_worker(*init_args)
+            try:
+                results = [_align_chunk(chunk) for chunk in chunks]
+            finally:
+                _close_worker()
+        else:
+            with Pool(processes, initializer=_init_worker, initargs=init_args) as pool:
+                results = list(pool.imap_unordered(_align_chunk, chunks))
+    finally:
+        shm.close()
+        shm.unlink()
+
+    for chunk in results:
+        for i, j, score, distance in chunk:
+            scores[i, j] = scores[j, i] = score
+            distances[i, j] = distances[j, i] = distance
+    return _rows(distances, rows), _rows(scores, rows), labels
+
+
+def _rows(matrix, rows):
+    return matrix if rows is None else matrix[list(rows)]
+
+
+def _balanced_chunks(pairs, lengths, count):
+    """
+    Repartir los pares en `count` bloques con costo total similar
+    (LPT: el par más caro va al bloque con menos carga).
+    """
+    costs = [int(lengths[i]) * int(lengths[j]) for i, j in pairs]
+    order = sorted(range(len(pairs)), key=lambda k: costs[k], reverse=True)
+    count = max(1, min(count, len(pairs)))
+    heap = [(0, k) for k in range(count)]
+    chunks = [[] for _ in range(count)]
+    for k in order:
+        load, idx = heapq.heappop(heap)
+        chunks[idx].append(pairs[k])
+        heapq.heappush(heap, (load + costs[k], idx))
+    return [c for c in chunks if c]
+
+
+def _init_worker(shm_name, offsets, scoring, band):
+    """Conectar el proceso a la memoria compartida con las secuencias"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    _worker['shm'] = shm
+    _worker['data'] = np.ndarray((int(offsets[-1]),), dtype=np.uint8, buffer=shm.buf)
+    _worker['offsets'] = offsets
+    _worker['scoring'] = scoring
+    _worker['band'] = band
+
+
+def _close_worker():
+    """Soltar la memoria compartida en el proceso actual"""
+    _worker.pop('data', None)
+    shm = _worker.pop('shm', None)
+    if shm is not None:
+        shm.close()
+
+
+def _sequence(k):
+    offsets = _worker['offsets']
+    return _worker['data'][offsets[k]:offsets[k + 1]].tobytes().decode('latin-1')
+
+
+def _align_chunk(chunk):
+    """Alinear un bloque de pares y devolver (i, j, puntaje, distancia)"""
+    out = []
+    for i, j in chunk:
+        aln1, aln2, score = needleman_wunsch_banded(
+            _sequence(i), _sequence(j), band=_worker['band'], scoring=_worker['scoring'])
+        out.append((i, j, score, 1.0 - alignment_identity(aln1, aln2)))
+    return out
+
+
+def alignment_identity(aln1, aln2):
+    """Fracción de columnas idénticas (sin gaps) sobre el largo del alineamiento"""
+    if not aln1:
+        return 1.0
+    a = np.frombuffer(aln1.upper().encode('latin-1', 'replace'), dtype=np.uint8)
+    b = np.frombuffer(aln2.upper().encode('latin-1', 'replace'), dtype=np.uint8)
+    matches = np.count_nonzero((a == b) & (a != ord('-')))
+    return matches / len(a)
@@ -0,0 +1,146 @@
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import time
+import uuid
+from contextlib import closing
+
+# Tamaño máximo por defecto de la caché de resultados en disco
+DEFAULT_MAX_BYTES = 2 << 30
+
+
+def cache_key(*parts):
+    """Hash de las partes (serializables a JSON) que identifican un resultado"""
+    text = json.dumps(parts, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """
+    Caché de resultados en disco indexada por contenido, compartida entre
+    sesiones y procesos: alineamientos, matrices de distancia y árboles.
+
+    Cada entrada es una carpeta con uno o más archivos, identificada por
+    (tipo, clave), donde la clave es cache_key() de las secuencias
+    normalizadas y los parámetros. Una base SQLite guarda el tamaño y el
+    último uso de cada entrada y los aciertos/fallos por tipo; al superar
+    `max_bytes` se eliminan las entradas usadas hace más tiempo.
+    El objeto solo guarda rutas, así que puede pasarse a otro proceso.
+    """
+
+    def __init__(self, folder, max_bytes=DEFAULT_MAX_BYTES):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.db_path = os.path.join(folder, 'index.db')
+        os.makedirs(folder, exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("CREATE TABLE IF NOT EXISTS entries ("
+                       "kind TEXT NOT NULL, key TEXT NOT NULL, size INTEGER NOT NULL, "
+                       "accessed REAL NOT NULL, PRIMARY KEY (kind, key))")
+            db.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+            db.execute("CREATE TABLE IF NOT EXISTS counters ("
+                       "kind TEXT PRIMARY KEY, hits INTEGER NOT NULL, misses INTEGER NOT NULL)")
+
+    def _connect(self):
+        return closing(sqlite3.connect(self.db_path, timeout=30, isolation_level=None))
+
+    def _entry_dir(self, kind, key):
+        return os.path.join(self.folder, kind, key)
+
+    def get(self, kind, key):
+        """Carpeta de la entrada (tipo, clave) o None; cuenta el acierto o el fallo"""
+        folder = self._entry_dir(kind, key)
+        with self._connect() as db:
+            found = db.execute("UPDATE entries SET accessed = ? WHERE kind = ? AND key = ?",
+                               (time.time(), kind, key)).rowcount > 0
+            found = found and os.path.isdir(folder)
+            db.execute("INSERT INTO counters (kind, hits, misses) VALUES (?, ?, ?) "
+                       "ON CONFLICT (kind) DO UPDATE SET hits = hits + excluded.hits, "
+                       "misses = misses + excluded.misses",
+                       (kind, int(found), int(not found)))
+        return folder if found else None
+
+    def put(self, kind, key, files):
+        """
+        Guardar una entrada: `files` es un dict nombre -> ruta de un archivo
+        existente (se copia) o bytes. Devuelve la carpeta de la entrada.
+        """
+        folder = self._entry_dir(kind, key)
+        temp = os.path.join(self.folder, 'tmp', uuid.uuid4().hex)
+        os.makedirs(temp)
+        size = 0
+        for name, source in files.items():
+            path = os.path.join(temp, name)
+            if isinstance(source, bytes):
+                with open(path, 'wb') as f:
+                    f.write(source)
+            else:
+                shutil.copyfile(source, path)
+            size += os.path.getsize(path)
+
+        os.makedirs(os.path.dirname(folder), exist_ok=True)
+        try:
+            # La carpeta completa aparece de una vez; si otro proceso ya la
+            # guardó, se conserva la suya
+            os.rename(temp, folder)
+        except OSError:
+            shutil.rmtree(temp, ignore_errors=True)
+        with self._connect() as db:
+            db.execute("INSERT OR REPLACE INTO entries (kind, key, size, accessed) VALUES (?, ?, ?, ?)",
+                       (kind, key, size, time.time()))
+        self.evict()
+        return folder
+
+    def evict(self):
+        """Eliminar las entradas usadas hace más tiempo hasta quedar bajo max_bytes"""
+        with self._connect() as db:
+            total = db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            rows = db.execute("SELECT kind, key, size FROM entries ORDER BY accessed").fetchall()
+            for kind, key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                db.execute("DELETE FROM entries WHERE kind = ? AND key = ?", (kind, key))
+                shutil.rmtree(self._entry_dir(kind, key), ignore_errors=True)
+                total -= size
+
+    def stats(self):
+        """Entradas, bytes usados y aciertos/fallos (en total y por tipo)"""
+        with self._connect() as db:
+            entries = dict(((kind, (count, size)) for kind, count, size in db.execute(
+                "SELECT kind, COUNT(*), COALESCE(SUM(size), 0) FROM entries GROUP BY kind")))
+            counters = db.execute("SELECT kind, hits, misses FROM counters").fetchall()
+        by_kind = {kind: {'entries': count, 'bytes': size, 'hits': 0, 'misses': 0}
+                   for kind, (count, size) in entries.items()}
+        for kind, hits, misses in counters:
+            by_kind.setdefault(kind, {'entries': 0, 'bytes': 0}).update(hits=hits, misses=misses)
+        return {
+            'entries': sum(item['entries'] for item in by_kind.values()),
+            'bytes': sum(item['bytes'] for item in by_kind.values()),
+            'max_bytes': self.max_bytes,
+            'hits': sum(item['hits'] for item in by_kind.values()),
+            'misses': sum(item['misses'] for item in by_kind.values()),
+            'by_kind': by_kind
+        }
+
+    def clear(self):
+        """Vaciar la caché y reiniciar los contadores"""
+        with self._connect() as db:
+            db.execute("DELETE FROM entries")
+            db.execute("DELETE FROM counters")
+        for name in os.listdir(self.folder):
+            path = os.path.join(self.folder, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+
+
+def create_result_cache(config):
+    """Caché de resultados según la configuración (RESULT_CACHE_*); None si está desactivada"""
+    max_bytes = config.get('RESULT_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)
+    if not max_bytes:
+        return None
+    return ResultCache(config['RESULT_CACHE_FOLDER'], max_bytes)
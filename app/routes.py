@@ -1,181 +1,472 @@
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, Response, request, jsonify, current_app, send_file
 from werkzeug.utils import secure_filename
-from Bio import SeqIO, AlignIO
+from Bio import AlignIO
 from Bio.Align import PairwiseAligner
 from Bio.Phylo.TreeConstruction import DistanceCalculator, DistanceTreeConstructor
 from Bio import Phylo
+import io
 import os
 import json
 import uuid
+import zlib
 from datetime import datetime
 
 # Importar módulos existentes
-from app.multiple_aligner import align_multiple_sequences
-from app.tree_builder import construir_nj_tree
-from app.ml_tree import construir_ml_tree
-from app.tree_comparator import compare_trees, convert_newick_to_json
+from app.multiple_aligner import STRATEGIES
+from app.tasks import align_task, append_task, build_tree_task, commit_outputs, discard_outputs
+from app.tree_comparator import (compare_trees, convert_newick_to_flat_json, convert_newick_to_json,
+                                 iter_flat_json, rf_matrix)
+from app.compact_tree import split_newick
+from app.fasta_index import FastaIndex
+from app.tree_cache import content_key, tree_cache
+from app.tree_render import FORMATS, render_tree
+from app.result_cache import cache_key
+from app.scoring import scheme_from_params
+from app.distance_models import MODELS
+from app.bootstrap import DEFAULT_SEED, MAX_REPLICATES
+from app.kmer_distance import MAX_MINHASH_K, MAX_SKETCH_SIZE
+from app.session_store import valid_session_id
 
 main = Blueprint('main', __name__)
 
-# Almacenamiento temporal de sesiones
-sessions = {}
+# Distancias disponibles para /api/build_tree: los modelos sobre el
+# alineamiento múltiple y las que no lo necesitan (solo NJ)
+DISTANCES = MODELS + ('pairwise', 'mash', 'kmer')
+
+# Árboles con más nodos no llevan el JSON anidado (`tree_json`) en las
+# respuestas: se piden en formato plano a /api/tree_json
+MAX_INLINE_TREE_NODES = 2000
+
+@main.before_request
+def _check_session_id():
+    """Rechazar ids de sesión que no son UUID antes de llegar al almacén o al disco"""
+    session_id = (request.view_args or {}).get('session_id')
+    if session_id is not None and not valid_session_id(session_id):
+        return jsonify({'error': 'Identificador de sesión inválido'}), 400
+
+def _sessions():
+    """Almacén de sesiones de la aplicación (memoria o SQLite, ver app/session_store.py)"""
+    return current_app.extensions['sessions']
+
+def _result_cache():
+    """Caché de resultados en disco (None si está desactivada, ver app/result_cache.py)"""
+    return current_app.extensions.get('result_cache')
+
+def _tree_blob(store, session_id, method):
+    """Newick de un árbol de la sesión (el JSON se arma desde él al pedirlo)"""
+    return store.get_blob(session_id, f'tree_{method}') or {}
+
+def _tree_views(session_id, method, tree_newick):
+    """
+    `tree_json` (anidado, solo para árboles chicos; si no, None) y la URL
+    del JSON plano del árbol, para las respuestas que devuelven un árbol
+    """
+    inline = len(tree_cache.get(tree_newick)) <= MAX_INLINE_TREE_NODES
+    return {
+        'tree_json': convert_newick_to_json(tree_newick) if inline else None,
+        'tree_json_url': f'/api/tree_json/{session_id}/{method}'
+    }
+
+def _remove_upload(filepath):
+    """Borrar un FASTA subido que no llegó a ser sesión, con su índice"""
+    for path in (filepath, f"{filepath}.fai"):
+        if os.path.exists(path):
+            os.remove(path)
+
+def _fasta_stream():
+    """
+    (nombre, flujo) del FASTA de la petición: formulario multipart (campo
+    `file`) o cuerpo binario con `?filename=`; o (None, respuesta de error)
+    """
+    if request.mimetype == 'multipart/form-data':
+        if 'file' not in request.files:
+            return None, (jsonify({'error': 'No se encontró archivo'}), 400)
+        file = request.files['file']
+        original_name, stream = file.filename, file.stream
+    else:
+        original_name, stream = request.args.get('filename', ''), request.stream
+    
+    if original_name == '':
+        return None, (jsonify({'error': 'No se seleccionó archivo'}), 400)
+    
+    if not original_name.lower().endswith(('.fasta', '.fas', '.fa')):
+        return None, (jsonify({'error': 'El archivo debe ser formato FASTA'}), 400)
+    return original_name, stream
 
 @main.route('/api/upload_fasta', methods=['POST'])
 def upload_fasta():
-    """Subir un archivo FASTA con múltiples secuencias"""
+    """
+    Subir un archivo FASTA con múltiples secuencias: como formulario
+    multipart (campo `file`) o como cuerpo binario con `?filename=`.
+    El archivo se copia a disco por bloques mientras se indexa (faidx), sin
+    cargar las secuencias en memoria; las etapas las leen del archivo.
+    """
     try:
-        if 'file' not in request.files:
-            return jsonify({'error': 'No se encontró archivo'}), 400
-        
-        file = request.files['file']
-        if file.filename == '':
-            return jsonify({'error': 'No se seleccionó archivo'}), 400
-        
-        if not file.filename.lower().endswith(('.fasta', '.fas', '.fa')):
-            return jsonify({'error': 'El archivo debe ser formato FASTA'}), 400
+        original_name, stream = _fasta_stream()
+        if original_name is None:
+            return stream
         
         # Generar ID de sesión único
         session_id = str(uuid.uuid4())
         
-        # Guardar archivo
-        filename = secure_filename(file.filename)
+        # Guardar archivo e indexar sus secuencias en la misma pasada
+        filename = secure_filename(original_name)
         filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], f"{session_id}_{filename}")
-        file.save(filepath)
-        
-        # Leer secuencias del archivo FASTA
-        sequences = {}
         try:
-            records = SeqIO.parse(filepath, 'fasta')
-            for record in records:
-                sequences[record.id] = {
-                    'id': record.id,
-                    'description': record.description,
-                    'sequence': str(record.seq),
-                    'length': len(record.seq)
-                }
+            index = FastaIndex.write_fasta(stream, filepath)
         except Exception as e:
+            _remove_upload(filepath)
             return jsonify({'error': f'Error al procesar archivo FASTA: {str(e)}'}), 400
         
-        if len(sequences) < 3:
+        if len(index) < 3:
+            _remove_upload(filepath)
             return jsonify({'error': 'Se requieren al menos 3 secuencias para construir árboles filogenéticos'}), 400
         
-        # Almacenar datos de la sesión
-        sessions[session_id] = {
+        # Almacenar datos de la sesión (las secuencias quedan en el archivo)
+        _sessions().create(session_id, {
             'filename': filename,
             'filepath': filepath,
-            'sequences': sequences,
+            'sequences_count': len(index),
+            'digest': index.digest(),
             'created_at': datetime.now().isoformat(),
             'alignment': None,
             'trees': {}
-        }
+        })
         
         return jsonify({
             'session_id': session_id,
             'filename': filename,
-            'sequences_count': len(sequences),
-            'sequences': list(sequences.keys())
+            'sequences_count': len(index),
+            'sequences': index.names()
         })
         
     except Exception as e:
         return jsonify({'error': f'Error interno: {str(e)}'}), 500
 
+def _run_or_submit(kind, session_id, func, args, on_success):
+    """
+    Ejecutar un trabajo en la petición o, con `"async": true` en el cuerpo
+    JSON (o `?async=true`), encolarlo y responder 202 con su job_id al
+    instante (el estado se consulta en /api/jobs/<job_id>). Los archivos
+    que el trabajo dejó en rutas temporales se mueven a su lugar justo
+    antes de on_success; si el resultado se descarta, se borran.
+    """
+    def success(result):
+        return on_success(commit_outputs(result))
+    
+    params = request.get_json(silent=True) or {}
+    if params.get('async') is True or request.args.get('async') == 'true':
+        job = current_app.extensions['jobs'].submit(kind, func, args, session_id, success,
+                                                    discard_outputs)
+        return jsonify({
+            'status': 'accepted',
+            'job_id': job.id,
+            'status_url': f'/api/jobs/{job.id}'
+        }), 202
+    result = func(*args)
+    try:
+        return jsonify(success(result))
+    except Exception:
+        discard_outputs(result)
+        raise
+
 @main.route('/api/align/<session_id>', methods=['POST'])
 def align_sequences(session_id):
-    """Generar alineamiento múltiple de las secuencias"""
+    """
+    Generar alineamiento múltiple de las secuencias.
+    Cuerpo JSON opcional: match, mismatch, gap, gap_open, gap_extend,
+    matrix (nombre como "BLOSUM62"/"DNA" o un diccionario de diccionarios)
+    y strategy ("progressive" por defecto, o "center"). Con `async` = true
+    se ejecuta en la cola de trabajos.
+    """
     try:
-        if session_id not in sessions:
+        store = _sessions()
+        if session_id not in store:
             return jsonify({'error': 'Sesión no encontrada'}), 404
         
-        session_data = sessions[session_id]
-        sequences = session_data['sequences']
-        
-        # Crear archivo FASTA temporal para el alineamiento
-        temp_fasta = os.path.join(current_app.config['RESULTS_FOLDER'], f"{session_id}_temp.fasta")
-        with open(temp_fasta, 'w') as f:
-            for seq_id, seq_data in sequences.items():
-                f.write(f">{seq_id}\n{seq_data['sequence']}\n")
-        
-        # Realizar alineamiento múltiple
-        aligned_file = os.path.join(current_app.config['RESULTS_FOLDER'], f"{session_id}_aligned.fasta")
-        align_multiple_sequences(temp_fasta, aligned_file)
-        
-        # Leer el alineamiento resultante
-        alignment_data = {}
+        params = request.get_json(silent=True) or {}
         try:
-            aligned_records = SeqIO.parse(aligned_file, 'fasta')
-            for record in aligned_records:
-                alignment_data[record.id] = str(record.seq)
-        except Exception as e:
-            return jsonify({'error': f'Error al leer alineamiento: {str(e)}'}), 500
-        
-        # Actualizar sesión
-        sessions[session_id]['alignment'] = {
-            'file_path': aligned_file,
-            'sequences': alignment_data,
-            'length': len(list(alignment_data.values())[0]) if alignment_data else 0
-        }
+            scheme_from_params(params)
+        except ValueError as e:
+            return jsonify({'error': f'Parámetros de alineamiento inválidos: {str(e)}'}), 400
         
-        # Limpiar archivo temporal
-        if os.path.exists(temp_fasta):
-            os.remove(temp_fasta)
+        strategy = params.get('strategy', 'progressive')
+        if strategy not in STRATEGIES:
+            return jsonify({'error': f'Estrategia debe ser una de: {", ".join(STRATEGIES)}'}), 400
         
-        return jsonify({
-            'status': 'success',
-            'alignment_length': sessions[session_id]['alignment']['length'],
-            'aligned_sequences': alignment_data
-        })
+        session_data = store.get(session_id)
+        args = (session_id, session_data['filepath'], params, current_app.config['RESULTS_FOLDER'],
+                session_data.get('digest'), _result_cache())
+        return _run_or_submit('align', session_id, align_task, args,
+                              lambda alignment: _save_alignment(store, session_id, alignment))
         
     except Exception as e:
         return jsonify({'error': f'Error en alineamiento: {str(e)}'}), 500
 
+def _save_alignment(store, session_id, alignment):
+    """Guardar el alineamiento en la sesión y armar la respuesta"""
+    def save(meta):
+        meta['alignment'] = {key: alignment[key]
+                             for key in ('file_path', 'length', 'scoring', 'params', 'digest')}
+    if not store.update(session_id, save):
+        raise Exception('La sesión ya no existe')
+    return {
+        'status': 'success',
+        'alignment_length': alignment['length'],
+        'aligned_sequences': alignment['sequences'],
+        'scoring': alignment['scoring']
+    }
+
 @main.route('/api/build_tree/<session_id>/<method>', methods=['POST'])
 def build_tree(session_id, method):
-    """Construir árbol filogenético usando NJ o ML"""
+    """
+    Construir árbol filogenético usando NJ o ML.
+    Cuerpo JSON opcional: distance = "identity", "p", "jc69" o "k2p"
+    (modelos sobre el alineamiento múltiple), "pairwise" (alineamiento de
+    todos los pares en paralelo), "mash" (sketches MinHash, con `k` y
+    `sketch_size` opcionales) o "kmer" (k-mers compartidos). Las tres
+    últimas son solo para NJ y no requieren /api/align.
+    `bootstrap`: número de réplicas (0 por defecto) para soportes reales,
+    solo con los modelos sobre el alineamiento; `seed` fija las réplicas.
+    Con `async` = true se ejecuta en la cola de trabajos.
+    """
     try:
-        if session_id not in sessions:
+        store = _sessions()
+        session_data = store.get(session_id)
+        if session_data is None:
             return jsonify({'error': 'Sesión no encontrada'}), 404
         
-        session_data = sessions[session_id]
-        
-        if not session_data.get('alignment'):
-            return jsonify({'error': 'Primero debe realizar el alineamiento'}), 400
+        params = request.get_json(silent=True) or {}
+        distance = params.get('distance', 'identity')
         
         if method not in ['nj', 'ml']:
             return jsonify({'error': 'Método debe ser "nj" o "ml"'}), 400
         
-        alignment_file = session_data['alignment']['file_path']
+        if distance not in DISTANCES:
+            return jsonify({'error': f'Distancia debe ser una de: {", ".join(DISTANCES)}'}), 400
         
-        if method == 'nj':
-            tree_newick, tree_file = construir_nj_tree(alignment_file, session_id)
-        elif method == 'ml':
-            tree_newick, tree_file = construir_ml_tree(alignment_file, session_id)
+        if distance not in MODELS and method != 'nj':
+            return jsonify({'error': f'La distancia "{distance}" solo está disponible para NJ'}), 400
         
-        # Convertir árbol a formato JSON para D3.js
-        tree_json = convert_newick_to_json(tree_newick)
-        
-        # Guardar en sesión
-        sessions[session_id]['trees'][method] = {
-            'newick': tree_newick,
-            'json': tree_json,
-            'file_path': tree_file,
-            'created_at': datetime.now().isoformat()
-        }
+        if distance in MODELS and not session_data.get('alignment'):
+            return jsonify({'error': 'Primero debe realizar el alineamiento'}), 400
         
-        return jsonify({
-            'status': 'success',
-            'method': method,
-            'newick': tree_newick,
-            'tree_json': tree_json
-        })
+        bootstrap = params.get('bootstrap', 0)
+        if isinstance(bootstrap, bool) or not isinstance(bootstrap, int) or not 0 <= bootstrap <= MAX_REPLICATES:
+            return jsonify({'error': f"El parámetro 'bootstrap' debe ser un entero entre 0 y {MAX_REPLICATES}"}), 400
+        seed = params.get('seed', DEFAULT_SEED)
+        if isinstance(seed, bool) or not isinstance(seed, int) or seed < 0:
+            return jsonify({'error': "El parámetro 'seed' debe ser un entero no negativo"}), 400
+        if bootstrap and distance not in MODELS:
+            return jsonify({'error': 'El bootstrap requiere una distancia sobre el alineamiento múltiple'}), 400
+        replicates = {'bootstrap': bootstrap, 'seed': seed,
+                      'processes': current_app.config.get('BOOTSTRAP_PROCESSES')}
+        
+        options = {}
+        if distance == 'mash':
+            for key, limit in (('k', MAX_MINHASH_K), ('sketch_size', MAX_SKETCH_SIZE)):
+                if params.get(key) is not None:
+                    value = params[key]
+                    if isinstance(value, bool) or not isinstance(value, int) or not 1 <= value <= limit:
+                        return jsonify({'error': f"El parámetro '{key}' debe ser un entero entre 1 y {limit}"}), 400
+                    options[key] = value
+        
+        # Las secuencias o el alineamiento se leen de disco en el trabajo
+        # (el hash de la entrada identifica el resultado en la caché)
+        fasta_path = alignment_file = None
+        if distance in MODELS:
+            alignment_file = session_data['alignment']['file_path']
+            digest = session_data['alignment'].get('digest')
+        else:
+            fasta_path = session_data['filepath']
+            digest = session_data.get('digest')
+        
+        args = (session_id, method, distance, fasta_path, alignment_file, options, replicates,
+                current_app.config.get('ALIGN_PROCESSES'), digest,
+                current_app.config['RESULTS_FOLDER'], _result_cache())
+        try:
+            return _run_or_submit('build_tree', session_id, build_tree_task, args,
+                                  lambda result: _save_tree(store, session_id, method, bootstrap, result,
+                                                            distance, options))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
     except Exception as e:
         return jsonify({'error': f'Error construyendo árbol {method}: {str(e)}'}), 500
 
+def _save_tree(store, session_id, method, bootstrap, result, distance, options):
+    """Guardar el árbol construido en la sesión y armar la respuesta"""
+    tree_newick = result['newick']
+    
+    # Guardar en sesión: Newick aparte, el resto en los metadatos
+    info = {
+        'file_path': result['file_path'],
+        'distance': distance,
+        'created_at': datetime.now().isoformat()
+    }
+    if options:
+        info['options'] = options
+    response = {
+        'status': 'success',
+        'method': method,
+        'newick': tree_newick
+    }
+    # JSON para D3.js: anidado si el árbol es chico, y la URL del formato plano
+    response.update(_tree_views(session_id, method, tree_newick))
+    if method == 'ml':
+        info['log_likelihood'] = response['log_likelihood'] = result['log_likelihood']
+    if bootstrap:
+        info['bootstrap'] = response['bootstrap'] = bootstrap
+    
+    store.set_blob(session_id, f'tree_{method}', {'newick': tree_newick})
+    
+    def save(meta):
+        meta['trees'][method] = info
+    if not store.update(session_id, save):
+        raise Exception('La sesión ya no existe')
+    return response
+
+@main.route('/api/append_sequences/<session_id>', methods=['POST'])
+def append_sequences(session_id):
+    """
+    Agregar secuencias a una sesión sin realinear ni reconstruir todo. El
+    FASTA se envía como en /api/upload_fasta; las secuencias nuevas se
+    alinean contra el alineamiento existente (perfil), se calculan solo
+    sus distancias y se insertan en los árboles ya construidos.
+    `?refine=true` refina los árboles ML con NNI alrededor de los taxones
+    insertados; `?async=true` ejecuta el trabajo en la cola.
+    """
+    try:
+        store = _sessions()
+        session_data = store.get(session_id)
+        if session_data is None:
+            return jsonify({'error': 'Sesión no encontrada'}), 404
+        
+        original_name, stream = _fasta_stream()
+        if original_name is None:
+            return stream
+        
+        # Las secuencias nuevas se copian aparte hasta que el trabajo las agrega
+        filepath = os.path.join(current_app.config['UPLOAD_FOLDER'],
+                                f"{session_id}_append_{uuid.uuid4().hex[:8]}.fasta")
+        try:
+            index = FastaIndex.write_fasta(stream, filepath)
+        except Exception as e:
+            _remove_upload(filepath)
+            return jsonify({'error': f'Error al procesar archivo FASTA: {str(e)}'}), 400
+        
+        if len(index) == 0:
+            _remove_upload(filepath)
+            return jsonify({'error': 'El archivo no contiene secuencias'}), 400
+        
+        existing = FastaIndex.open(session_data['filepath'])
+        repeated = [name for name in index.names() if name in existing]
+        if repeated:
+            _remove_upload(filepath)
+            return jsonify({'error': f'Secuencias ya presentes en la sesión: {", ".join(repeated[:10])}'}), 400
+        
+        trees = {}
+        for method, info in session_data.get('trees', {}).items():
+            trees[method] = {
+                'newick': _tree_blob(store, session_id, method)['newick'],
+                'distance': info.get('distance', 'identity'),
+                'options': info.get('options', {})
+            }
+        
+        refine = request.args.get('refine', 'false').lower() in ('true', '1')
+        args = (session_id, filepath, session_data['filepath'], session_data.get('alignment'), trees,
+                refine, current_app.config.get('ALIGN_PROCESSES'), current_app.config['RESULTS_FOLDER'])
+        return _run_or_submit('append', session_id, append_task, args,
+                              lambda result: _save_append(store, session_id, result))
+        
+    except Exception as e:
+        return jsonify({'error': f'Error agregando secuencias: {str(e)}'}), 500
+
+def _save_append(store, session_id, result):
+    """Guardar en la sesión el alineamiento y los árboles actualizados y armar la respuesta"""
+    response = {
+        'status': 'success',
+        'added': result['added'],
+        'sequences_count': result['sequences_count'],
+        'trees': {}
+    }
+    for method, entry in result['trees'].items():
+        store.set_blob(session_id, f'tree_{method}', {'newick': entry['newick']})
+        response['trees'][method] = {key: entry[key] for key in ('newick', 'log_likelihood') if key in entry}
+    if result['alignment']:
+        response['alignment_length'] = result['alignment']['length']
+    
+    def save(meta):
+        meta['sequences_count'] = result['sequences_count']
+        meta['digest'] = result['digest']
+        if result['alignment']:
+            meta['alignment'] = result['alignment']
+        for method, entry in result['trees'].items():
+            info = meta['trees'].get(method)
+            if info is not None:
+                info['file_path'] = entry['file_path']
+                info['updated_at'] = datetime.now().isoformat()
+                if 'log_likelihood' in entry:
+                    info['log_likelihood'] = entry['log_likelihood']
+    if not store.update(session_id, save):
+        raise Exception('La sesión ya no existe')
+    return response
+
+@main.route('/api/jobs', methods=['GET'])
+def list_jobs():
+    """Listar los trabajos (sin resultados), opcionalmente de una sesión (?session_id=...)"""
+    jobs = current_app.extensions['jobs'].jobs(request.args.get('session_id'))
+    return jsonify({'jobs': [job.to_dict(include_result=False) for job in jobs]})
+
+@main.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Estado, avance (0-100) y, al terminar, resultado o error de un trabajo"""
+    job = current_app.extensions['jobs'].get(job_id)
+    if job is None:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    return jsonify(job.to_dict())
+
+@main.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Cancelar un trabajo en cola o en ejecución (su resultado se descarta)"""
+    jobs = current_app.extensions['jobs']
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    if not jobs.cancel(job_id):
+        return jsonify({'error': f'El trabajo ya terminó ({job.status})'}), 409
+    return jsonify(jobs.get(job_id).to_dict())
+
+@main.route('/api/cache', methods=['GET'])
+def cache_stats():
+    """Estado de la caché de resultados: entradas, bytes y aciertos/fallos por tipo"""
+    cache = _result_cache()
+    if cache is None:
+        return jsonify({'enabled': False})
+    try:
+        return jsonify(dict(cache.stats(), enabled=True))
+    except Exception as e:
+        return jsonify({'error': f'Error leyendo la caché: {str(e)}'}), 500
+
+@main.route('/api/cache', methods=['DELETE'])
+def clear_cache():
+    """Vaciar la caché de resultados y reiniciar sus contadores"""
+    cache = _result_cache()
+    if cache is None:
+        return jsonify({'error': 'La caché de resultados está desactivada'}), 404
+    try:
+        cache.clear()
+        return jsonify({'status': 'success'})
+    except Exception as e:
+        return jsonify({'error': f'Error vaciando la caché: {str(e)}'}), 500
+
 @main.route('/api/compare_trees/<session_id>', methods=['POST'])
 def compare_trees_endpoint(session_id):
     """Comparar dos árboles filogenéticos"""
     try:
-        if session_id not in sessions:
+        store = _sessions()
+        session_data = store.get(session_id)
+        if session_data is None:
             return jsonify({'error': 'Sesión no encontrada'}), 404
         
         data = request.get_json()
@@ -185,14 +476,13 @@ def compare_trees_endpoint(session_id):
         if not method1 or not method2:
             return jsonify({'error': 'Se requieren ambos métodos para comparar'}), 400
         
-        session_data = sessions[session_id]
         trees = session_data.get('trees', {})
         
         if method1 not in trees or method2 not in trees:
             return jsonify({'error': 'Uno o ambos árboles no han sido construidos'}), 400
         
-        tree1_newick = trees[method1]['newick']
-        tree2_newick = trees[method2]['newick']
+        tree1_newick = _tree_blob(store, session_id, method1)['newick']
+        tree2_newick = _tree_blob(store, session_id, method2)['newick']
         
         # Realizar comparación
         comparison_result = compare_trees(tree1_newick, tree2_newick)
@@ -207,44 +497,209 @@ def compare_trees_endpoint(session_id):
     except Exception as e:
         return jsonify({'error': f'Error comparando árboles: {str(e)}'}), 500
 
+@main.route('/api/compare_trees_batch/<session_id>', methods=['POST'])
+def compare_trees_batch(session_id):
+    """
+    Comparar N árboles a la vez: matrices N x N de distancia RF y RF
+    normalizada. Cuerpo JSON: `trees`, lista cuyos elementos son métodos
+    ya construidos en la sesión ("nj", "ml") u objetos {"name", "newick"}
+    (el Newick puede traer varios árboles separados por ';', p. ej. réplicas
+    bootstrap). Sin `trees` se comparan todos los árboles de la sesión.
+    """
+    try:
+        store = _sessions()
+        session_data = store.get(session_id)
+        if session_data is None:
+            return jsonify({'error': 'Sesión no encontrada'}), 404
+        
+        data = request.get_json(silent=True) or {}
+        session_trees = session_data.get('trees', {})
+        entries = data.get('trees', list(session_trees))
+        if not isinstance(entries, list):
+            return jsonify({'error': "'trees' debe ser una lista"}), 400
+        
+        names = []
+        trees = []
+        for entry in entries:
+            if isinstance(entry, str):
+                if entry not in session_trees:
+                    return jsonify({'error': f'El árbol {entry} no ha sido construido'}), 400
+                named = [(entry, _tree_blob(store, session_id, entry)['newick'])]
+            elif isinstance(entry, dict) and isinstance(entry.get('newick'), str):
+                name = str(entry.get('name') or f'tree{len(names) + 1}')
+                texts = split_newick(entry['newick'])
+                named = [(name, texts[0])] if len(texts) == 1 else \
+                    [(f'{name}_{k}', text) for k, text in enumerate(texts, 1)]
+            else:
+                return jsonify({'error': 'Cada árbol debe ser un método de la sesión o {"name", "newick"}'}), 400
+            for name, text in named:
+                try:
+                    trees.append(tree_cache.get(text))
+                except ValueError as e:
+                    return jsonify({'error': f'Newick inválido en {name}: {str(e)}'}), 400
+                names.append(name)
+        
+        if len(trees) < 2:
+            return jsonify({'error': 'Se necesitan al menos dos árboles para comparar'}), 400
+        
+        rf, normalized, taxa = rf_matrix(trees)
+        
+        return jsonify({
+            'status': 'success',
+            'names': names,
+            'common_taxa': taxa,
+            'rf_distance': rf.tolist(),
+            'normalized': normalized.tolist()
+        })
+        
+    except Exception as e:
+        return jsonify({'error': f'Error comparando árboles: {str(e)}'}), 500
+
 @main.route('/api/get_tree/<session_id>/<method>', methods=['GET'])
 def get_tree(session_id, method):
     """Obtener árbol específico"""
     try:
-        if session_id not in sessions:
+        store = _sessions()
+        session_data = store.get(session_id)
+        if session_data is None:
             return jsonify({'error': 'Sesión no encontrada'}), 404
         
-        session_data = sessions[session_id]
         trees = session_data.get('trees', {})
         
         if method not in trees:
             return jsonify({'error': f'Árbol {method} no encontrado'}), 404
         
-        return jsonify({
+        tree = _tree_blob(store, session_id, method)
+        response = {
             'status': 'success',
             'method': method,
-            'newick': trees[method]['newick'],
-            'tree_json': trees[method]['json'],
+            'newick': tree['newick'],
             'created_at': trees[method]['created_at']
-        })
+        }
+        response.update(_tree_views(session_id, method, tree['newick']))
+        return jsonify(response)
         
     except Exception as e:
         return jsonify({'error': f'Error obteniendo árbol: {str(e)}'}), 500
 
+@main.route('/api/tree_json/<session_id>/<method>', methods=['GET'])
+def get_tree_json(session_id, method):
+    """
+    Árbol en JSON plano para D3.js: arreglos paralelos por nodo en
+    pre-orden (`parent`, `branch_length`, `support`, `name`, `size`,
+    `leaves`). Con `?node=i&depth=d` solo el subárbol del nodo i hasta d
+    niveles, con los índices del árbol completo en `id` y los nodos
+    recortados en `collapsed`. La respuesta se envía por partes,
+    comprimida con gzip si el cliente lo acepta, y lleva ETag (304 con
+    If-None-Match).
+    """
+    try:
+        subtree = {}
+        for key in ('node', 'depth'):
+            if request.args.get(key) is not None:
+                value = request.args.get(key)
+                if not value.isdigit():
+                    return jsonify({'error': f"El parámetro '{key}' debe ser un entero no negativo"}), 400
+                subtree[key] = int(value)
+        
+        store = _sessions()
+        session_data = store.get(session_id)
+        if session_data is None:
+            return jsonify({'error': 'Sesión no encontrada'}), 404
+        if method not in session_data.get('trees', {}):
+            return jsonify({'error': f'Árbol {method} no encontrado'}), 404
+        
+        newick = _tree_blob(store, session_id, method)['newick']
+        key = cache_key('tree_json', content_key(newick), subtree.get('node'), subtree.get('depth'))
+        if request.if_none_match.contains_weak(key):
+            response = Response(status=304)
+            response.set_etag(key, weak=True)
+            return response
+        
+        try:
+            flat = convert_newick_to_flat_json(newick, **subtree)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        chunks = (chunk.encode('utf-8') for chunk in iter_flat_json(flat))
+        gzip = 'gzip' in request.accept_encodings
+        response = Response(_gzip_stream(chunks) if gzip else chunks, mimetype='application/json')
+        if gzip:
+            response.headers['Content-Encoding'] = 'gzip'
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.set_etag(key, weak=True)
+        return response
+        
+    except Exception as e:
+        return jsonify({'error': f'Error obteniendo árbol: {str(e)}'}), 500
+
+def _gzip_stream(chunks):
+    """Comprimir con gzip una secuencia de bloques de bytes a medida que se generan"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+@main.route('/api/render_tree/<session_id>/<method>', methods=['GET'])
+def render_tree_image(session_id, method):
+    """
+    Imagen de un árbol de la sesión (`?format=png` o `svg`). Se dibuja solo
+    cuando se pide y se guarda en la caché de resultados por el hash del
+    Newick, así que el mismo árbol no se vuelve a dibujar; la respuesta
+    lleva ETag y admite peticiones condicionales (304).
+    """
+    try:
+        fmt = request.args.get('format', 'png').lower()
+        if fmt not in FORMATS:
+            return jsonify({'error': f"Formato debe ser uno de: {', '.join(FORMATS)}"}), 400
+        
+        store = _sessions()
+        session_data = store.get(session_id)
+        if session_data is None:
+            return jsonify({'error': 'Sesión no encontrada'}), 404
+        if method not in session_data.get('trees', {}):
+            return jsonify({'error': f'Árbol {method} no encontrado'}), 404
+        
+        newick = _tree_blob(store, session_id, method)['newick']
+        key = cache_key('render', content_key(newick), fmt)
+        if request.if_none_match.contains(key):
+            return '', 304, {'ETag': f'"{key}"'}
+        
+        cache = _result_cache()
+        name = f'tree.{fmt}'
+        cached = cache.get('render', key) if cache is not None else None
+        if cached is not None:
+            with open(os.path.join(cached, name), 'rb') as f:
+                image = f.read()
+        else:
+            image = render_tree(tree_cache.get(newick).tree, fmt)
+            if cache is not None:
+                cache.put('render', key, {name: image})
+        
+        return send_file(io.BytesIO(image), mimetype=FORMATS[fmt], etag=key,
+                         download_name=f'{session_id}_{method}.{fmt}')
+        
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 501
+    except Exception as e:
+        return jsonify({'error': f'Error dibujando árbol: {str(e)}'}), 500
+
 @main.route('/api/session/<session_id>', methods=['GET'])
 def get_session_info(session_id):
     """Obtener información completa de una sesión"""
     try:
-        if session_id not in sessions:
+        store = _sessions()
+        session_data = store.get(session_id)
+        if session_data is None:
             return jsonify({'error': 'Sesión no encontrada'}), 404
         
-        session_data = sessions[session_id]
-        
         return jsonify({
             'session_id': session_id,
             'filename': session_data['filename'],
-            'sequences_count': len(session_data['sequences']),
-            'sequences': list(session_data['sequences'].keys()),
+            'sequences_count': session_data['sequences_count'],
+            'sequences': FastaIndex.open(session_data['filepath']).names(),
             'has_alignment': session_data.get('alignment') is not None,
             'available_trees': list(session_data.get('trees', {}).keys()),
             'created_at': session_data['created_at']
@@ -253,16 +708,27 @@ def get_session_info(session_id):
     except Exception as e:
         return jsonify({'error': f'Error obteniendo información de sesión: {str(e)}'}), 500
 
+@main.route('/api/session/<session_id>', methods=['DELETE'])
+def delete_session(session_id):
+    """Eliminar una sesión con sus datos y sus archivos en uploads/results"""
+    try:
+        if not _sessions().delete(session_id):
+            return jsonify({'error': 'Sesión no encontrada'}), 404
+        return jsonify({'status': 'success', 'session_id': session_id})
+        
+    except Exception as e:
+        return jsonify({'error': f'Error eliminando sesión: {str(e)}'}), 500
+
 @main.route('/api/sessions', methods=['GET'])
 def list_sessions():
     """Listar todas las sesiones activas"""
     try:
         session_list = []
-        for session_id, data in sessions.items():
+        for session_id, data in _sessions().items():
             session_list.append({
                 'session_id': session_id,
                 'filename': data['filename'],
-                'sequences_count': len(data['sequences']),
+                'sequences_count': data['sequences_count'],
                 'has_alignment': data.get('alignment') is not None,
                 'trees_count': len(data.get('trees', {})),
                 'created_at': data['created_at']
@@ -282,7 +748,8 @@ def health_check():
     return jsonify({
         'status': 'healthy',
         'message': 'Filogenia Dashboard API funcionando correctamente',
-        'timestamp': datetime.now().isoformat()
+        'timestamp': datetime.now().isoformat(),
+        'tree_cache': tree_cache.info()
     })
 
 # Guia de endpoints de la API
@@ -295,10 +762,18 @@ def dashboard():
             'upload': '/api/upload_fasta',
             'align': '/api/align/<session_id>',
             'build_tree': '/api/build_tree/<session_id>/<method>',
+            'append_sequences': '/api/append_sequences/<session_id>',
             'compare_trees': '/api/compare_trees/<session_id>',
+            'compare_trees_batch': '/api/compare_trees_batch/<session_id>',
             'get_tree': '/api/get_tree/<session_id>/<method>',
+            'tree_json': '/api/tree_json/<session_id>/<method>?node=&depth=',
+            'render_tree': '/api/render_tree/<session_id>/<method>?format=png|svg',
             'session_info': '/api/session/<session_id>',
             'list_sessions': '/api/sessions',
+            'list_jobs': '/api/jobs',
+            'job_status': '/api/jobs/<job_id>',
+            'cancel_job': '/api/jobs/<job_id>/cancel',
+            'result_cache': '/api/cache',
             'health': '/api/health'
         }
     })
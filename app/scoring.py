@@ -0,0 +1,179 @@
+from functools import lru_cache
+import numpy as np
+from Bio.Align import substitution_matrices
+
+
+def _dna_matrix(match, transition, transversion):
+    """Matriz de ADN que distingue transiciones (A<->G, C<->T) de transversiones"""
+    purines = set('AG')
+    matrix = {}
+    for x in 'ACGT':
+        matrix[x] = {}
+        for y in 'ACGT':
+            if x == y:
+                matrix[x][y] = match
+            elif (x in purines) == (y in purines):
+                matrix[x][y] = transition
+            else:
+                matrix[x][y] = transversion
+    return matrix
+
+
+# Matrices de ADN propias; el resto de nombres (BLOSUM62, PAM250, NUC.4.4...)
+# se cargan desde Biopython
+DNA_MATRICES = {
+    'DNA': _dna_matrix(5, -4, -4),
+    'DNA_TRANSITION': _dna_matrix(2, -1, -2),
+}
+
+
+class ScoringScheme:
+    """
+    Esquema de puntuación: tabla de sustitución precalculada y penalidades
+    de gap. Un gap de longitud L puntúa gap_open + (L-1) * gap_extend; si
+    ambos valores coinciden el modelo es lineal.
+
+    Las secuencias se codifican una sola vez a índices uint8 (`encode`), de
+    modo que el alineamiento solo consulta `table[x, y]`.
+    """
+
+    def __init__(self, name, lookup, table, gap_open, gap_extend):
+        if gap_extend < gap_open:
+            raise ValueError("gap_extend no puede penalizar más que gap_open")
+        self.name = name
+        self.lookup = lookup
+        self.table = np.asarray(table, dtype=np.float64)
+        self.gap_open = gap_open
+        self.gap_extend = gap_extend
+        self.integral = (
+            bool(np.all(self.table == np.round(self.table)))
+            and float(gap_open).is_integer() and float(gap_extend).is_integer()
+        )
+
+    @property
+    def affine(self):
+        return self.gap_open != self.gap_extend
+
+    def encode(self, seq):
+        """Codificar una secuencia a un arreglo de índices de la tabla"""
+        raw = np.frombuffer(str(seq).encode('latin-1', 'replace'), dtype=np.uint8)
+        return self.lookup[raw]
+
+    def describe(self):
+        """Parámetros del esquema en formato serializable"""
+        info = {
+            'matrix': self.name,
+            'gap_open': self.gap_open,
+            'gap_extend': self.gap_extend,
+        }
+        if self.name is None:
+            for key, value in (('match', self.table[0, 0]), ('mismatch', self.table[0, 1])):
+                info[key] = int(value) if self.integral else float(value)
+        return info
+
+
+@lru_cache(maxsize=32)
+def _simple_table(match, mismatch):
+    """Tabla 256x256 de coincidencia/discrepancia sobre los bytes crudos"""
+    table = np.full((256, 256), mismatch, dtype=np.float64)
+    np.fill_diagonal(table, match)
+    table.setflags(write=False)
+    return table
+
+
+def _matrix_table(matrix):
+    """Construir (lookup, tabla) a partir de un dict de dicts {x: {y: score}}"""
+    alphabet = sorted(matrix)
+    size = len(alphabet)
+    if any(len(x) != 1 for x in alphabet):
+        raise ValueError("Los símbolos de la matriz deben ser caracteres individuales")
+    if size >= 255:
+        raise ValueError("La matriz de sustitución tiene demasiados símbolos")
+
+    table = np.empty((size + 1, size + 1), dtype=np.float64)
+    for i, x in enumerate(alphabet):
+        for j, y in enumerate(alphabet):
+            try:
+                table[i, j] = matrix[x][y]
+            except KeyError:
+                try:
+                    table[i, j] = matrix[y][x]
+                except KeyError:
+                    raise ValueError(f"Falta el puntaje de '{x}' contra '{y}' "
+                                     "en la matriz de sustitución") from None
+    # Símbolos fuera del alfabeto: peor puntaje de la matriz
+    worst = table[:size, :size].min()
+    table[size, :] = worst
+    table[:, size] = worst
+
+    lookup = np.full(256, size, dtype=np.uint8)
+    for i, x in enumerate(alphabet):
+        lookup[ord(x.upper())] = i
+        lookup[ord(x.lower())] = i
+    return lookup, table
+
+
+def _load_named_matrix(name):
+    """Obtener una matriz por nombre como dict de dicts"""
+    key = name.upper()
+    if key in DNA_MATRICES:
+        return DNA_MATRICES[key]
+    try:
+        loaded = substitution_matrices.load(key)
+    except (FileNotFoundError, ValueError):
+        available = sorted(DNA_MATRICES) + substitution_matrices.load()
+        raise ValueError(f"Matriz desconocida: {name}. Disponibles: {', '.join(available)}")
+    alphabet = loaded.alphabet
+    return {x: {y: float(loaded[x][y]) for y in alphabet} for x in alphabet}
+
+
+def get_scoring_scheme(matrix=None, match=1, mismatch=-1, gap=-2,
+                       gap_open=None, gap_extend=None):
+    """
+    Crear un ScoringScheme.
+
+    `matrix` puede ser None (coincidencia/discrepancia sobre los caracteres
+    tal cual, como el alineador original), el nombre de una matriz (BLOSUM62,
+    DNA, DNA_TRANSITION...) o un dict de dicts con una matriz propia.
+    `gap_open`/`gap_extend` activan gaps afines; por defecto valen `gap`.
+    """
+    gap_open = gap if gap_open is None else gap_open
+    gap_extend = gap_open if gap_extend is None else gap_extend
+
+    if matrix is None:
+        lookup = np.arange(256, dtype=np.uint8)
+        return ScoringScheme(None, lookup, _simple_table(match, mismatch),
+                             gap_open, gap_extend)
+
+    if isinstance(matrix, str):
+        name = matrix.upper()
+        matrix = _load_named_matrix(matrix)
+    elif isinstance(matrix, dict):
+        name = 'custom'
+    else:
+        raise ValueError("La matriz debe ser un nombre o un diccionario")
+
+    lookup, table = _matrix_table(matrix)
+    return ScoringScheme(name, lookup, table, gap_open, gap_extend)
+
+
+def scheme_from_params(params):
+    """
+    Construir un esquema a partir del cuerpo JSON de una petición.
+    Lanza ValueError si algún parámetro no es válido.
+    """
+    params = params or {}
+    numeric = {}
+    for key in ('match', 'mismatch', 'gap', 'gap_open', 'gap_extend'):
+        if params.get(key) is not None:
+            value = params[key]
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise ValueError(f"El parámetro '{key}' debe ser numérico")
+            numeric[key] = value
+
+    matrix = params.get('matrix')
+    if isinstance(matrix, dict):
+        for row in matrix.values():
+            if not isinstance(row, dict):
+                raise ValueError("La matriz propia debe ser un diccionario de diccionarios")
+    return get_scoring_scheme(matrix=matrix, **numeric)
@@ -0,0 +1,284 @@
+import copy
+import glob
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import closing
+
+# Backends de sesiones disponibles
+BACKENDS = ('memory', 'sqlite')
+
+# Una sesión sin usar durante este tiempo (segundos) se elimina
+DEFAULT_TTL = 24 * 3600
+
+# Máximo de sesiones guardadas; al superarlo se eliminan las usadas hace más tiempo
+DEFAULT_MAX_SESSIONS = 1000
+
+
+def valid_session_id(session_id):
+    """
+    True si session_id es un UUID en forma canónica, como los que crea
+    /api/upload_fasta. El id se usa en rutas de archivos, así que cualquier
+    otro valor (p. ej. '..') se rechaza antes de tocar el disco.
+    """
+    try:
+        return str(uuid.UUID(session_id)) == session_id
+    except (TypeError, ValueError, AttributeError):
+        return False
+
+
+class SessionStore:
+    """
+    Almacén de sesiones: metadatos pequeños (dict serializable a JSON) y
+    datos grandes por nombre ("blobs": secuencias, alineamiento, árboles).
+    Las sesiones caducan tras `ttl` segundos sin uso y, por encima de
+    `max_sessions`, se eliminan las usadas hace más tiempo. Al eliminar una
+    sesión se borran también sus archivos `{session_id}_*` de
+    `file_folders` (uploads y results).
+
+    get() devuelve una copia de los metadatos; los cambios se guardan con
+    update(session_id, func), que aplica func(metadatos) de forma atómica.
+    Los ids que no son UUID no existen: get() da None, delete() False y
+    create() lanza ValueError.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, max_sessions=DEFAULT_MAX_SESSIONS, file_folders=()):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.file_folders = list(file_folders)
+
+    def __contains__(self, session_id):
+        return self.get(session_id) is not None
+
+    def _check_id(self, session_id):
+        if not valid_session_id(session_id):
+            raise ValueError(f"Identificador de sesión inválido: {session_id!r}")
+
+    def _remove_files(self, session_id):
+        """Borrar los archivos de la sesión en uploads/results"""
+        for folder in self.file_folders:
+            for path in glob.glob(os.path.join(folder, f"{glob.escape(session_id)}_*")):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+class MemorySessionStore(SessionStore):
+    """Sesiones en memoria del proceso (un solo trabajador), acotadas por TTL y LRU"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._meta = OrderedDict()
+        self._blobs = {}
+        self._accessed = {}
+        self._lock = threading.RLock()
+
+    def create(self, session_id, meta):
+        self._check_id(session_id)
+        with self._lock:
+            self._meta[session_id] = copy.deepcopy(meta)
+            self._blobs[session_id] = {}
+            self._accessed[session_id] = time.time()
+            self.cleanup()
+
+    def get(self, session_id):
+        with self._lock:
+            if not self._touch(session_id):
+                return None
+            return copy.deepcopy(self._meta[session_id])
+
+    def update(self, session_id, func):
+        """Aplicar func(metadatos) y guardar; False si la sesión no existe"""
+        with self._lock:
+            if not self._touch(session_id):
+                return False
+            func(self._meta[session_id])
+            return True
+
+    def set_blob(self, session_id, name, value):
+        with self._lock:
+            if session_id in self._blobs:
+                self._blobs[session_id][name] = value
+
+    def get_blob(self, session_id, name, default=None):
+        with self._lock:
+            return self._blobs.get(session_id, {}).get(name, default)
+
+    def delete(self, session_id):
+        with self._lock:
+            found = self._meta.pop(session_id, None) is not None
+            self._blobs.pop(session_id, None)
+            self._accessed.pop(session_id, None)
+        if found:
+            self._remove_files(session_id)
+        return found
+
+    def items(self):
+        """(session_id, metadatos) de las sesiones vigentes, de la más antigua a la más reciente"""
+        with self._lock:
+            self.cleanup()
+            return [(session_id, copy.deepcopy(meta)) for session_id, meta in self._meta.items()]
+
+    def cleanup(self):
+        """Eliminar sesiones caducadas y las menos usadas por encima del máximo"""
+        with self._lock:
+            limit = time.time() - self.ttl
+            expired = [session_id for session_id, accessed in self._accessed.items() if accessed < limit]
+            by_use = sorted(self._accessed, key=self._accessed.get)
+            expired += by_use[:max(0, len(by_use) - self.max_sessions)]
+        for session_id in set(expired):
+            self.delete(session_id)
+
+    def _touch(self, session_id):
+        """Marcar la sesión como usada; False si no existe o caducó"""
+        if session_id not in self._meta:
+            return False
+        if self._accessed[session_id] < time.time() - self.ttl:
+            self.delete(session_id)
+            return False
+        self._accessed[session_id] = time.time()
+        return True
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Sesiones en disco: los metadatos en una base SQLite y cada blob en un
+    archivo JSON dentro de `blob_folder/<session_id>/`. El proceso no
+    guarda nada en memoria y varios trabajadores (p. ej. gunicorn) pueden
+    compartir las mismas sesiones.
+    """
+
+    def __init__(self, path, blob_folder, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.blob_folder = blob_folder
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        os.makedirs(blob_folder, exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("CREATE TABLE IF NOT EXISTS sessions ("
+                       "id TEXT PRIMARY KEY, meta TEXT NOT NULL, "
+                       "created REAL NOT NULL, accessed REAL NOT NULL)")
+            db.execute("CREATE INDEX IF NOT EXISTS sessions_accessed ON sessions (accessed)")
+
+    def _connect(self):
+        """Conexión nueva por operación: sqlite3 no comparte conexiones entre hilos"""
+        return closing(sqlite3.connect(self.path, timeout=30, isolation_level=None))
+
+    def create(self, session_id, meta):
+        self._check_id(session_id)
+        now = time.time()
+        with self._connect() as db:
+            db.execute("INSERT INTO sessions (id, meta, created, accessed) VALUES (?, ?, ?, ?)",
+                       (session_id, json.dumps(meta), now, now))
+        os.makedirs(self._blob_dir(session_id), exist_ok=True)
+        self.cleanup()
+
+    def get(self, session_id):
+        if not valid_session_id(session_id):
+            return None
+        with self._connect() as db:
+            row = db.execute("SELECT meta, accessed FROM sessions WHERE id = ?",
+                             (session_id,)).fetchone()
+            if row is not None and row[1] >= time.time() - self.ttl:
+                db.execute("UPDATE sessions SET accessed = ? WHERE id = ?", (time.time(), session_id))
+                return json.loads(row[0])
+        if row is not None:
+            self.delete(session_id)
+        return None
+
+    def update(self, session_id, func):
+        """Aplicar func(metadatos) y guardar en una transacción; False si la sesión no existe"""
+        if not valid_session_id(session_id):
+            return False
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute("SELECT meta FROM sessions WHERE id = ? AND accessed >= ?",
+                                 (session_id, time.time() - self.ttl)).fetchone()
+                if row is None:
+                    db.execute("ROLLBACK")
+                    return False
+                meta = json.loads(row[0])
+                func(meta)
+                db.execute("UPDATE sessions SET meta = ?, accessed = ? WHERE id = ?",
+                           (json.dumps(meta), time.time(), session_id))
+                db.execute("COMMIT")
+                return True
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+
+    def set_blob(self, session_id, name, value):
+        if not valid_session_id(session_id):
+            return
+        folder = self._blob_dir(session_id)
+        if not os.path.isdir(folder):
+            return
+        path = os.path.join(folder, f"{name}.json")
+        temp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp, 'w') as f:
+            json.dump(value, f)
+        # Reemplazo atómico: quien lee ve el blob anterior o el nuevo, nunca uno a medias
+        os.replace(temp, path)
+
+    def get_blob(self, session_id, name, default=None):
+        if not valid_session_id(session_id):
+            return default
+        try:
+            with open(os.path.join(self._blob_dir(session_id), f"{name}.json")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return default
+
+    def delete(self, session_id):
+        if not valid_session_id(session_id):
+            return False
+        with self._connect() as db:
+            found = db.execute("DELETE FROM sessions WHERE id = ?", (session_id,)).rowcount > 0
+        if found:
+            shutil.rmtree(self._blob_dir(session_id), ignore_errors=True)
+            self._remove_files(session_id)
+        return found
+
+    def items(self):
+        """(session_id, metadatos) de las sesiones vigentes, de la más antigua a la más reciente"""
+        self.cleanup()
+        with self._connect() as db:
+            rows = db.execute("SELECT id, meta FROM sessions ORDER BY created").fetchall()
+        return [(session_id, json.loads(meta)) for session_id, meta in rows]
+
+    def cleanup(self):
+        """Eliminar sesiones caducadas y las menos usadas por encima del máximo"""
+        with self._connect() as db:
+            expired = db.execute("SELECT id FROM sessions WHERE accessed < ?",
+                                 (time.time() - self.ttl,)).fetchall()
+            expired += db.execute("SELECT id FROM sessions ORDER BY accessed DESC LIMIT -1 OFFSET ?",
+                                  (self.max_sessions,)).fetchall()
+        for session_id in {row[0] for row in expired}:
+            self.delete(session_id)
+
+    def _blob_dir(self, session_id):
+        self._check_id(session_id)
+        return os.path.join(self.blob_folder, os.path.basename(session_id))
+
+
+def create_session_store(config):
+    """Almacén de sesiones según la configuración de la aplicación (SESSION_*)"""
+    backend = config.get('SESSION_BACKEND', 'sqlite')
+    options = {
+        'ttl': config.get('SESSION_TTL', DEFAULT_TTL),
+        'max_sessions': config.get('MAX_SESSIONS', DEFAULT_MAX_SESSIONS),
+        'file_folders': [config['UPLOAD_FOLDER'], config['RESULTS_FOLDER']]
+    }
+    if backend == 'memory':
+        return MemorySessionStore(**options)
+    if backend == 'sqlite':
+        return SQLiteSessionStore(config['SESSION_DB'], config['SESSION_BLOB_FOLDER'], **options)
+    raise ValueError(f"Backend de sesiones desconocido: {backend}")
@@ -0,0 +1,323 @@
+"""
+Trabajos de alineamiento y construcción de árboles. Reciben datos simples
+(sin sesión ni contexto de Flask), así que se pueden ejecutar dentro de la
+petición o en la cola de trabajos (app/jobs.py) en otro proceso; devuelven
+lo que la ruta guarda en la sesión. `progress(porcentaje, mensaje)`
+informa el avance.
+
+Los archivos de la sesión se escriben en rutas temporales (result['outputs']:
+temporal -> definitiva) y la ruta los mueve a su lugar con commit_outputs al
+guardar el resultado, así un trabajo cancelado no pisa los de la sesión.
+
+Con una caché de resultados (app/result_cache.py) los alineamientos,
+matrices de distancia y árboles ya calculados con las mismas secuencias y
+parámetros se reutilizan, aunque provengan de otra sesión.
+"""
+import io
+import json
+import os
+import shutil
+import uuid
+import numpy as np
+from app.fasta_index import FastaIndex, read_sequences
+from app.multiple_aligner import add_to_alignment, align_sequences, write_alignment
+from app.tree_builder import construir_nj_tree, guardar_newick
+from app.ml_tree import construir_ml_tree
+from app.scoring import scheme_from_params
+from app.pairwise_distances import all_pairs_alignment
+from app.kmer_distance import kmer_distance_matrix, mash_distance_matrix
+from app.distance_models import MODELS, distance_matrix, encode_alignment, read_encoded_alignment
+from app.binary_alignment import binary_alignment_path
+from app.result_cache import cache_key
+from app.compact_tree import CompactTree
+from app.likelihood import TreeLikelihood
+from app.tree_insertion import insert_taxa
+
+
+def _ignore(percent, message=None):
+    pass
+
+
+def _stage(progress, start, end, message):
+    """Avance de una etapa (fracción 0-1) como porcentaje entre start y end"""
+    return lambda fraction: progress(start + (end - start) * fraction, message)
+
+
+def staging_path(path):
+    """Ruta temporal junto a `path` (con el mismo prefijo de sesión)"""
+    return f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+
+
+def commit_outputs(result):
+    """Mover a su lugar los archivos que el trabajo escribió en rutas temporales"""
+    for temp, path in result.pop('outputs', {}).items():
+        os.replace(temp, path)
+    return result
+
+
+def discard_outputs(result):
+    """Borrar los archivos temporales de un resultado que no se va a usar"""
+    for temp in (result or {}).get('outputs', {}):
+        if os.path.exists(temp):
+            os.remove(temp)
+
+
+def _lookup(cache, kind, key):
+    """Carpeta de la entrada en caché, o None si no hay caché, clave o entrada"""
+    if cache is None or key is None:
+        return None
+    return cache.get(kind, key)
+
+
+def _cached_distances(cache, key, compute):
+    """Matriz de distancias y nombres desde la caché, o compute() guardándolos"""
+    entry = _lookup(cache, 'distance', key)
+    if entry is not None:
+        with open(os.path.join(entry, 'labels.json')) as f:
+            labels = json.load(f)
+        return np.load(os.path.join(entry, 'matrix.npy')), labels
+    matrix, labels = compute()
+    if cache is not None and key is not None:
+        buffer = io.BytesIO()
+        np.save(buffer, np.asarray(matrix, dtype=float))
+        cache.put('distance', key, {'matrix.npy': buffer.getvalue(),
+                                    'labels.json': json.dumps(list(labels)).encode('utf-8')})
+    return matrix, labels
+
+
+def align_task(session_id, fasta_path, params, results_folder, digest=None, cache=None,
+               progress=None):
+    """
+    Alineamiento múltiple de las secuencias del FASTA subido con los
+    parámetros ya validados de /api/align. `digest`: hash de las
+    secuencias (FastaIndex.digest); con él y `cache` se reutiliza un
+    alineamiento ya calculado. Devuelve el dict 'alignment' de la sesión,
+    con su propio hash en 'digest'.
+    """
+    progress = progress or _ignore
+    scoring = scheme_from_params(params)
+    strategy = params.get('strategy', 'progressive')
+    key = cache_key('alignment', digest, scoring.describe(), strategy) if digest else None
+
+    aligned_file = os.path.join(results_folder, f"{session_id}_aligned.fasta")
+    staged = staging_path(aligned_file)
+    # Primero el FASTA: el binario no debe quedar más antiguo que él
+    outputs = {staged: aligned_file,
+               binary_alignment_path(staged): binary_alignment_path(aligned_file)}
+    entry = _lookup(cache, 'alignment', key)
+    if entry is not None:
+        progress(5, 'alineamiento en caché')
+        shutil.copyfile(os.path.join(entry, 'aligned.fasta'), staged)
+        shutil.copyfile(os.path.join(entry, 'aligned.aln'), binary_alignment_path(staged))
+        codes, labels = read_encoded_alignment(staged)
+    else:
+        # Alinear en memoria; los archivos de la sesión se escriben una sola
+        # vez, para exportar y para las etapas siguientes
+        progress(5, 'alineando')
+        try:
+            aligned = align_sequences(read_sequences(fasta_path), scoring, strategy)
+            codes, labels = encode_alignment(aligned)
+        except Exception as e:
+            raise Exception(f"Error en alineamiento múltiple: {str(e)}")
+        progress(90, 'guardando alineamiento')
+        write_alignment(staged, codes, labels)
+        if cache is not None and key is not None:
+            cache.put('alignment', key, {'aligned.fasta': staged,
+                                         'aligned.aln': binary_alignment_path(staged)})
+
+    alignment_data = {label: codes[k].tobytes().decode('latin-1') for k, label in enumerate(labels)}
+    return {
+        'file_path': aligned_file,
+        'sequences': alignment_data,
+        'length': codes.shape[1],
+        'scoring': scoring.describe(),
+        'params': {name: value for name, value in params.items() if name != 'async'},
+        'digest': key,
+        'outputs': outputs
+    }
+
+
+def build_tree_task(session_id, method, distance, fasta_path=None, alignment_file=None,
+                    options=None, replicates=None, align_processes=None, digest=None,
+                    results_folder='app/results', cache=None, progress=None):
+    """
+    Construir el árbol `method` ("nj" o "ml") con la distancia `distance`,
+    ya validados por /api/build_tree. Las distancias sobre el alineamiento
+    (MODELS) leen `alignment_file`; pairwise, mash y kmer, las secuencias
+    del FASTA subido `fasta_path`. `options`: parámetros de mash;
+    `replicates`: bootstrap, seed y processes. `digest`: hash de la
+    entrada (del alineamiento con MODELS, de las secuencias si no); con él
+    y `cache` se reutilizan el árbol y la matriz de distancias.
+    Devuelve dict con newick, file_path y, en ML, log_likelihood.
+    """
+    progress = progress or _ignore
+    replicates = replicates or {}
+    bootstrap = replicates.get('bootstrap', 0)
+    result = {}
+
+    # El árbol depende de la entrada y los parámetros, no de los procesos
+    tree_key = distance_key = None
+    if digest:
+        tree_key = cache_key('tree', digest, method, distance, options or {}, bootstrap,
+                             replicates.get('seed') if bootstrap else None)
+        distance_key = cache_key('distance', digest, distance, options or {})
+
+    # Archivo Newick de la sesión (se escribe primero en una ruta temporal)
+    tree_file = os.path.join(results_folder, f"{session_id}_{method}_tree.txt")
+    staged = staging_path(tree_file)
+
+    entry = _lookup(cache, 'tree', tree_key)
+    if entry is not None:
+        progress(5, 'árbol en caché')
+        with open(os.path.join(entry, 'result.json')) as f:
+            result = json.load(f)
+        guardar_newick(result['newick'], staged)
+        result['file_path'] = tree_file
+        result['outputs'] = {staged: tree_file}
+        return result
+
+    if distance not in MODELS:
+        def compute():
+            sequences = read_sequences(fasta_path)
+            if distance == 'pairwise':
+                matrix, _, labels = all_pairs_alignment(sequences, processes=align_processes)
+                return matrix, labels
+            if distance == 'mash':
+                return mash_distance_matrix(sequences, **(options or {}))
+            return kmer_distance_matrix(sequences)
+
+        progress(5, 'calculando distancias')
+        matrix, labels = _cached_distances(cache, distance_key, compute)
+        progress(80, 'construyendo árbol')
+        tree_newick, _ = construir_nj_tree(
+            distance_matrix=matrix, labels=labels, output_path=staged)
+    elif method == 'nj' and not bootstrap:
+        def compute():
+            codes, labels = read_encoded_alignment(alignment_file)
+            return distance_matrix(codes, distance), labels
+
+        progress(5, 'calculando distancias')
+        matrix, labels = _cached_distances(cache, distance_key, compute)
+        progress(80, 'construyendo árbol')
+        tree_newick, _ = construir_nj_tree(
+            distance_matrix=matrix, labels=labels, output_path=staged)
+    elif method == 'nj':
+        progress(5, 'construyendo árbol')
+        tree_newick, _ = construir_nj_tree(
+            alignment_file, model=distance, progress=_stage(progress, 10, 95, 'bootstrap'),
+            output_path=staged, **replicates)
+    else:
+        progress(5, 'búsqueda de máxima verosimilitud')
+        tree_newick, _, result['log_likelihood'] = construir_ml_tree(
+            alignment_file, model=distance, progress=_stage(progress, 30, 95, 'bootstrap'),
+            output_path=staged, **replicates)
+
+    result['newick'] = tree_newick
+    if cache is not None and tree_key is not None:
+        cache.put('tree', tree_key, {'result.json': json.dumps(result).encode('utf-8')})
+    result['file_path'] = tree_file
+    result['outputs'] = {staged: tree_file}
+    return result
+
+
+def append_task(session_id, new_fasta, fasta_path, alignment=None, trees=None, refine=False,
+                align_processes=None, results_folder='app/results', progress=None):
+    """
+    Agregar a la sesión las secuencias del FASTA `new_fasta` sin recalcular
+    todo: las nuevas se alinean contra el perfil del alineamiento existente
+    (`alignment`, el dict de la sesión, o None), se calculan solo sus filas
+    de distancias y cada taxón se inserta en los árboles existentes
+    (`trees`: método -> {newick, distance, options}) en la arista de menor
+    error. Con `refine`, los árboles ML se refinan con NNI alrededor de los
+    taxones insertados. Los archivos de la sesión se reescriben al final,
+    cuando todo se calculó. Devuelve dict con added, sequences_count,
+    digest, alignment y trees (método -> newick, file_path y, en ML,
+    log_likelihood).
+    """
+    progress = progress or _ignore
+    trees = trees or {}
+    outputs = {}
+    try:
+        added = FastaIndex.open(new_fasta)
+        names = added.names()
+        new_sequences = added.sequences()
+
+        codes = labels = None
+        if alignment:
+            progress(5, 'alineando secuencias nuevas')
+            params = alignment.get('params') or {}
+            old_codes, old_labels = read_encoded_alignment(alignment['file_path'])
+            codes, labels = add_to_alignment(old_codes, old_labels, new_sequences,
+                                             scheme_from_params(params))
+
+        result = {'added': names, 'alignment': None, 'trees': {}}
+        sequences = None
+        for k, (method, info) in enumerate(trees.items()):
+            progress(30 + 60 * k / len(trees), f'insertando en el árbol {method}')
+            distance = info.get('distance', 'identity')
+            if distance in MODELS:
+                if codes is None:
+                    raise ValueError(f"El árbol {method} requiere el alineamiento de la sesión")
+                row_of = {label: row for row, label in enumerate(labels)}
+                rows = distance_matrix(codes, distance, rows=[row_of[name] for name in names])
+                columns = labels
+            else:
+                if sequences is None:
+                    sequences = read_sequences(fasta_path)
+                    sequences.update(new_sequences)
+                positions = list(range(len(sequences) - len(names), len(sequences)))
+                if distance == 'pairwise':
+                    rows, _, columns = all_pairs_alignment(sequences, processes=align_processes,
+                                                           rows=positions)
+                elif distance == 'mash':
+                    rows, columns = mash_distance_matrix(sequences, rows=positions,
+                                                         **(info.get('options') or {}))
+                else:
+                    rows, columns = kmer_distance_matrix(sequences, rows=positions)
+
+            tree, leaves = insert_taxa(CompactTree.from_newick(info['newick']), names, rows, columns)
+            entry = {}
+            if method == 'ml':
+                likelihood = TreeLikelihood(tree, codes, labels)
+                if refine:
+                    entry['log_likelihood'] = likelihood.local_search(leaves)
+                    tree = likelihood.to_tree()
+                else:
+                    entry['log_likelihood'] = likelihood.log_likelihood()
+            entry['newick'] = tree.to_newick()
+            result['trees'][method] = entry
+
+        # Escribir los archivos de la sesión en rutas temporales: el FASTA
+        # subido se copia y se le agregan las secuencias nuevas
+        progress(95, 'guardando')
+        staged = staging_path(fasta_path)
+        outputs[staged] = fasta_path
+        outputs[f"{staged}.fai"] = f"{fasta_path}.fai"
+        shutil.copyfile(fasta_path, staged)
+        index = FastaIndex(staged, FastaIndex.open(fasta_path).entries)
+        index.append(added)
+        result['sequences_count'] = len(index)
+        result['digest'] = index.digest()
+        if codes is not None:
+            staged = staging_path(alignment['file_path'])
+            outputs[staged] = alignment['file_path']
+            outputs[binary_alignment_path(staged)] = binary_alignment_path(alignment['file_path'])
+            write_alignment(staged, codes, labels)
+            result['alignment'] = dict(
+                alignment, length=codes.shape[1],
+                digest=cache_key('alignment', alignment['digest'], 'append', added.digest())
+                if alignment.get('digest') else None)
+        for method, entry in result['trees'].items():
+            entry['file_path'] = os.path.join(results_folder, f"{session_id}_{method}_tree.txt")
+            staged = staging_path(entry['file_path'])
+            outputs[staged] = entry['file_path']
+            guardar_newick(entry['newick'], staged)
+        result['outputs'] = outputs
+        return result
+    except Exception:
+        discard_outputs({'outputs': outputs})
+        raise
+    finally:
+        for path in (new_fasta, f"{new_fasta}.fai"):
+            if os.path.exists(path):
+                os.remove(path)
@@ -1,79 +1,104 @@
-from Bio import AlignIO
-from Bio.Phylo.TreeConstruction import DistanceCalculator, DistanceTreeConstructor
-from Bio import Phylo
+from Bio.Phylo.TreeConstruction import DistanceMatrix
 from app.upgma import upgma
+from app.neighbor_joining import neighbor_joining
+from app.distance_models import alignment_distance_matrix, distance_matrix as calcular_distancias, load_alignment
+from app.bootstrap import DEFAULT_SEED, bootstrap_support, with_support
+from app.compact_tree import CompactTree
+from app.tree_render import render_tree
 import os
-import matplotlib.pyplot as plt
+import numpy as np
 
-def calcular_matriz_distancia(path_alineado="results/alineado.fasta"):
-    alignment = AlignIO.read(path_alineado, "fasta")
-    calculator = DistanceCalculator("identity")
-    dm = calculator.get_distance(alignment)
+def calcular_matriz_distancia(alineamiento, model="identity"):
+    """
+    Matriz de distancias y nombres de un alineamiento: ruta de un FASTA
+    alineado o alineamiento en memoria (ver load_alignment)
+    """
+    return alignment_distance_matrix(alineamiento, model)
 
-    labels = dm.names
-    matrix = [[dm[i, j] for j in labels] for i in labels]
-    return matrix, labels
+def matriz_a_distance_matrix(matrix, labels):
+    """
+    Convertir una matriz de distancias NumPy (n x n), como la que devuelve
+    all_pairs_alignment, en un DistanceMatrix de Biopython
+    """
+    matrix = np.asarray(matrix, dtype=float)
+    lower = [matrix[i, :i + 1].tolist() for i in range(len(labels))]
+    return DistanceMatrix(list(labels), lower)
 
-def construir_upgma_tree():
-    # Asegurar que el archivo de alineamiento exista
-    if not os.path.exists("results/alineado.fasta"):
-        raise FileNotFoundError("El archivo de alineamiento no existe. Realiza la alineación primero.")
+def distance_matrix_a_numpy(dm):
+    """Convertir un DistanceMatrix de Biopython en (matriz NumPy n x n, nombres)"""
+    labels = list(dm.names)
+    matrix = np.array([[dm[i, j] for j in range(len(labels))] for i in range(len(labels))])
+    return matrix, labels
 
-    matrix, labels = calcular_matriz_distancia("results/alineado.fasta")
-    tree = upgma(matrix, labels)
+def construir_upgma_tree(alineamiento, output_path=None, image_path=None):
+    """
+    Construir árbol UPGMA desde un alineamiento (ruta o en memoria).
+    Devuelve el Newick; solo se escriben archivos si se pasan las rutas
+    (`output_path` para el Newick, `image_path` para la imagen).
+    """
+    matrix, labels = calcular_matriz_distancia(alineamiento)
+    tree_newick = upgma(matrix, labels).to_newick()
 
-    # Guardar como texto plano (Newick-like)
-    os.makedirs("results", exist_ok=True)
-    path = "results/upgma_tree.txt"
-    with open(path, "w") as f:
-        f.write(str(tree))
-    guardar_arbol_como_imagen("results/upgma_tree.txt", "static/arbol.png")
+    if output_path:
+        guardar_newick(tree_newick, output_path)
+    if image_path:
+        guardar_arbol_como_imagen(tree_newick, image_path)
 
-    return str(tree)
+    return tree_newick
 
-def construir_nj_tree(alignment_path=None, session_id=None):
+def construir_nj_tree(alineamiento=None, distance_matrix=None, labels=None, model="identity",
+                      bootstrap=0, seed=DEFAULT_SEED, processes=None, progress=None,
+                      output_path=None):
     """
-    Construir árbol Neighbor-Joining
+    Construir árbol Neighbor-Joining.
+    Si se pasa `distance_matrix` (NumPy n x n) y `labels`, se usa
+    directamente; si no, las distancias salen del alineamiento
+    (`alineamiento`: ruta o en memoria, ver load_alignment) con el modelo
+    `model` (identity, p, jc69 o k2p).
+    Con `bootstrap` > 0 se calculan ese número de réplicas (requiere el
+    alineamiento) y los soportes se escriben en los nodos internos;
+    `progress(fracción)` informa el avance de las réplicas.
+    Devuelve (newick, output_path); el Newick solo se escribe en disco si
+    se pasa `output_path` (p. ej. el archivo de la sesión).
     """
-    if alignment_path is None:
-        alignment_path = "results/alineado.fasta"
-    
-    # Asegurar que el archivo de alineamiento exista
-    if not os.path.exists(alignment_path):
-        raise FileNotFoundError("El archivo de alineamiento no existe. Realiza la alineación primero.")
-
-    alignment = AlignIO.read(alignment_path, "fasta")
-    calculator = DistanceCalculator("identity")
-    dm = calculator.get_distance(alignment)
+    codes = None
+    if distance_matrix is None:
+        if alineamiento is None:
+            raise ValueError("Se requiere un alineamiento o una matriz de distancias")
+        codes, labels = load_alignment(alineamiento)
+        distance_matrix = calcular_distancias(codes, model)
+    elif bootstrap:
+        raise ValueError("El bootstrap requiere un alineamiento múltiple")
 
-    constructor = DistanceTreeConstructor()
-    tree = constructor.nj(dm)
+    tree = neighbor_joining(distance_matrix, labels)
+    if bootstrap:
+        support = bootstrap_support(tree, codes, labels, 'nj', model, bootstrap, seed, processes,
+                                    progress)
+        tree = with_support(tree, support)
+    tree_newick = tree.to_newick()
 
-    # Determinar ruta del archivo de salida
-    if session_id:
-        results_dir = f"app/results"
-        tree_file = os.path.join(results_dir, f"{session_id}_nj_tree.txt")
-    else:
-        results_dir = "results"
-        tree_file = "results/nj_tree.txt"
-    
-    # Crear directorio si no existe
-    os.makedirs(results_dir, exist_ok=True)
-    
-    # Guardar árbol como archivo Newick
-    Phylo.write(tree, tree_file, "newick")
-    
-    # Generar imagen (opcional, para compatibilidad)
-    if not session_id:
-        guardar_arbol_como_imagen(tree_file, "static/arbol.png")
+    if output_path:
+        guardar_newick(tree_newick, output_path)
 
-    return tree.format("newick"), tree_file
+    return tree_newick, output_path
 
-def guardar_arbol_como_imagen(path_newick, output_path="static/arbol.png"):
-    tree = Phylo.read(path_newick, "newick")
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+def guardar_newick(tree_newick, path):
+    """Escribir un árbol Newick en `path`, creando la carpeta si hace falta"""
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    with open(path, "w") as f:
+        f.write(tree_newick + "\n")
 
-    fig = plt.figure(figsize=(8, 6))
-    Phylo.draw(tree, do_show=False)
-    plt.savefig(output_path)
-    plt.close(fig)
+def guardar_arbol_como_imagen(tree_newick, output_path, fmt='png'):
+    """
+    Dibujar un árbol (texto Newick) y guardarlo como imagen en `output_path`.
+    La API no lo usa al construir árboles: las imágenes se generan bajo
+    demanda en /api/render_tree (ver tree_render.py).
+    """
+    image = render_tree(CompactTree.from_newick(tree_newick), fmt)
+    folder = os.path.dirname(output_path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    with open(output_path, "wb") as f:
+        f.write(image)
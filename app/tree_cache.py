@@ -0,0 +1,153 @@
+import functools
+import hashlib
+import sys
+import threading
+from collections import OrderedDict
+import numpy as np
+from app.compact_tree import CompactTree
+
+# Tamaño máximo de la caché, en bytes (estimados) sumados entre todas las
+# entradas: cada árbol con todos sus datos derivados (biparticiones, JSON)
+MAX_CACHED_BYTES = 512 << 20
+
+
+def estimate_size(value):
+    """
+    Bytes aproximados que ocupa un valor: arreglos NumPy, contenedores
+    (listas, tuplas, conjuntos, dicts) con su contenido y escalares. Las
+    claves de texto de los dicts no se cuentan (se repiten en cada nodo del
+    JSON y se comparten). Sin recursión, así que sirve para el JSON anidado
+    de árboles grandes.
+    """
+    getsizeof = sys.getsizeof
+    total = 0
+    stack = [value]
+    pop, extend = stack.pop, stack.extend
+    while stack:
+        item = pop()
+        total += getsizeof(item)
+        kind = type(item)
+        if kind is dict:
+            extend(item.values())
+            extend(key for key in item if type(key) is not str)
+        elif kind in (list, tuple, set, frozenset):
+            extend(item)
+        elif kind is np.ndarray:
+            if item.base is not None:
+                total += item.nbytes
+        elif kind is CompactTree:
+            stack.append(vars(item))
+    return total
+
+
+def content_key(newick):
+    """Hash del texto Newick: el mismo árbol en cualquier sesión o método comparte entrada"""
+    return hashlib.blake2b(newick.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class ParsedTree:
+    """
+    Árbol ya leído (CompactTree) junto con los datos derivados de él
+    (hojas, biparticiones, estadísticas, JSON), calculados la primera vez
+    que se piden y reutilizados después. `size` estima los bytes del árbol
+    más los de todo lo guardado; la caché lo usa como peso de la entrada.
+    """
+
+    def __init__(self, tree):
+        self.tree = tree
+        self.size = estimate_size(tree)
+        self._memo = {}
+        # Aviso a la caché cuando el árbol crece (bytes agregados)
+        self._on_grow = None
+
+    def __len__(self):
+        return len(self.tree)
+
+    def memo(self, key, compute):
+        """Resultado de compute(tree), guardado bajo `key`"""
+        try:
+            return self._memo[key]
+        except KeyError:
+            value = self._memo[key] = compute(self.tree)
+            grown = estimate_size(key) + estimate_size(value)
+            self.size += grown
+            if self._on_grow is not None:
+                self._on_grow(self, grown)
+            return value
+
+
+class TreeCache:
+    """
+    Caché LRU de árboles parseados indexada por el hash del texto Newick.
+    El peso de cada entrada es el tamaño estimado del árbol y de sus datos
+    derivados, que crece a medida que se calculan; cuando la suma supera
+    `max_bytes` se descartan los árboles usados hace más tiempo. Segura
+    entre hilos.
+    """
+
+    def __init__(self, max_bytes=MAX_CACHED_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, newick):
+        """ParsedTree del texto Newick, leyéndolo solo si no está en la caché"""
+        key = content_key(newick)
+        with self._lock:
+            parsed = self._entries.get(key)
+            if parsed is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return parsed
+            self.misses += 1
+
+        parsed = ParsedTree(CompactTree.from_newick(newick))
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = parsed
+                self.bytes += parsed.size
+                parsed._on_grow = functools.partial(self._grow, key)
+                self._evict(keep=key)
+            return self._entries[key]
+
+    def _grow(self, key, parsed, grown):
+        """Sumar lo que creció una entrada (un dato derivado nuevo) y acotar la caché"""
+        with self._lock:
+            if self._entries.get(key) is not parsed:
+                # Ya fue descartado: su tamaño no cuenta
+                return
+            self.bytes += grown
+            self._evict(keep=key)
+
+    def _evict(self, keep):
+        """Descartar los árboles usados hace más tiempo hasta quedar bajo max_bytes (con el lock tomado)"""
+        # La entrada `keep` se conserva aunque sola supere el límite
+        for key in list(self._entries):
+            if self.bytes <= self.max_bytes:
+                break
+            if key != keep:
+                self.bytes -= self._entries.pop(key).size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def info(self):
+        """Contadores de uso de la caché"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'nodes': sum(len(parsed) for parsed in self._entries.values()),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+# Caché compartida por todo el proceso
+tree_cache = TreeCache()
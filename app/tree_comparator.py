@@ -1,29 +1,32 @@
-from Bio import Phylo
-from Bio.Phylo.TreeConstruction import DistanceCalculator
+from app.compact_tree import CompactTree
+from app.tree_cache import ParsedTree, tree_cache
 import json
+import math
 import os
-from io import StringIO
+import numpy as np
+from scipy import sparse
 
 def compare_trees(tree1_newick, tree2_newick):
     """
     Comparar dos árboles filogenéticos y devolver similitudes/diferencias
     """
     try:
-        # Leer árboles desde strings Newick
-        tree1 = Phylo.read(StringIO(tree1_newick), "newick")
-        tree2 = Phylo.read(StringIO(tree2_newick), "newick")
+        # Árboles ya leídos (caché por contenido): en comparaciones repetidas
+        # no se vuelve a parsear ni a recalcular biparticiones o estadísticas
+        tree1 = tree_cache.get(tree1_newick)
+        tree2 = tree_cache.get(tree2_newick)
         
         # Extraer terminales (hojas) de ambos árboles
-        terminals1 = [terminal.name for terminal in tree1.get_terminals()]
-        terminals2 = [terminal.name for terminal in tree2.get_terminals()]
+        terminals1 = _leaf_names(tree1)
+        terminals2 = _leaf_names(tree2)
         
         # Analizar coincidencias y diferencias en terminales
-        common_terminals = list(set(terminals1) & set(terminals2))
-        unique_tree1 = list(set(terminals1) - set(terminals2))
-        unique_tree2 = list(set(terminals2) - set(terminals1))
+        common_terminals = list(terminals1 & terminals2)
+        unique_tree1 = list(terminals1 - terminals2)
+        unique_tree2 = list(terminals2 - terminals1)
         
-        # Calcular distancia Robinson-Foulds simplificada
-        rf_distance = calculate_rf_distance(tree1, tree2)
+        # Distancia Robinson-Foulds (una sola vez, compartida con la similitud)
+        rf_distance = calculate_rf_distance(tree1, tree2, common_terminals)
         
         # Analizar topología
         topology_analysis = analyze_topology(tree1, tree2)
@@ -47,7 +50,7 @@ def compare_trees(tree1_newick, tree2_newick):
             'topology': topology_analysis,
             'branch_lengths': branch_comparison,
             'support_values': support_comparison,
-            'similarity_score': calculate_similarity_score(tree1, tree2, common_terminals)
+            'similarity_score': calculate_similarity_score(tree1, tree2, common_terminals, rf_distance)
         }
         
         return comparison_result
@@ -55,59 +58,109 @@ def compare_trees(tree1_newick, tree2_newick):
     except Exception as e:
         raise Exception(f"Error comparando árboles: {str(e)}")
 
-def calculate_rf_distance(tree1, tree2):
+def _as_parsed(tree):
+    """Aceptar ParsedTree (de la caché), CompactTree o árboles de Bio.Phylo"""
+    if isinstance(tree, ParsedTree):
+        return tree
+    return ParsedTree(tree if isinstance(tree, CompactTree) else CompactTree.from_bio(tree))
+
+def _leaf_names(tree):
+    """Conjunto de nombres de las hojas"""
+    return tree.memo('leaf_names', lambda t: frozenset(t.leaf_names()))
+
+def _splits(tree, common_terminals):
+    """Biparticiones no triviales (bitsets) del árbol restringido a `common_terminals`"""
+    common = frozenset(common_terminals)
+    return tree.memo(('splits', common),
+                     lambda t: frozenset(t.bipartitions(taxa_index(common)).values()))
+
+def taxa_index(names):
+    """Índice entero de cada taxón (orden alfabético), calculado una sola vez por comparación"""
+    return {name: k for k, name in enumerate(sorted(set(names)))}
+
+def calculate_rf_distance(tree1, tree2, common_terminals=None):
     """
-    Calcular distancia Robinson-Foulds simplificada
+    Calcular la distancia Robinson-Foulds entre las biparticiones no
+    triviales de ambos árboles, restringidos a los taxones comunes.
+    Los taxones se numeran una sola vez y cada árbol se recorre una vez en
+    post-orden construyendo las biparticiones como bitsets.
     """
     try:
-        # Obtener clados de cada árbol
-        clades1 = set()
-        clades2 = set()
-        
-        for clade in tree1.find_clades():
-            if not clade.is_terminal():
-                terminals = sorted([t.name for t in clade.get_terminals()])
-                if len(terminals) > 1:
-                    clades1.add(tuple(terminals))
-        
-        for clade in tree2.find_clades():
-            if not clade.is_terminal():
-                terminals = sorted([t.name for t in clade.get_terminals()])
-                if len(terminals) > 1:
-                    clades2.add(tuple(terminals))
+        tree1, tree2 = _as_parsed(tree1), _as_parsed(tree2)
+        if common_terminals is None:
+            common_terminals = _leaf_names(tree1) & _leaf_names(tree2)
+        
+        # Biparticiones de cada árbol
+        clades1 = _splits(tree1, common_terminals)
+        clades2 = _splits(tree2, common_terminals)
         
         # Calcular diferencia simétrica
-        common_clades = clades1 & clades2
-        unique_clades1 = clades1 - clades2
-        unique_clades2 = clades2 - clades1
+        common_clades = len(clades1 & clades2)
+        unique_clades1 = len(clades1) - common_clades
+        unique_clades2 = len(clades2) - common_clades
         
-        rf_distance = len(unique_clades1) + len(unique_clades2)
+        rf_distance = unique_clades1 + unique_clades2
         max_distance = len(clades1) + len(clades2)
         
         return {
             'distance': rf_distance,
             'max_distance': max_distance,
             'normalized': rf_distance / max_distance if max_distance > 0 else 0,
-            'common_clades': len(common_clades),
-            'unique_clades_tree1': len(unique_clades1),
-            'unique_clades_tree2': len(unique_clades2)
+            'common_clades': common_clades,
+            'unique_clades_tree1': unique_clades1,
+            'unique_clades_tree2': unique_clades2
         }
         
     except Exception:
         return {'distance': 0, 'normalized': 0, 'error': 'No se pudo calcular RF distance'}
 
+def rf_matrix(trees):
+    """
+    Matrices N x N de distancia Robinson-Foulds y RF normalizada entre
+    varios árboles, restringidos a los taxones comunes a todos.
+
+    Como en HashRF, las biparticiones de todos los árboles van a una sola
+    tabla hash (bitset -> fila) y se arma una matriz de incidencia dispersa
+    biparticiones x árboles B; las biparticiones compartidas por cada par
+    salen de B^T B. El costo es casi lineal en el tamaño total de los
+    árboles, en lugar de N^2 comparaciones por pares.
+    Devuelve (rf, rf normalizada, número de taxones comunes).
+    """
+    trees = [_as_parsed(tree) for tree in trees]
+    if not trees:
+        raise ValueError("Se necesita al menos un árbol")
+    common = _leaf_names(trees[0])
+    for tree in trees[1:]:
+        common &= _leaf_names(tree)
+
+    table = {}
+    rows, cols = [], []
+    sizes = np.zeros(len(trees))
+    for k, tree in enumerate(trees):
+        masks = _splits(tree, common)
+        sizes[k] = len(masks)
+        for mask in masks:
+            rows.append(table.setdefault(mask, len(table)))
+            cols.append(k)
+
+    incidence = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)),
+                                  shape=(len(table), len(trees)))
+    shared = (incidence.T @ incidence).toarray()
+    total = sizes[:, None] + sizes[None, :]
+    rf = total - 2 * shared
+    normalized = np.divide(rf, total, out=np.zeros_like(rf), where=total > 0)
+    return rf.astype(np.int64), normalized, len(common)
+
 def analyze_topology(tree1, tree2):
     """
     Analizar diferencias topológicas entre árboles
     """
     try:
-        # Contar nodos internos
-        internal_nodes1 = len([c for c in tree1.find_clades() if not c.is_terminal()])
-        internal_nodes2 = len([c for c in tree2.find_clades() if not c.is_terminal()])
+        tree1, tree2 = _as_parsed(tree1), _as_parsed(tree2)
         
-        # Calcular profundidad máxima
-        max_depth1 = tree1.depths().get(max(tree1.depths().keys()), 0)
-        max_depth2 = tree2.depths().get(max(tree2.depths().keys()), 0)
+        # Nodos internos y profundidad máxima (distancia de la raíz a la hoja más lejana)
+        internal_nodes1, max_depth1 = tree1.memo('topology', _topology)
+        internal_nodes2, max_depth2 = tree2.memo('topology', _topology)
         
         return {
             'internal_nodes_tree1': internal_nodes1,
@@ -120,40 +173,48 @@ def analyze_topology(tree1, tree2):
     except Exception:
         return {'error': 'No se pudo analizar topología'}
 
+def _topology(tree):
+    """Número de nodos internos y profundidad máxima"""
+    return int((tree.left_child >= 0).sum()), float(tree.depths().max())
+
+def _summary(values):
+    """Estadísticas básicas de los valores definidos (no NaN) de un arreglo; None si no hay"""
+    values = values[~np.isnan(values)]
+    if not len(values):
+        return None
+    return {
+        'count': len(values),
+        'mean': float(values.mean()),
+        'median': float(np.median(values)),
+        'min': float(values.min()),
+        'max': float(values.max())
+    }
+
+def _compare_values(summary1, summary2):
+    return {
+        'tree1': dict(summary1),
+        'tree2': dict(summary2),
+        'difference': {
+            'mean_diff': abs(summary1['mean'] - summary2['mean']),
+            'median_diff': abs(summary1['median'] - summary2['median'])
+        }
+    }
+
 def compare_branch_lengths(tree1, tree2):
     """
     Comparar longitudes de ramas entre árboles
     """
     try:
-        # Obtener longitudes de ramas
-        branches1 = [c.branch_length for c in tree1.find_clades() if c.branch_length is not None]
-        branches2 = [c.branch_length for c in tree2.find_clades() if c.branch_length is not None]
+        tree1, tree2 = _as_parsed(tree1), _as_parsed(tree2)
         
-        if not branches1 or not branches2:
-            return {'error': 'No hay longitudes de ramas disponibles'}
+        # Resumen de longitudes de ramas
+        branches1 = tree1.memo('branch_lengths', lambda t: _summary(t.branch_length))
+        branches2 = tree2.memo('branch_lengths', lambda t: _summary(t.branch_length))
         
-        import statistics
+        if branches1 is None or branches2 is None:
+            return {'error': 'No hay longitudes de ramas disponibles'}
         
-        return {
-            'tree1': {
-                'count': len(branches1),
-                'mean': statistics.mean(branches1),
-                'median': statistics.median(branches1),
-                'min': min(branches1),
-                'max': max(branches1)
-            },
-            'tree2': {
-                'count': len(branches2),
-                'mean': statistics.mean(branches2),
-                'median': statistics.median(branches2),
-                'min': min(branches2),
-                'max': max(branches2)
-            },
-            'difference': {
-                'mean_diff': abs(statistics.mean(branches1) - statistics.mean(branches2)),
-                'median_diff': abs(statistics.median(branches1) - statistics.median(branches2))
-            }
-        }
+        return _compare_values(branches1, branches2)
         
     except Exception:
         return {'error': 'No se pudo comparar longitudes de ramas'}
@@ -163,52 +224,37 @@ def compare_support_values(tree1, tree2):
     Comparar valores de soporte (bootstrap) entre árboles
     """
     try:
-        # Obtener valores de confianza
-        support1 = [c.confidence for c in tree1.find_clades() if c.confidence is not None]
-        support2 = [c.confidence for c in tree2.find_clades() if c.confidence is not None]
+        tree1, tree2 = _as_parsed(tree1), _as_parsed(tree2)
         
-        if not support1 or not support2:
-            return {'info': 'No hay valores de soporte disponibles'}
+        # Resumen de valores de confianza
+        support1 = tree1.memo('support', lambda t: _summary(t.support))
+        support2 = tree2.memo('support', lambda t: _summary(t.support))
         
-        import statistics
+        if support1 is None or support2 is None:
+            return {'info': 'No hay valores de soporte disponibles'}
         
-        return {
-            'tree1': {
-                'count': len(support1),
-                'mean': statistics.mean(support1),
-                'median': statistics.median(support1),
-                'min': min(support1),
-                'max': max(support1)
-            },
-            'tree2': {
-                'count': len(support2),
-                'mean': statistics.mean(support2),
-                'median': statistics.median(support2),
-                'min': min(support2),
-                'max': max(support2)
-            },
-            'difference': {
-                'mean_diff': abs(statistics.mean(support1) - statistics.mean(support2)),
-                'median_diff': abs(statistics.median(support1) - statistics.median(support2))
-            }
-        }
+        return _compare_values(support1, support2)
         
     except Exception:
         return {'info': 'No se pudo comparar valores de soporte'}
 
-def calculate_similarity_score(tree1, tree2, common_terminals):
+def calculate_similarity_score(tree1, tree2, common_terminals, rf_info=None):
     """
     Calcular un puntaje de similitud general entre árboles
+    (`rf_info`: resultado ya calculado de calculate_rf_distance)
     """
     try:
+        tree1, tree2 = _as_parsed(tree1), _as_parsed(tree2)
+        
         # Factores para el cálculo de similitud
         terminal_similarity = len(common_terminals) / max(
-            len([t for t in tree1.get_terminals()]),
-            len([t for t in tree2.get_terminals()])
+            tree1.memo('leaf_count', lambda t: len(t.leaves())),
+            tree2.memo('leaf_count', lambda t: len(t.leaves()))
         ) if common_terminals else 0
         
         # Considerar RF distance normalizada
-        rf_info = calculate_rf_distance(tree1, tree2)
+        if rf_info is None:
+            rf_info = calculate_rf_distance(tree1, tree2, common_terminals)
         rf_similarity = 1 - rf_info.get('normalized', 1)
         
         # Puntaje combinado (ponderado)
@@ -227,39 +273,148 @@ def calculate_similarity_score(tree1, tree2, common_terminals):
 def convert_newick_to_json(newick_string):
     """
     Convertir formato Newick a JSON para visualización con D3.js
+    (el árbol leído y su JSON quedan en la caché por contenido)
     """
     try:
-        tree = Phylo.read(StringIO(newick_string), "newick")
-        
-        def clade_to_dict(clade):
-            """Convertir recursivamente un clado a diccionario"""
-            result = {
-                'name': clade.name if clade.name else f"Node_{id(clade)}",
-                'branch_length': float(clade.branch_length) if clade.branch_length else 0.0,
-                'confidence': float(clade.confidence) if clade.confidence else None,
-                'is_terminal': clade.is_terminal()
-            }
-            
-            if not clade.is_terminal():
-                result['children'] = [clade_to_dict(child) for child in clade.clades]
-            
-            return result
-        
-        # Convertir árbol completo
-        tree_json = clade_to_dict(tree.root)
-        
-        # Agregar metadatos del árbol
-        tree_json['metadata'] = {
-            'total_terminals': len(tree.get_terminals()),
-            'total_nodes': len(list(tree.find_clades())),
-            'max_depth': len(tree.get_path(tree.get_terminals()[0])) if tree.get_terminals() else 0
-        }
+        return tree_cache.get(newick_string).memo('json', _tree_to_json)
         
-        return tree_json
+    except Exception as e:
+        raise Exception(f"Error convirtiendo Newick a JSON: {str(e)}")
+
+def _tree_to_json(tree):
+    """Diccionarios anidados de D3.js armados en pre-orden, sin recursión"""
+    nodes = {}
+    order = tree.preorder().tolist()
+    for node in order:
+        length = tree.branch_length[node]
+        confidence = tree.support[node]
+        is_terminal = bool(tree.is_leaf(node))
+        result = {
+            'name': tree.name(node) or f"Node_{node}",
+            'branch_length': float(length) if length and not np.isnan(length) else 0.0,
+            'confidence': float(confidence) if confidence and not np.isnan(confidence) else None,
+            'is_terminal': is_terminal
+        }
+        if not is_terminal:
+            result['children'] = []
+        if node != tree.root:
+            nodes[tree.parent[node]]['children'].append(result)
+        nodes[node] = result
+    
+    # Agregar metadatos del árbol (profundidad: ramas hasta la primera hoja)
+    tree_json = nodes[tree.root]
+    leaves = tree.leaves()
+    node = next(node for node in order if tree.is_leaf(node))
+    depth = 0
+    while node != tree.root:
+        node = tree.parent[node]
+        depth += 1
+    tree_json['metadata'] = {
+        'total_terminals': len(leaves),
+        'total_nodes': len(tree),
+        'max_depth': depth
+    }
+    return tree_json
+
+def convert_newick_to_flat_json(newick_string, node=None, depth=None):
+    """
+    Árbol en formato plano para D3.js: arreglos paralelos indexados por
+    nodo en pre-orden (cada padre antes que sus hijos y cada subárbol en un
+    rango contiguo de índices), ver _tree_to_flat.
+    Con `node` y/o `depth` devuelve solo el subárbol de `node` hasta
+    `depth` niveles por debajo, para cargar el árbol por partes.
+    """
+    try:
+        flat = tree_cache.get(newick_string).memo('flat', _tree_to_flat)
+        if node is None and depth is None:
+            return flat
+        return _flat_subtree(flat, 0 if node is None else node, depth)
         
+    except IndexError:
+        raise ValueError(f"Nodo fuera de rango: {node}")
     except Exception as e:
         raise Exception(f"Error convirtiendo Newick a JSON: {str(e)}")
 
+def _tree_to_flat(tree):
+    """
+    Arreglos por nodo, en pre-orden y sin recursión:
+    parent (-1 en la raíz), branch_length y support (NaN si no tienen),
+    name (None en nodos sin nombre), size (nodos del subárbol, así que el
+    subárbol de i son los índices i .. i + size[i] - 1), leaves (hojas del
+    subárbol) y level (ramas desde la raíz).
+    """
+    order = tree.preorder()
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    parent = np.where(tree.parent[order] >= 0, rank[tree.parent[order]], -1)
+    is_leaf = tree.left_child[order] < 0
+
+    parents = parent.tolist()
+    size = [1] * len(order)
+    leaves = is_leaf.astype(np.int64).tolist()
+    for k in range(len(order) - 1, 0, -1):
+        size[parents[k]] += size[k]
+        leaves[parents[k]] += leaves[k]
+    level = [0] * len(order)
+    for k in range(1, len(order)):
+        level[k] = level[parents[k]] + 1
+
+    return {
+        'parent': parent,
+        'branch_length': tree.branch_length[order],
+        'support': np.where(is_leaf, np.nan, tree.support[order]),
+        'name': [tree.name(node) for node in order.tolist()],
+        'size': np.array(size, dtype=np.int64),
+        'leaves': np.array(leaves, dtype=np.int64),
+        'level': np.array(level, dtype=np.int64)
+    }
+
+def _flat_subtree(flat, node, depth=None):
+    """
+    Subárbol de `node` en formato plano, cortado `depth` niveles por debajo
+    de él. Los índices (`id`, `parent`) siguen siendo los del árbol
+    completo; `collapsed` lista los nodos internos cuyos hijos quedaron
+    fuera, que se pueden pedir después con node = ese índice.
+    """
+    if node < 0:
+        raise IndexError(node)
+    end = node + int(flat['size'][node])
+    ids = np.arange(node, end)
+    level = flat['level'][node:end] - flat['level'][node]
+    if depth is not None:
+        ids = ids[level <= depth]
+        cut = ids[(level[ids - node] == depth) & (flat['size'][ids] > 1)]
+    else:
+        cut = ids[:0]
+    subtree = {key: value[ids] for key, value in flat.items() if key not in ('name', 'level')}
+    subtree['name'] = [flat['name'][k] for k in ids.tolist()]
+    subtree['id'] = ids
+    subtree['collapsed'] = cut
+    return subtree
+
+def iter_flat_json(flat, chunk_size=4096):
+    """
+    Texto JSON de un árbol plano por partes (sin armar el documento
+    completo en memoria); los NaN e infinitos se escriben como null
+    """
+    yield '{"format": "flat", "nodes": %d' % len(flat['parent'])
+    for key in ('id', 'parent', 'branch_length', 'support', 'name', 'size', 'leaves', 'collapsed'):
+        if key not in flat:
+            continue
+        values = flat[key]
+        yield ', "%s": [' % key
+        for start in range(0, len(values), chunk_size):
+            part = values[start:start + chunk_size]
+            if isinstance(part, np.ndarray) and part.dtype.kind == 'f':
+                text = ', '.join(repr(x) if math.isfinite(x) else 'null' for x in part.tolist())
+            elif isinstance(part, np.ndarray):
+                text = ', '.join(map(str, part.tolist()))
+            else:
+                text = ', '.join(json.dumps(x, ensure_ascii=False) for x in part)
+            yield (', ' if start else '') + text
+        yield ']'
+    yield '}'
+
 def save_comparison_result(comparison_result, output_path):
     """
     Guardar resultado de comparación en archivo JSON
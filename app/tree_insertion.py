@@ -0,0 +1,108 @@
+import numpy as np
+from app.compact_tree import CompactTree
+
+# Distancia mínima al calcular los pesos 1/d^2 (taxones idénticos)
+MIN_DISTANCE = 1e-6
+
+
+def place_taxon(tree, distances):
+    """
+    Mejor posición de un taxón nuevo en un árbol existente, dadas sus
+    distancias a las hojas (`distances`: dict nombre de hoja -> distancia).
+
+    Para cada arista (v, padre de v) se busca el punto de unión a distancia
+    `a` de v y la rama colgante `b` que minimizan el error de mínimos
+    cuadrados ponderado (Fitch-Margoliash, pesos 1/d^2, como APPLES) entre
+    las distancias dadas y las del árbol. Las sumas de cada lado de la
+    arista se obtienen con una pasada en post-orden y otra en pre-orden,
+    así que la búsqueda es O(n).
+    Devuelve (v, a, b, error).
+    """
+    size = len(tree)
+    parent = tree.parent.tolist()
+    lengths = np.nan_to_num(tree.branch_length).tolist()
+    order = tree.preorder().tolist()
+
+    # Sumas del subárbol de cada nodo, medidas desde el nodo:
+    # w0 = sum(w), w1 = sum(w y), w2 = sum(w y^2), con y = d - distancia en el árbol
+    w0, w1, w2 = [0.0] * size, [0.0] * size, [0.0] * size
+    for node in reversed(order):
+        if tree.is_leaf(node):
+            name = tree.name(node)
+            if name not in distances:
+                raise ValueError(f"Falta la distancia a la hoja '{name}'")
+            d = float(distances[name])
+            w = 1.0 / max(d, MIN_DISTANCE) ** 2
+            w0[node], w1[node], w2[node] = w, w * d, w * d * d
+        up = parent[node]
+        if up >= 0:
+            s0, s1, s2 = _shift(w0[node], w1[node], w2[node], -lengths[node])
+            w0[up] += s0
+            w1[up] += s1
+            w2[up] += s2
+
+    # Sumas de todas las hojas medidas desde cada nodo, de la raíz hacia abajo
+    full = [None] * size
+    full[tree.root] = (w0[tree.root], w1[tree.root], w2[tree.root])
+    total = w0[tree.root]
+    best = None
+    for node in order[1:]:
+        up = parent[node]
+        length = lengths[node]
+        below = (w0[node], w1[node], w2[node])
+        # Hojas fuera del subárbol: desde el padre, luego corridas hasta el nodo
+        inner = _shift(*below, -length)
+        above = _shift(*(f - i for f, i in zip(full[up], inner)), -length)
+        full[node] = tuple(b + a for b, a in zip(below, above))
+
+        # y = b + a bajo el nodo, z = b - a fuera (ver docstring)
+        s = below[1] / below[0]
+        t = above[1] / above[0] if above[0] > 0 else s
+        a = min(max((s - t) / 2.0, 0.0), max(length, 0.0))
+        b = max((below[1] - a * below[0] + above[1] + a * above[0]) / total, 0.0)
+        error = (below[2] - 2 * (b + a) * below[1] + (b + a) ** 2 * below[0]
+                 + above[2] - 2 * (b - a) * above[1] + (b - a) ** 2 * above[0])
+        if best is None or error < best[3]:
+            best = (node, a, b, error)
+    if best is None:
+        raise ValueError("El árbol necesita al menos una arista")
+    return best
+
+
+def insert_taxon(tree, name, node, a, b):
+    """
+    Árbol nuevo con la hoja `name` colgando (rama `b`) de un nodo nuevo
+    sobre la arista de `node`, a distancia `a` de él
+    """
+    size = len(tree)
+    junction = size
+    parent = np.append(tree.parent, [tree.parent[node], junction])
+    parent[node] = junction
+    branch_length = np.append(tree.branch_length, [np.nan, b])
+    length = tree.branch_length[node]
+    if not np.isnan(length):
+        branch_length[junction] = length - a
+        branch_length[node] = a
+    label = np.append(tree.label, [-1, len(tree.labels)])
+    support = np.append(tree.support, [np.nan, np.nan])
+    return CompactTree(parent, branch_length, label, tree.labels + [name], support, tree.rooted)
+
+
+def insert_taxa(tree, names, distances, labels):
+    """
+    Insertar varios taxones uno a uno. `distances`: matriz len(names) x
+    len(labels) con la distancia de cada taxón nuevo a cada taxón de
+    `labels` (que incluye a los nuevos, así los siguientes se pueden ubicar
+    junto a los ya insertados). Devuelve (árbol, hojas nuevas).
+    """
+    leaves = []
+    for name, row in zip(names, distances):
+        node, a, b, _ = place_taxon(tree, dict(zip(labels, row.tolist())))
+        tree = insert_taxon(tree, name, node, a, b)
+        leaves.append(len(tree) - 1)
+    return tree, leaves
+
+
+def _shift(s0, s1, s2, delta):
+    """Sumas ponderadas de y + delta a partir de las de y"""
+    return s0, s1 + delta * s0, s2 + 2 * delta * s1 + delta * delta * s0
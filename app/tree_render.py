@@ -0,0 +1,97 @@
+import io
+import numpy as np
+
+# Formatos de imagen disponibles y su tipo MIME
+FORMATS = {'png': 'image/png', 'svg': 'image/svg+xml'}
+
+# Por encima de este número de hojas no se escriben nombres ni soportes
+MAX_LABELED_LEAVES = 2000
+
+# Tamaño de la figura (pulgadas): ancho fijo, alto según las hojas, acotado
+FIGURE_WIDTH = 10.0
+LEAF_HEIGHT = 0.2
+MIN_HEIGHT = 4.0
+MAX_HEIGHT = 120.0
+DPI = 100
+
+
+def tree_layout(tree):
+    """
+    Coordenadas de un filograma rectangular, sin recursión: x es la
+    distancia a la raíz (si ninguna rama tiene longitud, cada rama mide 1)
+    e y el orden de la hoja en pre-orden; un nodo interno queda a media
+    altura entre su primer y su último hijo.
+    Devuelve (x, y), arreglos con un valor por nodo.
+    """
+    if np.all(np.isnan(tree.branch_length[tree.parent >= 0])):
+        x = np.zeros(len(tree))
+        for node in tree.preorder()[1:]:
+            x[node] = x[tree.parent[node]] + 1.0
+    else:
+        x = tree.depths()
+
+    y = np.zeros(len(tree))
+    leaf_order = [node for node in tree.preorder().tolist() if tree.is_leaf(node)]
+    y[leaf_order] = np.arange(len(leaf_order))
+    for node in tree.postorder().tolist():
+        children = tree.children(node)
+        if children:
+            y[node] = (y[children[0]] + y[children[-1]]) / 2.0
+    return x, y
+
+
+def render_tree(tree, fmt='png'):
+    """
+    Dibujar un árbol (CompactTree) como PNG o SVG y devolver los bytes.
+    Usa una Figure propia con el lienzo Agg, sin el estado global de
+    pyplot, así que se puede llamar desde varios hilos a la vez. Las ramas
+    se dibujan como un solo LineCollection.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Formato debe ser uno de: {', '.join(FORMATS)}")
+    try:
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.collections import LineCollection
+        from matplotlib.figure import Figure
+    except ImportError:
+        raise RuntimeError("Se requiere matplotlib para dibujar árboles")
+
+    x, y = tree_layout(tree)
+    leaves = tree.leaves()
+    height = min(max(MIN_HEIGHT, LEAF_HEIGHT * len(leaves)), MAX_HEIGHT)
+    fig = Figure(figsize=(FIGURE_WIDTH, height), dpi=DPI)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(1, 1, 1)
+
+    # Tramos horizontales (nodo -> padre) y verticales (entre hijos extremos)
+    nodes = np.flatnonzero(tree.parent >= 0)
+    parents = tree.parent[nodes]
+    horizontal = np.stack([np.column_stack([x[parents], y[nodes]]),
+                           np.column_stack([x[nodes], y[nodes]])], axis=1)
+    internal = np.flatnonzero(tree.left_child >= 0)
+    last = [tree.children(node)[-1] for node in internal.tolist()]
+    vertical = np.stack([np.column_stack([x[internal], y[tree.left_child[internal]]]),
+                         np.column_stack([x[internal], y[last]])], axis=1)
+    ax.add_collection(LineCollection(np.concatenate([horizontal, vertical]),
+                                     colors='black', linewidths=0.8))
+
+    if len(leaves) <= MAX_LABELED_LEAVES:
+        offset = 0.01 * max(float(np.max(x)), 1e-9)
+        for node in leaves.tolist():
+            ax.text(x[node] + offset, y[node], tree.name(node) or '', va='center', fontsize=8)
+        for node in internal.tolist():
+            if not np.isnan(tree.support[node]):
+                ax.text(x[node], y[node], f"{tree.support[node]:g}", ha='right', va='bottom',
+                        fontsize=6, color='dimgray')
+
+    ax.set_xlim(min(float(np.min(x)), 0.0), float(np.max(x)) * 1.25 or 1.0)
+    ax.set_ylim(len(leaves) - 0.5, -0.5)
+    ax.set_yticks([])
+    for side in ('left', 'right', 'top'):
+        ax.spines[side].set_visible(False)
+    ax.set_xlabel('Longitud de rama')
+    fig.tight_layout()
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format=fmt)
+    return buffer.getvalue()
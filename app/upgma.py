@@ -1,60 +1,72 @@
 import numpy as np
+from app.compact_tree import CompactTree
 
-class Node:
-    def __init__(self, name, left=None, right=None, distance=0.0, count=1):
-        self.name = name
-        self.left = left
-        self.right = right
-        self.distance = distance
-        self.count = count
+def upgma(distance_matrix, labels):
+    """
+    UPGMA en O(n^2): la matriz se reserva una sola vez y cada unión
+    sobrescribe la fila/columna de uno de los clusters y desactiva la del
+    otro (distancia infinita). Cada fila guarda en caché su vecino más
+    cercano, de modo que encontrar el par mínimo cuesta O(n) y solo se
+    recalculan las filas cuyo vecino desapareció.
 
-    def __repr__(self):
-        if self.left and self.right:
-            return f"({self.left}:{self.distance:.2f},{self.right}:{self.distance:.2f})"
-        return self.name
+    Devuelve un CompactTree enraizado: las hojas son los nodos 0..n-1 (en el
+    orden de `labels`) y los nodos internos n..2n-2, con la raíz al final.
+    Las ramas miden la diferencia de alturas (distancia / 2) entre nodos.
+    """
+    n = len(labels)
+    if n == 0:
+        raise ValueError("Se necesita al menos un taxón")
+    parent = np.full(2 * n - 1, -1, dtype=np.int32)
+    height = np.zeros(2 * n - 1)
+    label = np.full(2 * n - 1, -1, dtype=np.int32)
+    label[:n] = np.arange(n)
+    # Nodo del árbol que ocupa cada fila de la matriz
+    slot = np.arange(n)
 
-def upgma(distance_matrix, labels):
-    clusters = [Node(name=label) for label in labels]
-    n = len(clusters)
-    matrix = np.array(distance_matrix)
-
-    while len(clusters) > 1:
-        # Buscar el par más cercano
-        min_val = float('inf')
-        x, y = 0, 1
-        for i in range(len(matrix)):
-            for j in range(i):
-                if matrix[i][j] < min_val:
-                    min_val = matrix[i][j]
-                    x, y = i, j
-
-        # Combinar clusters
-        new_name = f"{clusters[x].name}+{clusters[y].name}"
-        new_node = Node(new_name, left=clusters[x], right=clusters[y],
-                        distance=min_val / 2,
-                        count=clusters[x].count + clusters[y].count)
-
-        # Nueva fila/columna de distancias
-        new_row = []
-        for k in range(len(matrix)):
-            if k != x and k != y:
-                d = (matrix[x][k] * clusters[x].count + matrix[y][k] * clusters[y].count) / \
-                    (clusters[x].count + clusters[y].count)
-                new_row.append(d)
-
-        # Eliminar y reemplazar en matriz y clusters
-        indices = sorted([x, y], reverse=True)
-        for idx in indices:
-            del clusters[idx]
-            matrix = np.delete(matrix, idx, axis=0)
-            matrix = np.delete(matrix, idx, axis=1)
-
-        clusters.append(new_node)
-
-        # Agregar nueva fila y columna
-        new_row = np.array(new_row)
-        matrix = np.vstack([matrix, new_row])
-        new_col = np.append(new_row, 0.0).reshape(-1, 1)
-        matrix = np.hstack([matrix, new_col])
-
-    return clusters[0]  # el nodo raíz del árbol
+    matrix = np.array(distance_matrix, dtype=np.float64)
+    np.fill_diagonal(matrix, np.inf)
+    counts = np.ones(n)
+
+    # Caché de vecino más cercano por fila
+    nearest = matrix.argmin(axis=1)
+    nearest_dist = matrix[np.arange(n), nearest]
+
+    for step in range(n - 1):
+        # Par más cercano: mínimo de la caché
+        x = int(nearest_dist.argmin())
+        y = int(nearest[x])
+        min_val = nearest_dist[x]
+
+        # Combinar clusters (el nuevo ocupa la posición x)
+        node = n + step
+        parent[slot[x]] = node
+        parent[slot[y]] = node
+        height[node] = min_val / 2
+        slot[x] = node
+
+        # Nueva fila/columna de distancias, actualizada en el lugar
+        row = (matrix[x] * counts[x] + matrix[y] * counts[y]) / (counts[x] + counts[y])
+        row[x] = np.inf
+        row[y] = np.inf
+        matrix[x, :] = row
+        matrix[:, x] = row
+        matrix[y, :] = np.inf
+        matrix[:, y] = np.inf
+        counts[x] += counts[y]
+        nearest_dist[y] = np.inf
+
+        # Filas que apuntaban a x o y: recalcular su vecino
+        stale = np.flatnonzero((nearest == x) | (nearest == y))
+        stale = stale[np.isfinite(nearest_dist[stale])]
+        stale = np.union1d(stale, [x])
+        nearest[stale] = matrix[stale].argmin(axis=1)
+        nearest_dist[stale] = matrix[stale, nearest[stale]]
+
+        # El resto solo puede acercarse al nuevo cluster
+        closer = row < nearest_dist
+        nearest[closer] = x
+        nearest_dist[closer] = row[closer]
+
+    branch_length = np.full(2 * n - 1, np.nan)
+    branch_length[:-1] = height[parent[:-1]] - height[:-1]
+    return CompactTree(parent, branch_length, label, labels, rooted=True)
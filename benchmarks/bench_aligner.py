@@ -0,0 +1,112 @@
+"""
+Benchmark del motor Needleman-Wunsch: celdas por segundo de la
+implementación vectorizada, los modos con banda y solo-puntaje, frente a
+la versión original en Python puro.
+
+Uso (desde la raíz del repositorio):
+    python -m benchmarks.bench_aligner
+"""
+import random
+import time
+
+from app.aligner import (needleman_wunsch, needleman_wunsch_banded,
+                         needleman_wunsch_score)
+
+
+def needleman_wunsch_original(seq1, seq2, match=1, mismatch=-1, gap=-2):
+    """Implementación original (listas de listas), usada como referencia"""
+    n, m = len(seq1), len(seq2)
+    score = [[0]*(m+1) for _ in range(n+1)]
+    trace = [['']*(m+1) for _ in range(n+1)]
+
+    for i in range(n+1):
+        score[i][0] = i * gap
+        trace[i][0] = 'U'
+    for j in range(m+1):
+        score[0][j] = j * gap
+        trace[0][j] = 'L'
+    trace[0][0] = '0'
+
+    for i in range(1, n+1):
+        for j in range(1, m+1):
+            diag = score[i-1][j-1] + (match if seq1[i-1]==seq2[j-1] else mismatch)
+            up = score[i-1][j] + gap
+            left = score[i][j-1] + gap
+            best = max(diag, up, left)
+            score[i][j] = best
+            trace[i][j] = 'D' if best==diag else 'U' if best==up else 'L'
+
+    aln1, aln2 = "", ""
+    i, j = n, m
+    while i > 0 or j > 0:
+        if trace[i][j] == 'D':
+            aln1 = seq1[i-1] + aln1
+            aln2 = seq2[j-1] + aln2
+            i -= 1
+            j -= 1
+        elif trace[i][j] == 'U':
+            aln1 = seq1[i-1] + aln1
+            aln2 = '-' + aln2
+            i -= 1
+        elif trace[i][j] == 'L':
+            aln1 = '-' + aln1
+            aln2 = seq2[j-1] + aln2
+            j -= 1
+
+    return aln1, aln2, score[n][m]
+
+
+def mutate(seq, rate, rng):
+    """Introducir sustituciones e indels con la tasa indicada"""
+    out = []
+    for c in seq:
+        r = rng.random()
+        if r < rate / 3:
+            continue
+        if r < 2 * rate / 3:
+            out.append(rng.choice('ACGT'))
+        out.append(c if r >= rate else rng.choice('ACGT'))
+    return ''.join(out)
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main():
+    rng = random.Random(42)
+
+    print(f"{'longitud':>9} {'motor':>12} {'segundos':>10} {'celdas/s':>12}")
+    for length in (300, 1000, 2000, 5000, 10000):
+        s1 = ''.join(rng.choice('ACGT') for _ in range(length))
+        s2 = mutate(s1, 0.1, rng)
+        cells = (len(s1) + 1) * (len(s2) + 1)
+
+        new, t_new = timed(needleman_wunsch, s1, s2)
+        print(f"{length:>9} {'numpy':>12} {t_new:>10.3f} {cells / t_new:>12.3g}")
+
+        if length <= 2000:
+            old, t_old = timed(needleman_wunsch_original, s1, s2)
+            assert old[2] == new[2], "los puntajes no coinciden"
+            print(f"{length:>9} {'original':>12} {t_old:>10.3f} {cells / t_old:>12.3g}")
+
+        _, t_lin = timed(needleman_wunsch, s1, s2, max_cells=1 << 16)
+        print(f"{length:>9} {'hirschberg':>12} {t_lin:>10.3f} {cells / t_lin:>12.3g}")
+
+        score, t_score = timed(needleman_wunsch_score, s1, s2)
+        assert score == new[2], "el modo solo-puntaje no coincide"
+        print(f"{length:>9} {'solo-puntaje':>12} {t_score:>10.3f} {cells / t_score:>12.3g}")
+
+    # Aislados casi idénticos (1% de divergencia): caso típico de la banda
+    for length in (1000, 10000, 30000):
+        s1 = ''.join(rng.choice('ACGT') for _ in range(length))
+        s2 = mutate(s1, 0.01, rng)
+        cells = (len(s1) + 1) * (len(s2) + 1)
+        _, t_band = timed(needleman_wunsch_banded, s1, s2)
+        print(f"{length:>9} {'banda':>12} {t_band:>10.3f} {cells / t_band:>12.3g}")
+
+
+if __name__ == '__main__':
+    main()
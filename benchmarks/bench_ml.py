@@ -0,0 +1,92 @@
+"""
+Benchmark del motor de máxima verosimilitud: alineamientos simulados con
+JC69 sobre un árbol aleatorio, evaluados sobre el árbol NJ. Se mide el
+rendimiento de una evaluación completa de la log-verosimilitud en
+patrones x taxones por segundo, el tiempo de reevaluarla tras cambiar una
+rama (con la caché de mensajes) y el de la búsqueda NNI completa.
+
+Uso (desde la raíz del repositorio):
+    python -m benchmarks.bench_ml
+"""
+import time
+
+import numpy as np
+
+from app.compact_tree import CompactTree
+from app.distance_models import distance_matrix
+from app.likelihood import TreeLikelihood
+from app.neighbor_joining import neighbor_joining
+
+
+def random_tree(n, rng, scale=0.1):
+    """Árbol binario aleatorio (uniones al azar) con ramas exponenciales"""
+    parent = np.full(2 * n - 1, -1, dtype=np.int32)
+    active = list(range(n))
+    for node in range(n, 2 * n - 1):
+        a = int(rng.integers(len(active)))
+        b = int(rng.integers(len(active) - 1))
+        b += b >= a
+        parent[active[a]] = node
+        parent[active[b]] = node
+        # Quitar a y b moviendo el último activo a su lugar
+        for k in sorted((a, b), reverse=True):
+            active[k] = active[-1]
+            active.pop()
+        active.append(node)
+    lengths = rng.exponential(scale, size=2 * n - 1)
+    lengths[-1] = np.nan
+    label = np.full(2 * n - 1, -1, dtype=np.int32)
+    label[:n] = np.arange(n)
+    return CompactTree(parent, lengths, label, [f"t{i}" for i in range(n)])
+
+
+def simulate(tree, sites, rng):
+    """Secuencias JC69 a lo largo del árbol, como matriz uint8 de bytes ACGT"""
+    states = np.zeros((len(tree), sites), dtype=np.uint8)
+    states[tree.root] = rng.integers(0, 4, sites)
+    for node in tree.preorder()[1:]:
+        changed = rng.random(sites) < 1.0 - np.exp(-4.0 / 3.0 * tree.branch_length[node])
+        states[node] = np.where(changed, rng.integers(0, 4, sites), states[tree.parent[node]])
+    leaves = tree.leaves()
+    return np.frombuffer(b'ACGT', dtype=np.uint8)[states[leaves]], [tree.name(v) for v in leaves]
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main():
+    rng = np.random.default_rng(11)
+
+    print(f"{'taxones':>8} {'sitios':>7} {'patrones':>9} {'logL s':>8} {'patr*tax/s':>12} "
+          f"{'cambio s':>9} {'NNI s':>8} {'NNI':>5} {'logL NJ':>12} {'logL ML':>12}")
+    for n, sites in ((20, 1000), (100, 2000), (500, 2000), (1000, 5000)):
+        codes, labels = simulate(random_tree(n, rng, scale=5.0 / n), sites, rng)
+        start = neighbor_joining(distance_matrix(codes, 'jc69'), labels)
+        likelihood = TreeLikelihood(start, codes, labels)
+
+        initial, t_eval = timed(likelihood.log_likelihood)
+        rate = likelihood.n_patterns * n / t_eval
+
+        # Reevaluar tras cambiar la rama de una hoja: solo se recalcula el
+        # camino hasta la raíz
+        leaf, up = likelihood.edges()[-1]
+        length = likelihood.length[(min(leaf, up), max(leaf, up))]
+        likelihood.set_length(leaf, up, length * 2)
+        _, t_change = timed(likelihood.log_likelihood)
+        likelihood.set_length(leaf, up, length)
+
+        row = (f"{n:>8} {sites:>7} {likelihood.n_patterns:>9} {t_eval:>8.3f} {rate:>12.3g} "
+               f"{t_change:>9.4f}")
+        if n <= 500:
+            final, t_nni = timed(likelihood.nni_search)
+            assert final >= initial - 1e-6, "la búsqueda empeoró la verosimilitud"
+            print(f"{row} {t_nni:>8.2f} {likelihood.swaps:>5} {initial:>12.1f} {final:>12.1f}")
+        else:
+            print(f"{row} {'-':>8} {'-':>5} {initial:>12.1f} {'-':>12}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Benchmark de Neighbor-Joining: motor NumPy (vectorizado y con poda tipo
+RapidNJ) frente a DistanceTreeConstructor.nj de Biopython. En los tamaños
+pequeños se comprueba que las biparticiones coinciden con las de Biopython.
+
+Uso (desde la raíz del repositorio):
+    python -m benchmarks.bench_nj
+"""
+import time
+
+import numpy as np
+from Bio.Phylo.TreeConstruction import DistanceTreeConstructor
+
+from app.compact_tree import CompactTree
+from app.neighbor_joining import neighbor_joining
+from app.tree_builder import matriz_a_distance_matrix
+
+
+def tree_like_matrix(n, rng, noise=0.01):
+    """
+    Distancias casi aditivas: coalescente aleatorio (altura de la unión) más
+    ramas terminales de distinta longitud y un poco de ruido
+    """
+    D = np.zeros((n, n))
+    clusters = [[k] for k in range(n)]
+    height = 0.0
+    while len(clusters) > 1:
+        height += rng.exponential(1.0 / len(clusters))
+        a, b = rng.choice(len(clusters), size=2, replace=False)
+        A, B = clusters[a], clusters[b]
+        D[np.ix_(A, B)] = 2 * height
+        D[np.ix_(B, A)] = 2 * height
+        clusters[min(a, b)] = A + B
+        del clusters[max(a, b)]
+    tips = rng.random(n) * height
+    D += tips[:, None] + tips[None, :]
+    D += rng.random((n, n)) * noise * height
+    D = (D + D.T) / 2
+    np.fill_diagonal(D, 0.0)
+    return D
+
+
+def splits(tree):
+    """Biparticiones no triviales (como conjuntos de nombres)"""
+    names = frozenset(tree.leaf_names())
+    leaves = {}
+    out = set()
+    for node in tree.postorder().tolist():
+        if tree.is_leaf(node):
+            leaves[node] = frozenset([tree.name(node)])
+            continue
+        leaves[node] = frozenset().union(*(leaves[c] for c in tree.children(node)))
+        side = leaves[node]
+        if 1 < len(side) < len(names) - 1:
+            out.add(min(side, names - side, key=sorted))
+    return out
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main():
+    rng = np.random.default_rng(7)
+
+    print(f"{'taxones':>8} {'motor':>12} {'segundos':>10}")
+    for n in (100, 300, 1000, 3000, 10000):
+        matrix = tree_like_matrix(n, rng)
+        labels = [f"t{i}" for i in range(n)]
+
+        rapid, t_rapid = timed(neighbor_joining, matrix, labels, rapid=True)
+        print(f"{n:>8} {'rapidnj':>12} {t_rapid:>10.3f}")
+
+        if n <= 1000:
+            full, t_full = timed(neighbor_joining, matrix, labels, rapid=False)
+            assert splits(full) == splits(rapid), "los modos no coinciden"
+            print(f"{n:>8} {'vectorizado':>12} {t_full:>10.3f}")
+
+        if n <= 300:
+            dm = matriz_a_distance_matrix(matrix, labels)
+            bio, t_bio = timed(DistanceTreeConstructor().nj, dm)
+            assert splits(CompactTree.from_bio(bio)) == splits(rapid), \
+                "la topología no coincide con Biopython"
+            print(f"{n:>8} {'biopython':>12} {t_bio:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
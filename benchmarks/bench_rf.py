@@ -0,0 +1,105 @@
+"""
+Benchmark de la distancia Robinson-Foulds: biparticiones como bitsets en
+una pasada en post-orden frente a la versión original (nombres ordenados
+de cada clado sobre árboles de Bio.Phylo). Se mide el tiempo de leer los
+dos Newick y calcular RF, y el tiempo por taxón para comprobar que crece
+de forma lineal. Luego, la matriz RF de N árboles con una sola tabla de
+biparticiones (estilo HashRF) frente a N^2 / 2 comparaciones por pares.
+
+Uso (desde la raíz del repositorio):
+    python -m benchmarks.bench_rf
+"""
+import sys
+import time
+from io import StringIO
+
+import numpy as np
+from Bio import Phylo
+
+from app.compact_tree import CompactTree
+from app.tree_comparator import calculate_rf_distance, rf_matrix
+from benchmarks.bench_ml import random_tree
+from benchmarks.bench_nj import splits
+
+
+def rf_original(tree1, tree2):
+    """Versión original: tupla de nombres ordenados por cada clado interno"""
+    clades1 = set()
+    clades2 = set()
+    for clade in tree1.find_clades():
+        if not clade.is_terminal():
+            terminals = sorted([t.name for t in clade.get_terminals()])
+            if len(terminals) > 1:
+                clades1.add(tuple(terminals))
+    for clade in tree2.find_clades():
+        if not clade.is_terminal():
+            terminals = sorted([t.name for t in clade.get_terminals()])
+            if len(terminals) > 1:
+                clades2.add(tuple(terminals))
+    return len(clades1 ^ clades2)
+
+
+def perturbed(tree, rng, moves):
+    """Copia del árbol con `moves` intercambios de hojas al azar"""
+    label = tree.label.copy()
+    leaves = tree.leaves()
+    for _ in range(moves):
+        a, b = rng.choice(leaves, size=2, replace=False)
+        label[a], label[b] = label[b], label[a]
+    return CompactTree(tree.parent, tree.branch_length, label, tree.labels)
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def bitset_rf(newick1, newick2):
+    return calculate_rf_distance(CompactTree.from_newick(newick1),
+                                 CompactTree.from_newick(newick2))
+
+
+def bio_rf(newick1, newick2):
+    return rf_original(Phylo.read(StringIO(newick1), "newick"),
+                       Phylo.read(StringIO(newick2), "newick"))
+
+
+def main():
+    rng = np.random.default_rng(3)
+    sys.setrecursionlimit(100000)
+
+    print(f"{'taxones':>8} {'motor':>10} {'segundos':>10} {'us/taxón':>10} {'RF':>7}")
+    for n in (1000, 3000, 10000, 30000):
+        tree1 = random_tree(n, rng)
+        tree2 = perturbed(tree1, rng, n // 100)
+        newick1, newick2 = tree1.to_newick(), tree2.to_newick()
+
+        rf, t_bits = timed(bitset_rf, newick1, newick2)
+        print(f"{n:>8} {'bitsets':>10} {t_bits:>10.3f} {1e6 * t_bits / n:>10.1f} {rf['distance']:>7}")
+
+        if n <= 1000:
+            expected = len(splits(tree1) ^ splits(tree2))
+            assert rf['distance'] == expected, "RF no coincide con las biparticiones por nombres"
+        if n <= 3000:
+            _, t_bio = timed(bio_rf, newick1, newick2)
+            print(f"{n:>8} {'original':>10} {t_bio:>10.3f} {1e6 * t_bio / n:>10.1f} {'-':>7}")
+
+    print()
+    print(f"{'árboles':>8} {'taxones':>8} {'matriz s':>10} {'pares s':>10}")
+    for count, n in ((20, 1000), (100, 1000), (500, 200)):
+        base = random_tree(n, rng)
+        trees = [perturbed(base, rng, n // 50) for _ in range(count)]
+        (rf, _, _), t_matrix = timed(rf_matrix, trees)
+
+        # Por pares: se mide una muestra y se extrapola a los N^2 / 2 pares
+        sample = [(i, j) for i in range(min(count, 10)) for j in range(i)]
+        start = time.perf_counter()
+        for i, j in sample:
+            assert calculate_rf_distance(trees[i], trees[j])['distance'] == rf[i, j]
+        t_pairs = (time.perf_counter() - start) / len(sample) * count * (count - 1) / 2
+        print(f"{count:>8} {n:>8} {t_matrix:>10.3f} {t_pairs:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
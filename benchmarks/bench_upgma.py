@@ -0,0 +1,128 @@
+"""
+Benchmark de UPGMA: versión O(n^2) con caché de vecino más cercano frente
+a la implementación original O(n^3), comprobando que ambas producen los
+mismos clusters y alturas.
+
+Uso (desde la raíz del repositorio):
+    python -m benchmarks.bench_upgma
+"""
+import time
+
+import numpy as np
+
+from app.upgma import upgma
+
+
+class Node:
+    """Nodo recursivo de la implementación original"""
+    def __init__(self, name, left=None, right=None, distance=0.0, count=1):
+        self.name = name
+        self.left = left
+        self.right = right
+        self.distance = distance
+        self.count = count
+
+
+def upgma_original(distance_matrix, labels):
+    """Implementación original (recorrido doble y np.delete), como referencia"""
+    clusters = [Node(name=label) for label in labels]
+    matrix = np.array(distance_matrix)
+
+    while len(clusters) > 1:
+        min_val = float('inf')
+        x, y = 0, 1
+        for i in range(len(matrix)):
+            for j in range(i):
+                if matrix[i][j] < min_val:
+                    min_val = matrix[i][j]
+                    x, y = i, j
+
+        new_name = f"{clusters[x].name}+{clusters[y].name}"
+        new_node = Node(new_name, left=clusters[x], right=clusters[y],
+                        distance=min_val / 2,
+                        count=clusters[x].count + clusters[y].count)
+
+        new_row = []
+        for k in range(len(matrix)):
+            if k != x and k != y:
+                d = (matrix[x][k] * clusters[x].count + matrix[y][k] * clusters[y].count) / \
+                    (clusters[x].count + clusters[y].count)
+                new_row.append(d)
+
+        for idx in sorted([x, y], reverse=True):
+            del clusters[idx]
+            matrix = np.delete(matrix, idx, axis=0)
+            matrix = np.delete(matrix, idx, axis=1)
+
+        clusters.append(new_node)
+        new_row = np.array(new_row)
+        matrix = np.vstack([matrix, new_row])
+        new_col = np.append(new_row, 0.0).reshape(-1, 1)
+        matrix = np.hstack([matrix, new_col])
+
+    return clusters[0]
+
+
+def random_matrix(n, rng):
+    """Distancias euclidianas entre puntos aleatorios (sin empates)"""
+    points = rng.random((n, 8))
+    diff = points[:, None, :] - points[None, :, :]
+    return np.sqrt((diff ** 2).sum(axis=2))
+
+
+def clusters_with_height(root):
+    """Conjunto de (hojas del cluster, altura) de cada nodo interno (árbol original)"""
+    out = set()
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if node.left is not None:
+            leaves = frozenset(node.name.split('+'))
+            out.add((leaves, round(node.distance, 9)))
+            stack.extend((node.left, node.right))
+    return out
+
+
+def compact_clusters_with_height(tree):
+    """Lo mismo para un CompactTree (alturas desde las hojas)"""
+    out = set()
+    leaves = {}
+    height = {}
+    for node in tree.postorder().tolist():
+        if tree.is_leaf(node):
+            leaves[node] = frozenset([tree.name(node)])
+            height[node] = 0.0
+            continue
+        children = tree.children(node)
+        leaves[node] = frozenset().union(*(leaves[c] for c in children))
+        height[node] = height[children[0]] + tree.branch_length[children[0]]
+        out.add((leaves[node], round(height[node], 9)))
+    return out
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    rng = np.random.default_rng(42)
+
+    print(f"{'taxones':>8} {'motor':>10} {'segundos':>10}")
+    for n in (100, 1000, 5000):
+        matrix = random_matrix(n, rng)
+        labels = [f"t{i}" for i in range(n)]
+
+        tree, t_new = timed(upgma, matrix, labels)
+        print(f"{n:>8} {'cache':>10} {t_new:>10.3f}")
+
+        if n <= 100:
+            ref, t_old = timed(upgma_original, matrix, labels)
+            assert compact_clusters_with_height(tree) == clusters_with_height(ref), \
+                "los árboles no coinciden"
+            print(f"{n:>8} {'original':>10} {t_old:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
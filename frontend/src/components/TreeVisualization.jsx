@@ -1,19 +1,86 @@
-import React, { useEffect, useRef } from 'react';
+import React, { useEffect, useRef, useState } from 'react';
 import * as d3 from 'd3';
+import { AlertCircle } from 'lucide-react';
+import { phylogenyAPI } from '../services/api';
+
+// Profundidad que se pide de un árbol grande; los subárboles más abajo
+// quedan colapsados
+const FLAT_TREE_DEPTH = 8;
+
+// Convertir el JSON plano del backend (arreglos paralelos por nodo) en
+// los diccionarios anidados que espera d3.hierarchy
+const flatToNested = (flat) => {
+  const ids = flat.id || flat.parent.map((_, k) => k);
+  const collapsed = new Set(flat.collapsed || []);
+  const nodes = new Map();
+  let root = null;
+  ids.forEach((id, k) => {
+    const node = {
+      name: flat.name[k] || `Node_${id}`,
+      branch_length: flat.branch_length[k] || 0,
+      confidence: flat.support[k],
+      is_terminal: flat.size[k] === 1,
+      leaves: flat.leaves[k]
+    };
+    if (collapsed.has(id)) {
+      node.name = `${flat.leaves[k]} hojas`;
+    }
+    nodes.set(id, node);
+    const parent = nodes.get(flat.parent[k]);
+    if (parent) {
+      (parent.children = parent.children || []).push(node);
+    } else {
+      root = node;
+    }
+  });
+  return root;
+};
 
 const TreeVisualization = ({ trees }) => {
   const njTreeRef = useRef(null);
   const mlTreeRef = useRef(null);
+  const [errors, setErrors] = useState({});
+
+  // Árboles chicos traen tree_json; los grandes se piden en formato plano
+  const loadTree = async (tree) => {
+    if (tree.tree_json || !tree.tree_json_url) {
+      return tree.tree_json;
+    }
+    const flat = await phylogenyAPI.getTreeJson(tree.tree_json_url, { depth: FLAT_TREE_DEPTH });
+    return flatToNested(flat);
+  };
+
+  // Cargar y dibujar un árbol; la función devuelta descarta la respuesta
+  // si el componente se desmonta o el árbol cambia antes de que llegue
+  const showTree = (tree, ref, method) => {
+    let cancelled = false;
+    setErrors(prev => ({ ...prev, [method]: '' }));
+    loadTree(tree)
+      .then(data => {
+        if (!cancelled) drawTree(ref.current, data, method.toUpperCase());
+      })
+      .catch(err => {
+        if (cancelled) return;
+        console.error(`Error loading ${method} tree:`, err);
+        if (ref.current) d3.select(ref.current).selectAll("*").remove();
+        setErrors(prev => ({
+          ...prev,
+          [method]: err.response?.data?.error || err.message ||
+                    `Error cargando árbol ${method.toUpperCase()}.`
+        }));
+      });
+    return () => { cancelled = true; };
+  };
 
   useEffect(() => {
     if (trees.nj) {
-      drawTree(njTreeRef.current, trees.nj.tree_json, 'NJ');
+      return showTree(trees.nj, njTreeRef, 'nj');
     }
   }, [trees.nj]);
 
   useEffect(() => {
     if (trees.ml) {
-      drawTree(mlTreeRef.current, trees.ml.tree_json, 'ML');
+      return showTree(trees.ml, mlTreeRef, 'ml');
     }
   }, [trees.ml]);
 
@@ -109,6 +176,7 @@ const TreeVisualization = ({ trees }) => {
       <div className="grid grid-cols-1 lg:grid-cols-2 gap-6">
         {trees.nj && (
           <div className="border border-gray-200 rounded-lg p-4">
+            <TreeError error={errors.nj} />
             <div ref={njTreeRef}></div>
             <div className="mt-3 text-sm text-gray-600">
               <p><strong>Neighbor-Joining:</strong> Método de distancia rápido</p>
@@ -119,6 +187,7 @@ const TreeVisualization = ({ trees }) => {
 
         {trees.ml && (
           <div className="border border-gray-200 rounded-lg p-4">
+            <TreeError error={errors.ml} />
             <div ref={mlTreeRef}></div>
             <div className="mt-3 text-sm text-gray-600">
               <p><strong>Máxima Verosimilitud:</strong> Método probabilístico</p>
@@ -142,4 +211,17 @@ const TreeVisualization = ({ trees }) => {
   );
 };
 
+const TreeError = ({ error }) => {
+  if (!error) return null;
+  return (
+    <div className="mb-3 p-3 bg-red-50 rounded-lg flex items-start space-x-3">
+      <AlertCircle className="h-5 w-5 text-red-500 mt-0.5 flex-shrink-0" />
+      <div>
+        <p className="text-red-900 text-sm font-medium">Error</p>
+        <p className="text-red-700 text-xs">{error}</p>
+      </div>
+    </div>
+  );
+};
+
 export default TreeVisualization;
@@ -87,6 +87,12 @@ export const phylogenyAPI = {
       return response.data;
    },
 
+   // Obtener árbol en JSON plano (todo, o el subárbol de `node` hasta `depth` niveles)
+   getTreeJson: async (url, params = {}) => {
+      const response = await api.get(url, { params });
+      return response.data;
+   },
+
    // Obtener información de sesión
    getSessionInfo: async (sessionId) => {
       const response = await api.get(`/api/session/${sessionId}`);